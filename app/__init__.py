@@ -8,8 +8,10 @@ from config import Config
 import jinja2
 import markupsafe
 
+from app.replica import RoutingSession
+
 # Initialize Flask extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 migrate = Migrate()
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
@@ -21,6 +23,10 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     
+    # Pool settings for server databases
+    from app.database import configure_engine
+    configure_engine(app)
+    
     # Initialize extensions with the app
     db.init_app(app)
     migrate.init_app(app, db)
@@ -28,6 +34,9 @@ def create_app(config_class=Config):
     mail.init_app(app)
     bcrypt.init_app(app)
     
+    # Flask-Login user loader backed by the identity cache
+    from app import identity
+    
     # Register blueprints
     from app.auth import bp as auth_bp
     app.register_blueprint(auth_bp, url_prefix='/auth')
@@ -61,6 +70,34 @@ def create_app(config_class=Config):
     from app.errors import bp as errors_bp
     app.register_blueprint(errors_bp)
     
+    # Rollup tables and their maintenance commands
+    from app.rollups import rollups_cli
+    app.cli.add_command(rollups_cli)
+    
+    # Full-text search index
+    from app.search import search_cli
+    app.cli.add_command(search_cli)
+    
+    # Secondary indexes and query plan checks
+    from app.indexes import indexes_cli
+    app.cli.add_command(indexes_cli)
+    
+    # SQLite pragmas and maintenance commands
+    from app.sqlite import sqlite_cli, configure_sqlite
+    app.cli.add_command(sqlite_cli)
+    
+    # Read replica status and syncing
+    from app.replica import replica_cli, configure_replica
+    app.cli.add_command(replica_cli)
+    
+    # Business calendars SLA due dates are counted in
+    from app.calendars import calendars_cli
+    app.cli.add_command(calendars_cli)
+    
+    # Stored SLA states and their periodic evaluation
+    from app.sla import sla_cli, configure_sla
+    app.cli.add_command(sla_cli)
+    
     # Add custom Jinja2 filters
     @app.template_filter('nl2br')
     def nl2br(value):
@@ -72,7 +109,15 @@ def create_app(config_class=Config):
     
     # Create database tables on first run
     with app.app_context():
+        configure_sqlite(app)
         db.create_all()
+
+        # create_all() never adds columns to existing tables; add them before anything queries them
+        from app.schema import add_missing_columns
+        added = add_missing_columns()
+        if added:
+            app.logger.info(f'Added columns: {", ".join(added)}')
+
         from app.models import User, Role
         
         # Create default roles if they don't exist
@@ -83,6 +128,12 @@ def create_app(config_class=Config):
         if not Role.query.filter_by(name='Agent').first():
             agent_role = Role(name='Agent', description='Can manage tickets and knowledge base')
             db.session.add(agent_role)
+        
+        # Roles from before permissions were stored get the defaults for their name;
+        # add_missing_columns() above has added role.permissions to such databases as NULL
+        from app.permissions import default_permissions
+        for role in Role.query.filter(Role.permissions.is_(None)):
+            role.permissions = default_permissions(role.name)
             
         # Create default admin user if no users exist
         if not User.query.first():
@@ -100,5 +151,22 @@ def create_app(config_class=Config):
             db.session.add(admin_user)
             
         db.session.commit()
+        
+        # Rebuilding rollups first clears any duplicate keys before their unique indexes are added
+        from app.rollups import seed_empty_rollups
+        seed_empty_rollups()
+        
+        # create_all() skips indexes on tables that already exist
+        from app.indexes import create_missing_indexes
+        create_missing_indexes()
+        
+        from app.search import ensure_search_index
+        ensure_search_index(app)
+        
+        from app.typeahead import typeahead_index
+        typeahead_index.rebuild()
+        
+        configure_sla(app)
+        configure_replica(app)
     
     return app
@@ -0,0 +1,24 @@
+"""
+Filter criteria shared by the asset list and its export.
+"""
+from app.models import Asset
+
+
+def asset_filter_criteria(args):
+    """SQL criteria for the type/status/assignee filters in ``args``."""
+    criteria = []
+
+    asset_type = args.get('asset_type', '')
+    status = args.get('status', '')
+    assigned_to = args.get('assigned_to', type=int, default=0)
+
+    if asset_type:
+        criteria.append(Asset.asset_type == asset_type)
+
+    if status:
+        criteria.append(Asset.status == status)
+
+    if assigned_to > 0:
+        criteria.append(Asset.assigned_to_id == assigned_to)
+
+    return criteria
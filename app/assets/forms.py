@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, TextAreaField, SelectField, DateField, SubmitField
 from wtforms.validators import DataRequired, Optional, Length
-from app.models import User
+from app.choices import RemoteSelectField, USER_CHOICES
 
 class AssetForm(FlaskForm):
     name = StringField('Asset Name', validators=[DataRequired(), Length(max=128)])
@@ -22,15 +22,9 @@ class AssetForm(FlaskForm):
         ('maintenance', 'Under Maintenance'),
         ('retired', 'Retired')
     ], validators=[DataRequired()])
-    assigned_to_id = SelectField('Assigned To', coerce=int, validators=[Optional()])
+    assigned_to_id = RemoteSelectField('Assigned To', validators=[Optional()], source=USER_CHOICES, blank=(0, 'Unassigned'))
     notes = TextAreaField('Notes', validators=[Optional()])
     submit = SubmitField('Save Asset')
-    
-    def __init__(self, *args, **kwargs):
-        super(AssetForm, self).__init__(*args, **kwargs)
-        self.assigned_to_id.choices = [(0, 'Unassigned')] + [
-            (u.id, u.full_name) for u in User.query.filter(User.is_active == True).all()
-        ]
 
 class AssetFilterForm(FlaskForm):
     asset_type = SelectField('Asset Type', choices=[
@@ -49,9 +43,5 @@ class AssetFilterForm(FlaskForm):
         ('maintenance', 'Under Maintenance'),
         ('retired', 'Retired')
     ], validators=[Optional()])
-    assigned_to = SelectField('Assigned To', coerce=int, validators=[Optional()])
+    assigned_to = RemoteSelectField('Assigned To', validators=[Optional()], source=USER_CHOICES, blank=(0, 'All'))
     submit = SubmitField('Filter')
-    
-    def __init__(self, *args, **kwargs):
-        super(AssetFilterForm, self).__init__(*args, **kwargs)
-        self.assigned_to.choices = [(0, 'All')] + [(u.id, u.full_name) for u in User.query.filter(User.is_active == True).all()]
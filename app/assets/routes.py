@@ -3,32 +3,21 @@ from flask_login import login_required, current_user
 from app import db
 from app.assets import bp
 from app.assets.forms import AssetForm, AssetFilterForm
+from app.assets.filters import asset_filter_criteria
+from app.export import csv_response, stream_rows
+from app.replica import read_only
 from app.models import Asset, User, Ticket
 from datetime import datetime, timedelta
 from app.settings.routes import admin_required
+from sqlalchemy import select
 
 @bp.route('/')
 @login_required
 def index():
     form = AssetFilterForm()
     
-    # Get filter parameters
-    asset_type = request.args.get('asset_type', '')
-    status = request.args.get('status', '')
-    assigned_to = request.args.get('assigned_to', type=int, default=0)
-    
-    # Base query
-    query = Asset.query
-    
-    # Apply filters
-    if asset_type:
-        query = query.filter(Asset.asset_type == asset_type)
-    
-    if status:
-        query = query.filter(Asset.status == status)
-    
-    if assigned_to > 0:
-        query = query.filter(Asset.assigned_to_id == assigned_to)
+    # Apply the type, status and assignee filters
+    query = Asset.query.filter(*asset_filter_criteria(request.args))
     
     # Get assets
     assets = query.order_by(Asset.name).all()
@@ -56,6 +45,22 @@ def index():
                           maintenance_assets=maintenance_assets,
                           expiring_warranty=expiring_warranty)
 
+@bp.route('/export.csv')
+@login_required
+@read_only
+def export():
+    # Same filters as the asset list, streamed as CSV
+    statement = (select(Asset.id, Asset.name, Asset.asset_type, Asset.serial_number, Asset.status,
+                        User.username, Asset.purchase_date, Asset.warranty_expiry, Asset.notes,
+                        Asset.created_at, Asset.updated_at)
+                 .outerjoin(User, Asset.assigned_to_id == User.id)
+                 .where(*asset_filter_criteria(request.args))
+                 .order_by(Asset.name))
+    return csv_response('assets.csv',
+                        ['ID', 'Name', 'Type', 'Serial Number', 'Status', 'Assigned To',
+                         'Purchase Date', 'Warranty Expiry', 'Notes', 'Created', 'Updated'],
+                        stream_rows(statement))
+
 @bp.route('/create', methods=['GET', 'POST'])
 @login_required
 def create():
@@ -67,12 +67,13 @@ def change_password():
     form = ChangePasswordForm()
     
     if form.validate_on_submit():
-        if not current_user.check_password(form.current_password.data):
+        user = current_user.load()
+        if not user.check_password(form.current_password.data):
             flash('Current password is incorrect', 'danger')
             return redirect(url_for('auth.change_password'))
         
-        current_user.set_password(form.new_password.data)
-        current_user.force_password_change = False
+        user.set_password(form.new_password.data)
+        user.force_password_change = False
         db.session.commit()
         
         flash('Your password has been updated', 'success')
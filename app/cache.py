@@ -0,0 +1,201 @@
+"""
+Process-local caches for expensive, read-mostly page data.
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from app import db
+from app.models import CacheVersion
+from app.rollups import bump
+
+
+class SnapshotCache:
+    """Keeps one computed value per key and refreshes it stale-while-revalidate.
+
+    A fresh entry is returned as is. Once an entry is older than the TTL (or
+    has been invalidated) it is still returned, while a single background
+    thread recomputes it. Only a key that has never been computed is built
+    in the calling request.
+
+    At most ``max_entries`` keys are kept, least recently read first out,
+    and entries not read for ``EXPIRY_TTLS`` TTLs are dropped when storing,
+    so per-audience keys don't accumulate for the life of the process.
+    """
+
+    # Entries unread for this many TTLs are dropped rather than refreshed
+    EXPIRY_TTLS = 5
+
+    def __init__(self, loader, ttl_config_key, default_ttl=60, max_entries=1000):
+        self.loader = loader
+        self.ttl_config_key = ttl_config_key
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, stored_at), least recently read first
+        self._last_read = {}
+        self._refreshing = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _ttl(self, app):
+        return app.config.get(self.ttl_config_key, self.default_ttl)
+
+    def get(self, key):
+        app = current_app._get_current_object()
+        ttl = self._ttl(app)
+        if not ttl:
+            return self.loader(key)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._last_read[key] = time.monotonic()
+        if entry is None:
+            generation = self._generation
+            value = self.loader(key)
+            self._store(key, value, generation, ttl)
+            return value
+
+        value, stored_at = entry
+        if time.monotonic() - stored_at >= ttl:
+            self._refresh_in_background(app, key)
+        return value
+
+    def _store(self, key, value, generation, ttl):
+        with self._lock:
+            # Drop results computed before an invalidation that raced with them
+            if generation != self._generation:
+                return
+            now = time.monotonic()
+            self._entries[key] = (value, now)
+            self._entries.move_to_end(key)
+            self._last_read.setdefault(key, now)
+            expired = [old for old, read_at in self._last_read.items() if now - read_at > ttl * self.EXPIRY_TTLS]
+            for old in expired:
+                self._entries.pop(old, None)
+                del self._last_read[old]
+            while len(self._entries) > self.max_entries:
+                old, _ = self._entries.popitem(last=False)
+                self._last_read.pop(old, None)
+
+    def _refresh_in_background(self, app, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                with app.app_context():
+                    generation = self._generation
+                    self._store(key, self.loader(key), generation, self._ttl(app))
+            except Exception:
+                app.logger.exception(f'Error refreshing cached snapshot {key!r}')
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def invalidate(self):
+        """Mark every entry stale so the next read triggers a refresh."""
+        with self._lock:
+            self._generation += 1
+            self._entries = OrderedDict((key, (value, float('-inf'))) for key, (value, _) in self._entries.items())
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries = OrderedDict()
+            self._last_read = {}
+
+
+def bump_version(connection, name):
+    """Advance the shared version stamp ``name`` within the current transaction."""
+    bump(connection, CacheVersion.__table__, {'name': name}, version=1)
+
+
+class VersionedCache(ABC):
+    """Process-wide data reloaded whenever its shared version stamp changes.
+
+    Subclasses implement ``load()`` and call ``watch()`` with the models the
+    data comes from. The stamp is read at most once every
+    ``check_interval_key`` seconds, so other processes' writes show up within
+    that interval; writes committed by this process are seen immediately.
+    """
+
+    def __init__(self, name, check_interval_key, default_interval=5):
+        self.name = name
+        self.check_interval_key = check_interval_key
+        self.default_interval = default_interval
+        self._data = None
+        self._version = None
+        self._next_check = 0
+        self._watched = ()
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def load(self):
+        """Read the data from the database."""
+
+    def _read_version(self):
+        return db.session.execute(
+            select(CacheVersion.version).where(CacheVersion.name == self.name)
+        ).scalar() or 0
+
+    def data(self):
+        now = time.monotonic()
+        if self._data is not None and now < self._next_check:
+            return self._data
+
+        interval = current_app.config.get(self.check_interval_key, self.default_interval)
+        version = self._read_version()
+        with self._lock:
+            if self._data is not None and version == self._version:
+                self._next_check = now + interval
+                return self._data
+
+        data = self.load()
+        with self._lock:
+            self._data = data
+            self._version = version
+            self._next_check = now + interval
+        return data
+
+    def invalidate(self):
+        self._next_check = 0
+
+    def watch(self, *models):
+        """Bump the version on every write to ``models`` and reload after local commits."""
+        for model in models:
+            for event_name in ('after_insert', 'after_update', 'after_delete'):
+                event.listen(model, event_name, self._bump_on_write)
+        self._watched = models
+        event.listen(Session, 'after_flush', self._note_writes)
+        event.listen(Session, 'after_commit', self._invalidate_after_commit)
+        event.listen(Session, 'after_rollback', self._forget_writes)
+
+    def _bump_on_write(self, mapper, connection, target):
+        bump_version(connection, self.name)
+
+    def _note_writes(self, session, flush_context):
+        changed = list(session.new) + list(session.dirty) + list(session.deleted)
+        if any(isinstance(instance, self._watched) for instance in changed):
+            session.info[f'{self.name}_changed'] = True
+
+    def _invalidate_after_commit(self, session):
+        if session.info.pop(f'{self.name}_changed', False):
+            self.invalidate()
+
+    def _forget_writes(self, session):
+        session.info.pop(f'{self.name}_changed', None)
+
+    def clear(self):
+        with self._lock:
+            self._data = None
+            self._version = None
+            self._next_check = 0
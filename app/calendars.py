@@ -0,0 +1,328 @@
+"""
+Business calendars for SLA due dates.
+
+A calendar has weekly working hours in its own time zone and a list of
+holidays. Priorities may name a calendar; the others use the default one,
+and with no calendars at all SLA times run around the clock.
+
+Due dates are not found by stepping through the clock. For a range of days
+each calendar is compiled once into its working intervals in UTC and the
+working seconds elapsed before each of them. The working offset of any
+instant and the instant at which an offset is reached are then binary
+searches over those arrays, so adding N working minutes costs O(log n)
+however long N is, and ``add_many`` computes due dates for whole batches of
+tickets against one compiled table. Tables grow to cover the dates asked
+for and are rebuilt when a calendar, its hours or holidays change.
+"""
+import re
+import threading
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, namedtuple
+from datetime import datetime, time, timedelta
+import click
+import pytz
+from flask.cli import AppGroup
+from sqlalchemy import select
+from app import db
+from app.cache import VersionedCache
+from app.models import BusinessCalendar, BusinessHours, CalendarHoliday, TicketPriority
+from app.reference import reference
+
+calendars_cli = AppGroup('calendars', help='Manage the business calendars SLA times are counted in.')
+
+CALENDARS_VERSION = 'calendars'
+
+# Instants are handled as seconds since this naive UTC epoch
+EPOCH = datetime(1970, 1, 1)
+
+# Days compiled ahead of the latest start asked for, and kept before the earliest
+LOOKAHEAD_DAYS = 366
+LOOKBEHIND_DAYS = 7
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+DEFAULT_HOURS = ('mon-fri 09:00-17:00',)
+
+# Calendar changes apply to new tickets; open ones keep their due dates until recalculated
+RECALCULATE_HINT = 'Run `flask sla recalculate` to update the due dates of open tickets.'
+
+
+def _seconds(moment):
+    return (moment - EPOCH).total_seconds()
+
+
+def _moment(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+
+class AlwaysOpen:
+    """The calendar used when none is configured: every minute is a working minute."""
+
+    def add(self, start, minutes):
+        return start + timedelta(minutes=minutes)
+
+    def add_many(self, starts, minutes):
+        return [self.add(start, minutes) for start in starts]
+
+
+ALWAYS_OPEN = AlwaysOpen()
+
+
+# A compiled range of days. ``starts`` and ``ends`` bound each working interval
+# in UTC seconds; ``offsets`` and ``reached`` are the working seconds elapsed
+# at its start and end.
+_Table = namedtuple('_Table', 'first_day last_day starts ends offsets reached')
+
+
+class WorkingCalendar:
+    """Weekly hours and holidays compiled into searchable working-interval tables."""
+
+    def __init__(self, timezone, hours, holidays):
+        self.timezone = pytz.timezone(timezone)
+        self.hours = hours  # weekday -> sorted [(start_minute, end_minute)]
+        self.holidays = frozenset(holidays)
+        self._table = None
+        self._lock = threading.Lock()
+
+    def _utc_seconds(self, day, minute):
+        local = datetime.combine(day, time()) + timedelta(minutes=minute)
+        return _seconds(self.timezone.localize(local, is_dst=False).astimezone(pytz.utc).replace(tzinfo=None))
+
+    def _compile(self, first_day, last_day):
+        starts, ends, offsets, reached = [], [], [], []
+        elapsed = 0
+        day = first_day
+        while day <= last_day:
+            if day not in self.holidays:
+                for start_minute, end_minute in self.hours.get(day.weekday(), ()):
+                    start = self._utc_seconds(day, start_minute)
+                    end = self._utc_seconds(day, end_minute)
+                    if end <= start:
+                        continue
+                    starts.append(start)
+                    ends.append(end)
+                    offsets.append(elapsed)
+                    elapsed += end - start
+                    reached.append(elapsed)
+            day += timedelta(days=1)
+        return _Table(first_day, last_day, starts, ends, offsets, reached)
+
+    def _cover(self, first, last):
+        """A table spanning the days of the instants ``first`` to ``last``."""
+        first_day = first.date() - timedelta(days=LOOKBEHIND_DAYS)
+        last_day = last.date() + timedelta(days=LOOKAHEAD_DAYS)
+        with self._lock:
+            table = self._table
+            if table is not None:
+                if table.first_day <= first_day and last_day <= table.last_day:
+                    return table
+                first_day = min(first_day, table.first_day)
+                last_day = max(last_day, table.last_day)
+            self._table = self._compile(first_day, last_day)
+            return self._table
+
+    def _extend(self, table):
+        """A table twice as long as ``table``, for targets beyond its end."""
+        span = table.last_day - table.first_day
+        if span > timedelta(days=LOOKAHEAD_DAYS * 100):
+            raise ValueError('Business calendar has no working hours to count SLA time in')
+        return self._cover(datetime.combine(table.first_day, time()) + timedelta(days=LOOKBEHIND_DAYS),
+                           datetime.combine(table.last_day, time()) + span)
+
+    @staticmethod
+    def _offset(table, seconds):
+        """Working seconds between the start of ``table`` and ``seconds``."""
+        index = bisect_right(table.starts, seconds) - 1
+        if index < 0:
+            return 0
+        return table.offsets[index] + min(seconds, table.ends[index]) - table.starts[index]
+
+    def _due(self, table, start, minutes):
+        if minutes <= 0:
+            return start
+        seconds = _seconds(start)
+        while True:
+            target = self._offset(table, seconds) + minutes * 60
+            if table.reached and target <= table.reached[-1]:
+                break
+            table = self._extend(table)
+        index = bisect_left(table.reached, target)
+        return _moment(table.starts[index] + target - table.offsets[index])
+
+    def add(self, start, minutes):
+        """The instant ``minutes`` working minutes after the naive UTC ``start``."""
+        return self._due(self._cover(start, start), start, minutes)
+
+    def add_many(self, starts, minutes):
+        """``add(start, minutes)`` for each of ``starts``, against one compiled table."""
+        starts = list(starts)
+        if not starts:
+            return []
+        table = self._cover(min(starts), max(starts))
+        return [self._due(table, start, minutes) for start in starts]
+
+
+Calendars = namedtuple('Calendars', 'by_id default')
+
+
+class CalendarRegistry(VersionedCache):
+    def __init__(self):
+        super().__init__(CALENDARS_VERSION, 'SETTINGS_VERSION_CHECK_INTERVAL')
+
+    def load(self):
+        hours = defaultdict(lambda: defaultdict(list))
+        for row in db.session.execute(select(BusinessHours.calendar_id, BusinessHours.weekday,
+                                             BusinessHours.start_minute, BusinessHours.end_minute)):
+            hours[row.calendar_id][row.weekday].append((row.start_minute, row.end_minute))
+        holidays = defaultdict(list)
+        for calendar_id, day in db.session.execute(select(CalendarHoliday.calendar_id, CalendarHoliday.date)):
+            holidays[calendar_id].append(day)
+
+        by_id = {}
+        default = ALWAYS_OPEN
+        for row in db.session.execute(select(BusinessCalendar.id, BusinessCalendar.timezone,
+                                             BusinessCalendar.is_default).order_by(BusinessCalendar.id)):
+            calendar_hours = {weekday: sorted(spans) for weekday, spans in hours[row.id].items()}
+            # A calendar without hours would never reach a due date
+            calendar = (WorkingCalendar(row.timezone or 'UTC', calendar_hours, holidays[row.id])
+                        if calendar_hours else ALWAYS_OPEN)
+            by_id[row.id] = calendar
+            if row.is_default:
+                default = calendar
+        return Calendars(by_id, default)
+
+    def get(self, calendar_id):
+        data = self.data()
+        return data.by_id.get(calendar_id, data.default)
+
+    def for_priority(self, priority_id):
+        """The calendar SLA times of tickets with ``priority_id`` are counted in."""
+        priority = reference.priority_by_id.get(priority_id)
+        return self.get(priority.calendar_id if priority else None)
+
+
+calendars = CalendarRegistry()
+calendars.watch(BusinessCalendar, BusinessHours, CalendarHoliday)
+
+
+_HOURS_PATTERN = re.compile(r'^(\w{3})(?:-(\w{3}))?\s+(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})$')
+
+
+def parse_hours(spec):
+    """[(weekday, start_minute, end_minute)] from e.g. 'mon-fri 09:00-17:00'."""
+    match = _HOURS_PATTERN.match(spec.strip().lower())
+    if not match or match.group(1) not in WEEKDAYS or (match.group(2) or match.group(1)) not in WEEKDAYS:
+        raise ValueError(f'Expected hours like "mon-fri 09:00-17:00", got {spec!r}')
+    first = WEEKDAYS.index(match.group(1))
+    last = WEEKDAYS.index(match.group(2) or match.group(1))
+    start = int(match.group(3)) * 60 + int(match.group(4))
+    end = int(match.group(5)) * 60 + int(match.group(6))
+    if not 0 <= start < end <= 24 * 60:
+        raise ValueError(f'Working hours must fall within one day, got {spec!r}')
+    if last < first:
+        raise ValueError(f'Weekday range must run from Monday towards Sunday, got {spec!r}')
+    return [(weekday, start, end) for weekday in range(first, last + 1)]
+
+
+def _format_minute(minute):
+    return f'{minute // 60:02d}:{minute % 60:02d}'
+
+
+def _get_calendar(name):
+    calendar = BusinessCalendar.query.filter_by(name=name).first()
+    if calendar is None:
+        raise click.ClickException(f'No calendar named {name!r}')
+    return calendar
+
+
+@calendars_cli.command('list')
+def list_calendars():
+    """Show the calendars, their hours, holidays and priorities."""
+    for calendar in BusinessCalendar.query.order_by(BusinessCalendar.name):
+        default = ' (default)' if calendar.is_default else ''
+        click.echo(f'{calendar.name}{default} [{calendar.timezone}]')
+        for hours in calendar.hours.order_by(BusinessHours.weekday, BusinessHours.start_minute):
+            click.echo(f'  {WEEKDAYS[hours.weekday]} '
+                       f'{_format_minute(hours.start_minute)}-{_format_minute(hours.end_minute)}')
+        for holiday in calendar.holidays.order_by(CalendarHoliday.date):
+            click.echo(f'  holiday {holiday.date} {holiday.name or ""}'.rstrip())
+        priorities = ', '.join(priority.name for priority in calendar.priorities)
+        if priorities:
+            click.echo(f'  priorities: {priorities}')
+
+
+@calendars_cli.command('create')
+@click.argument('name')
+@click.option('--timezone', default='UTC', show_default=True, help='Time zone the hours are in.')
+@click.option('--hours', 'hour_specs', multiple=True, help='Working hours, e.g. "mon-fri 09:00-17:00". Repeatable.')
+@click.option('--default', 'is_default', is_flag=True, help='Use for priorities without a calendar.')
+def create_calendar(name, timezone, hour_specs, is_default):
+    """Create or replace a calendar's time zone and working hours."""
+    if timezone not in pytz.all_timezones_set:
+        raise click.BadParameter(f'Unknown time zone {timezone!r}', param_hint='--timezone')
+    try:
+        spans = [span for spec in (hour_specs or DEFAULT_HOURS) for span in parse_hours(spec)]
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--hours')
+
+    calendar = BusinessCalendar.query.filter_by(name=name).first()
+    if calendar is None:
+        calendar = BusinessCalendar(name=name)
+        db.session.add(calendar)
+    calendar.timezone = timezone
+    calendar.hours.delete()
+    for weekday, start, end in spans:
+        calendar.hours.append(BusinessHours(weekday=weekday, start_minute=start, end_minute=end))
+    if is_default:
+        BusinessCalendar.query.filter(BusinessCalendar.name != name).update({'is_default': False})
+        calendar.is_default = True
+    db.session.commit()
+    click.echo(f'Saved calendar {name!r}. {RECALCULATE_HINT}')
+
+
+@calendars_cli.command('holiday')
+@click.argument('name')
+@click.argument('day', type=click.DateTime(formats=['%Y-%m-%d']))
+@click.option('--label', help='Name of the holiday.')
+@click.option('--remove', is_flag=True, help='Remove the holiday instead.')
+def holiday(name, day, label, remove):
+    """Add (or remove) a holiday on DAY (YYYY-MM-DD) in a calendar."""
+    calendar = _get_calendar(name)
+    existing = calendar.holidays.filter_by(date=day.date()).first()
+    if remove:
+        if existing:
+            db.session.delete(existing)
+    elif existing:
+        existing.name = label
+    else:
+        calendar.holidays.append(CalendarHoliday(date=day.date(), name=label))
+    db.session.commit()
+    click.echo(RECALCULATE_HINT)
+
+
+@calendars_cli.command('assign')
+@click.argument('priority')
+@click.argument('name', required=False)
+def assign(priority, name):
+    """Count PRIORITY's SLA times in calendar NAME (the default calendar if omitted)."""
+    ticket_priority = TicketPriority.query.filter_by(name=priority).first()
+    if ticket_priority is None:
+        raise click.ClickException(f'No priority named {priority!r}')
+    ticket_priority.calendar_id = _get_calendar(name).id if name else None
+    db.session.commit()
+    click.echo(RECALCULATE_HINT)
+
+
+@calendars_cli.command('due')
+@click.argument('priority')
+@click.option('--start', type=click.DateTime(), help='UTC start time; now if omitted.')
+def due(priority, start):
+    """Show the SLA due dates a new PRIORITY ticket would get."""
+    ticket_priority = TicketPriority.query.filter_by(name=priority).first()
+    if ticket_priority is None:
+        raise click.ClickException(f'No priority named {priority!r}')
+    start = start or datetime.utcnow()
+    calendar = calendars.for_priority(ticket_priority.id)
+    for label, minutes in (('response', ticket_priority.sla_response_time),
+                           ('resolution', ticket_priority.sla_resolution_time)):
+        if minutes:
+            click.echo(f'{label}: {calendar.add(start, minutes):%Y-%m-%d %H:%M} UTC')
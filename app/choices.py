@@ -0,0 +1,101 @@
+"""
+Remote-loaded choices for pickers over large tables (users, assets).
+
+Forms render only the blank option and the current selection; the browser
+fetches further options page by page from the JSON choice endpoints, and a
+submitted id is validated with a single primary-key lookup.
+"""
+from flask import request, url_for
+from sqlalchemy import or_
+from wtforms import SelectField
+from wtforms.validators import ValidationError
+from app import db
+from app.models import User, Asset
+from app.pagination import keyset_paginate, per_page_from_request
+
+
+class ChoiceSource:
+    def __init__(self, model, endpoint, label, search_columns, order_column, accepts=None, criteria=None):
+        self.model = model
+        self.endpoint = endpoint
+        self.label = label
+        self.search_columns = search_columns
+        self.order_column = order_column
+        self.accepts = accepts or (lambda record: True)
+        self.criteria = criteria or ()
+
+    def get(self, record_id):
+        """The selectable record with ``record_id``, or None."""
+        record = db.session.get(self.model, record_id)
+        return record if record is not None and self.accepts(record) else None
+
+    def page(self):
+        """One page of options matching ``?q=``, as JSON-ready data."""
+        query = self.model.query.filter(*self.criteria)
+        term = request.args.get('q', '').strip()
+        if term:
+            query = query.filter(or_(*[column.istartswith(term, autoescape=True) for column in self.search_columns]))
+        page = keyset_paginate(query, 'name', self.order_column, self.model.id,
+                               descending=False,
+                               per_page=per_page_from_request('CHOICES_PER_PAGE'),
+                               cursor=request.args.get('cursor'),
+                               nullable=True)
+        return {
+            'results': [{'id': record.id, 'text': self.label(record)} for record in page.items],
+            'next_cursor': page.next_cursor,
+        }
+
+
+def user_label(user):
+    return f'{user.full_name} ({user.username})'
+
+
+def asset_label(asset):
+    return f'{asset.name} ({asset.asset_type})'
+
+
+USER_CHOICES = ChoiceSource(
+    User, 'main.user_choices', user_label,
+    search_columns=(User.username, User.email, User.first_name, User.last_name),
+    order_column=User.username,
+    accepts=lambda user: user.is_active,
+    criteria=(User.is_active == True,)
+)
+
+ASSET_CHOICES = ChoiceSource(
+    Asset, 'main.asset_choices', asset_label,
+    search_columns=(Asset.name, Asset.serial_number),
+    order_column=Asset.name
+)
+
+
+class RemoteSelectField(SelectField):
+    """Integer select whose options come from a ChoiceSource endpoint."""
+
+    def __init__(self, label=None, validators=None, source=None, blank=(0, ''), **kwargs):
+        kwargs.setdefault('coerce', int)
+        super().__init__(label, validators, choices=[blank], **kwargs)
+        self.source = source
+        self.blank = blank
+
+    def _selected(self):
+        if self.data is None or self.data == self.blank[0]:
+            return None
+        return self.source.get(self.data)
+
+    def iter_choices(self):
+        choices = [self.blank]
+        record = self._selected()
+        if record is not None:
+            choices.append((record.id, self.source.label(record)))
+        return self._choices_generator(choices)
+
+    def pre_validate(self, form):
+        if self.data is None or self.data == self.blank[0]:
+            return
+        if self._selected() is None:
+            raise ValidationError(self.gettext('Not a valid choice.'))
+
+    def __call__(self, **kwargs):
+        kwargs.setdefault('data_choices_url', url_for(self.source.endpoint))
+        return super().__call__(**kwargs)
@@ -1,16 +1,16 @@
 from flask import g
-from app.models import Setting
+from app.settings.service import settings
+from app.reference import reference
+from app.permissions import Permission
 
 def inject_settings():
     """
     Inject settings into the application context.
     This makes settings available to all templates.
     """
-    # Get theme setting
-    theme_setting = Setting.query.filter_by(key='theme').first()
-    if theme_setting:
-        g.theme = theme_setting.value
-    else:
-        g.theme = 'light'  # Default to light mode
+    # Get theme setting from the process-wide settings cache
+    g.theme = settings.get('theme', 'light')  # Default to light mode
     
-    return {}
+    # Cached statuses, priorities, types and roles for id lookups in templates
+    # Permission flags for current_user.can() checks in templates
+    return {'reference': reference, 'Permission': Permission}
@@ -0,0 +1,56 @@
+"""
+Database portability: engine options per backend and SQL constructs that
+compile differently on SQLite and on server databases such as PostgreSQL.
+"""
+from sqlalchemy import Date
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+
+def database_uri(uri):
+    """``uri`` with the legacy ``postgres://`` scheme renamed for SQLAlchemy."""
+    if uri and uri.startswith('postgres://'):
+        return 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def configure_engine(app):
+    """Fill in SQLALCHEMY_ENGINE_OPTIONS for the configured database.
+
+    Connection pool settings only apply to server databases; SQLite keeps
+    Flask-SQLAlchemy's defaults. Options set explicitly in the config win.
+    """
+    uri = database_uri(app.config.get('SQLALCHEMY_DATABASE_URI'))
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    binds = app.config.get('SQLALCHEMY_BINDS') or {}
+    app.config['SQLALCHEMY_BINDS'] = {key: database_uri(value) if isinstance(value, str) else value
+                                      for key, value in binds.items()}
+    if not uri or uri.startswith('sqlite'):
+        return
+
+    options = {
+        'pool_size': app.config.get('DB_POOL_SIZE', 10),
+        'max_overflow': app.config.get('DB_MAX_OVERFLOW', 20),
+        'pool_timeout': app.config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': app.config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': app.config.get('DB_POOL_PRE_PING', True),
+    }
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+class day_of(FunctionElement):
+    """The calendar date of a datetime column, for grouping rows by day."""
+    type = Date()
+    inherit_cache = True
+
+
+@compiles(day_of)
+def _day_of(element, compiler, **kw):
+    return f'CAST({compiler.process(element.clauses, **kw)} AS DATE)'
+
+
+@compiles(day_of, 'sqlite')
+def _day_of_sqlite(element, compiler, **kw):
+    # SQLite stores datetimes as text; CAST would keep only the year
+    return f'date({compiler.process(element.clauses, **kw)})'
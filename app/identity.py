@@ -0,0 +1,155 @@
+"""
+Flask-Login user loading from an in-process identity cache.
+
+Each request's ``current_user`` is a ``Principal``: an immutable snapshot
+of the user's id, names, role, permission bits and flags, read together with the role in
+one joined query and kept for ``IDENTITY_CACHE_TTL`` seconds. Changes to a
+user's role, status or names, and any change to the roles, bump the shared
+'identity' version stamp, so deactivated users are signed out and new roles
+apply on the next request (within the version check interval for other
+processes).
+
+Code that writes to the signed-in user loads the ORM row with
+``current_user.load()``.
+"""
+import threading
+import time
+from flask import current_app
+from flask_login import AnonymousUserMixin
+from sqlalchemy import inspect, select
+from app import db, login_manager
+from app.cache import VersionedCache
+from app.models import User, Role
+from app.permissions import Permission
+from app.reference import RoleRef
+
+IDENTITY_VERSION = 'identity'
+
+# User columns copied into the principal; writes to any other column
+# (password hash, last login) leave cached principals in place
+PRINCIPAL_COLUMNS = ('id', 'username', 'email', 'first_name', 'last_name',
+                     'role_id', 'is_active', 'force_password_change')
+
+
+class Principal:
+    """Read-only stand-in for the signed-in ``User``."""
+    __slots__ = PRINCIPAL_COLUMNS + ('role', 'permissions')
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, role, **columns):
+        object.__setattr__(self, 'role', role)
+        object.__setattr__(self, 'permissions', (role.permissions or 0) if role else 0)
+        for name in PRINCIPAL_COLUMNS:
+            object.__setattr__(self, name, columns[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is read-only; use load() to change the user')
+
+    @property
+    def full_name(self):
+        return f"{self.first_name} {self.last_name}"
+
+    def can(self, permission):
+        return self.permissions & permission == permission
+
+    def is_administrator(self):
+        return self.can(Permission.ADMIN_SETTINGS)
+
+    def get_id(self):
+        return str(self.id)
+
+    def load(self):
+        """The ``User`` row for this principal, attached to the current session."""
+        return db.session.get(User, self.id)
+
+    def __repr__(self):
+        return f'<Principal {self.username}>'
+
+
+class AnonymousPrincipal(AnonymousUserMixin):
+    permissions = 0
+
+    def can(self, permission):
+        return False
+
+    def is_administrator(self):
+        return False
+
+
+login_manager.anonymous_user = AnonymousPrincipal
+
+
+def _affects_identity(instance):
+    if isinstance(instance, Role):
+        return True
+    if not isinstance(instance, User):
+        return False
+    state = inspect(instance)
+    if state.session is not None and instance in state.session.deleted:
+        return True
+    return any(state.attrs[name].history.has_changes() for name in PRINCIPAL_COLUMNS)
+
+
+class IdentityCache(VersionedCache):
+    def __init__(self):
+        super().__init__(IDENTITY_VERSION, 'SETTINGS_VERSION_CHECK_INTERVAL')
+        self._entries_lock = threading.Lock()
+
+    def load(self):
+        # Principals are added one by one as users make requests
+        return {}
+
+    def _fetch(self, user_id):
+        row = db.session.execute(
+            select(*[getattr(User, name) for name in PRINCIPAL_COLUMNS],
+                   Role.id, Role.name, Role.description, Role.permissions)
+            .outerjoin(Role, User.role_id == Role.id)
+            .where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        columns = dict(zip(PRINCIPAL_COLUMNS, row))
+        role = RoleRef(*row[len(PRINCIPAL_COLUMNS):]) if columns['role_id'] is not None else None
+        return Principal(role, **columns)
+
+    def get(self, user_id):
+        """The cached principal for ``user_id``, or None for unknown users."""
+        entries = self.data()
+        ttl = current_app.config.get('IDENTITY_CACHE_TTL', 60)
+        now = time.monotonic()
+        entry = entries.get(user_id)
+        if entry is not None and now < entry[1]:
+            return entry[0]
+
+        principal = self._fetch(user_id)
+        if ttl:
+            with self._entries_lock:
+                entries[user_id] = (principal, now + ttl)
+        return principal
+
+    def _bump_on_write(self, mapper, connection, target):
+        if _affects_identity(target):
+            super()._bump_on_write(mapper, connection, target)
+
+    def _note_writes(self, session, flush_context):
+        changed = list(session.new) + list(session.dirty) + list(session.deleted)
+        if any(_affects_identity(instance) for instance in changed):
+            session.info[f'{self.name}_changed'] = True
+
+
+identities = IdentityCache()
+identities.watch(User, Role)
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    try:
+        principal = identities.get(int(user_id))
+    except ValueError:
+        return None
+    # Deactivated accounts are signed out on their next request
+    if principal is None or not principal.is_active:
+        return None
+    return principal
@@ -0,0 +1,137 @@
+"""
+Secondary indexes and the query plans that depend on them.
+
+The indexes are declared on the models, so ``db.create_all()`` builds them
+for a new database; ``create_missing_indexes`` adds any that an existing
+database lacks. ``flask indexes check`` runs EXPLAIN QUERY PLAN over the
+application's hot queries and fails if SQLite would answer one of them
+with a full table scan.
+"""
+import re
+import sys
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select, func
+from app import db
+from app.database import day_of
+from app.models import Ticket, TicketComment, TimeEntry, Expense, DailyBillingTotal
+
+indexes_cli = AppGroup('indexes', help='Create and verify the database indexes.')
+
+# "SCAN ticket" ("SCAN TABLE ticket" before SQLite 3.36) reads every row of the
+# table, unless it walks an index ("USING [COVERING] INDEX ...")
+_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?( USING (?:COVERING )?INDEX \w+)?$')
+
+
+def create_missing_indexes():
+    """Create every index declared on the models that the database lacks.
+
+    Returns the names of the indexes created.
+    """
+    existing = set()
+    inspector = db.inspect(db.engine)
+    for table_name in inspector.get_table_names():
+        existing.update(index['name'] for index in inspector.get_indexes(table_name))
+
+    created = []
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                created.append(index.name)
+    return created
+
+
+def canonical_queries():
+    """(description, statement) pairs for the queries the indexes serve."""
+    now = datetime.utcnow()
+    week_ago = now - timedelta(days=7)
+    newest_first = (Ticket.created_at.desc(), Ticket.id.desc())
+    return [
+        ('ticket list', select(Ticket).order_by(*newest_first).limit(50)),
+        ('ticket list by update time', select(Ticket).order_by(Ticket.updated_at.desc(), Ticket.id.desc()).limit(50)),
+        ('tickets by status', select(Ticket).where(Ticket.status_id == 1).order_by(*newest_first).limit(50)),
+        ('tickets by priority', select(Ticket).where(Ticket.priority_id == 1).order_by(*newest_first).limit(50)),
+        ('tickets by assignee', select(Ticket).where(Ticket.assigned_to == 1).order_by(*newest_first).limit(50)),
+        ('unassigned tickets', select(Ticket).where(Ticket.assigned_to == None).order_by(*newest_first).limit(5)),
+        ('tickets by creator', select(Ticket).where(Ticket.created_by == 1).order_by(*newest_first).limit(10)),
+        ('most time-consuming tickets', select(Ticket).order_by(Ticket.total_seconds.desc(), Ticket.id.desc()).limit(10)),
+        ('tickets with time spent over', select(Ticket).where(Ticket.total_seconds >= 3600)),
+        ('tickets created in range', select(Ticket).where(Ticket.created_at >= week_ago, Ticket.created_at <= now)),
+        ('daily ticket volume', select(day_of(Ticket.created_at), func.count(Ticket.id))
+            .where(Ticket.created_at >= week_ago).group_by(day_of(Ticket.created_at))),
+        ('overdue tickets', select(func.count(Ticket.id)).where(Ticket.due_date < now)),
+        ('SLA breached tickets', select(func.count(Ticket.id)).where(Ticket.sla_state == 'breached')),
+        ('SLA at-risk tickets', select(func.count(Ticket.id)).where(Ticket.sla_state == 'at_risk')),
+        ('SLA evaluation due', select(Ticket.id).where(Ticket.sla_next_check_at <= now)
+            .order_by(Ticket.sla_next_check_at, Ticket.id)),
+        ('comment thread', select(TicketComment).where(TicketComment.ticket_id == 1)
+            .order_by(TicketComment.created_at, TicketComment.id)),
+        ('comment replies', select(TicketComment).where(TicketComment.parent_id == 1)),
+        ('time entries by user', select(TimeEntry).where(TimeEntry.user_id == 1)
+            .order_by(TimeEntry.start_time.desc())),
+        ('time entries in range', select(TimeEntry).where(TimeEntry.start_time >= week_ago, TimeEntry.start_time <= now)),
+        ('time entries for ticket', select(TimeEntry).where(TimeEntry.ticket_id == 1)),
+        ('running timer', select(TimeEntry).where(
+            TimeEntry.ticket_id == 1, TimeEntry.user_id == 1, TimeEntry.end_time == None)),
+        ('expenses in range', select(Expense).where(Expense.date >= week_ago.date(), Expense.date <= now.date())),
+        ('expenses by user', select(Expense).where(Expense.user_id == 1).order_by(Expense.date.desc())),
+        ('billing totals in range', select(DailyBillingTotal).where(
+            DailyBillingTotal.day >= week_ago.date(), DailyBillingTotal.day <= now.date())),
+        ('billing totals by user', select(DailyBillingTotal).where(
+            DailyBillingTotal.user_id == 1, DailyBillingTotal.day >= week_ago.date())),
+    ]
+
+
+def explain(connection, statement):
+    """The EXPLAIN QUERY PLAN detail lines for ``statement``."""
+    compiled = statement.compile(dialect=connection.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup or ())
+    rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled.string}', params)
+    return [row[-1] for row in rows]
+
+
+def full_table_scans(plan):
+    """Tables a query plan reads in full."""
+    return [match.group(1) for match in map(_SCAN.match, plan) if match and not match.group(2)]
+
+
+@indexes_cli.command('create')
+def create():
+    """Create any missing secondary indexes."""
+    created = create_missing_indexes()
+    if created:
+        click.echo(f'Created {len(created)} indexes: {", ".join(created)}')
+    else:
+        click.echo('All indexes already exist.')
+
+
+@indexes_cli.command('check')
+@click.option('--verbose', '-v', is_flag=True, help='Print every query plan.')
+def check(verbose):
+    """Fail if any hot query would scan a whole table."""
+    if db.engine.dialect.name != 'sqlite':
+        click.echo('Query plans are only checked on SQLite; nothing to do.')
+        return
+
+    failures = 0
+    with db.engine.connect() as connection:
+        # EXPLAIN never reads the database file; a real read makes a pooled
+        # connection pick up indexes created or dropped by other connections
+        connection.exec_driver_sql('SELECT count(*) FROM sqlite_master').scalar()
+        for description, statement in canonical_queries():
+            plan = explain(connection, statement)
+            scans = full_table_scans(plan)
+            if scans:
+                failures += 1
+                click.echo(f'FAIL  {description}: full scan of {", ".join(scans)}')
+            else:
+                click.echo(f'ok    {description}')
+            if scans or verbose:
+                for line in plan:
+                    click.echo(f'        {line}')
+
+    if failures:
+        click.echo(f'{failures} queries fall back to a full table scan; run "flask indexes create".')
+        sys.exit(1)
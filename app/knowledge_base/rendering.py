@@ -0,0 +1,113 @@
+"""
+Markdown rendering for knowledge base articles.
+
+Rendered, sanitized HTML is cached in a bounded LRU keyed by a hash of the
+article content and the renderer version, so a popular article is converted
+once rather than on every view. An edit changes the hash, and the entry for
+the old content is dropped when the change is flushed.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+import bleach
+import markdown
+import markupsafe
+from flask import current_app
+from sqlalchemy import event, inspect
+from app.models import KnowledgeBaseArticle
+
+# Bump when the Markdown extensions or sanitizer rules below change
+RENDERER_VERSION = f'1/markdown-{markdown.__version__}/bleach-{bleach.__version__}'
+
+MARKDOWN_EXTENSIONS = ['extra', 'sane_lists']
+
+ALLOWED_TAGS = set(bleach.sanitizer.ALLOWED_TAGS) | {
+    'p', 'br', 'hr', 'pre', 'span', 'div',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'img', 'table', 'thead', 'tbody', 'tr', 'th', 'td',
+    'dl', 'dt', 'dd', 'sup', 'sub', 'del', 'ins',
+}
+ALLOWED_ATTRIBUTES = {
+    **bleach.sanitizer.ALLOWED_ATTRIBUTES,
+    'img': ['src', 'alt', 'title', 'width', 'height'],
+    'th': ['align'],
+    'td': ['align'],
+    '*': ['id', 'class'],
+}
+ALLOWED_PROTOCOLS = set(bleach.sanitizer.ALLOWED_PROTOCOLS)
+
+
+def content_key(content):
+    digest = hashlib.sha256((content or '').encode('utf-8')).hexdigest()
+    return f'{RENDERER_VERSION}:{digest}'
+
+
+def _render(content):
+    html = markdown.markdown(content or '', extensions=MARKDOWN_EXTENSIONS)
+    return bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES,
+                        protocols=ALLOWED_PROTOCOLS)
+
+
+class RenderCache:
+    def __init__(self, default_size=256):
+        self.default_size = default_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+            return html
+
+    def put(self, key, html, size):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+render_cache = RenderCache()
+
+
+def render_markdown(content):
+    """Sanitized HTML for Markdown ``content``, from the cache when possible."""
+    key = content_key(content)
+    html = render_cache.get(key)
+    if html is None:
+        html = _render(content)
+        size = current_app.config.get('KB_RENDER_CACHE_SIZE', render_cache.default_size)
+        if size:
+            render_cache.put(key, html, size)
+    return markupsafe.Markup(html)
+
+
+@event.listens_for(KnowledgeBaseArticle.content, 'set', active_history=True)
+def _track_old_content(target, value, oldvalue, initiator):
+    # active_history keeps the previous content around for the listeners below
+    pass
+
+
+@event.listens_for(KnowledgeBaseArticle, 'after_update')
+def drop_stale_render(mapper, connection, target):
+    history = inspect(target).attrs.content.history
+    for old_content in history.deleted:
+        render_cache.discard(content_key(old_content))
+
+
+@event.listens_for(KnowledgeBaseArticle, 'after_delete')
+def drop_deleted_render(mapper, connection, target):
+    # Only if loaded; the row is gone, so an expired value can't be fetched
+    content = inspect(target).dict.get('content')
+    if content is not None:
+        render_cache.discard(content_key(content))
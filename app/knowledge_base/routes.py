@@ -1,7 +1,6 @@
 import os
 import uuid
 import shutil
-import markdown
 from flask import render_template, redirect, url_for, flash, request, jsonify, current_app, send_from_directory
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
@@ -9,9 +8,14 @@ from app import db
 from app.knowledge_base import bp
 from app.models import KnowledgeBaseArticle, KnowledgeBaseCategory, KnowledgeBaseImage
 from app.knowledge_base.forms import ArticleForm, CategoryForm, KnowledgeBaseSearchForm
+from app.search import search_records
+from app.replica import read_only
+from app.knowledge_base.rendering import render_markdown
+from app.knowledge_base.view_counter import view_counter
 
 @bp.route('/')
 @login_required
+@read_only
 def index():
     # Get all published articles
     articles = KnowledgeBaseArticle.query.filter_by(is_published=True).order_by(KnowledgeBaseArticle.created_at.desc()).all()
@@ -32,6 +36,7 @@ def index():
 
 @bp.route('/category/<int:id>')
 @login_required
+@read_only
 def view_category(id):
     category = KnowledgeBaseCategory.query.get_or_404(id)
     articles = KnowledgeBaseArticle.query.filter_by(category_id=id, is_published=True).all()
@@ -53,14 +58,13 @@ def view_article(id):
         KnowledgeBaseArticle.is_published == True
     ).limit(5).all()
     
-    # Increment view count
-    article.view_count += 1
-    db.session.commit()
+    # Count the view; buffered counts are written out in batches
+    view_counter.record(article.id)
     
     # Render markdown content if needed
     content_html = None
     if article.file_format == 'md':
-        content_html = markdown.markdown(article.content)
+        content_html = render_markdown(article.content)
     
     # Get images for this article
     images = KnowledgeBaseImage.query.filter_by(article_id=article.id).all()
@@ -68,6 +72,8 @@ def view_article(id):
     return render_template('knowledge_base/article.html',
                           title=article.title,
                           article=article,
+                          # Include views still buffered in memory
+                          view_count=(article.view_count or 0) + view_counter.pending(article.id),
                           categories=categories,
                           related_articles=related_articles,
                           content_html=content_html,
@@ -104,6 +110,7 @@ def delete_article(id):
 
 @bp.route('/search', methods=['GET', 'POST'])
 @login_required
+@read_only
 def search():
     form = KnowledgeBaseSearchForm()
     results = []
@@ -112,22 +119,15 @@ def search():
         query = form.query.data or request.args.get('query')
         category_id = form.category_id.data or request.args.get('category_id', 0, type=int)
         
+        criteria = []
         if category_id > 0:
-            results = KnowledgeBaseArticle.query.filter(
-                KnowledgeBaseArticle.is_published == True,
-                KnowledgeBaseArticle.category_id == category_id,
-                (KnowledgeBaseArticle.title.contains(query) | KnowledgeBaseArticle.content.contains(query))
-            ).all()
-        else:
-            results = KnowledgeBaseArticle.query.filter(
-                KnowledgeBaseArticle.is_published == True,
-                (KnowledgeBaseArticle.title.contains(query) | KnowledgeBaseArticle.content.contains(query))
-            ).all()
+            criteria.append(KnowledgeBaseArticle.category_id == category_id)
+        results = search_records(KnowledgeBaseArticle, query, *criteria, limit=50)
     
     return render_template('knowledge_base/search.html',
                           title='Search Knowledge Base',
                           form=form,
-                          results=results)
+                          articles=results)
 
 @bp.route('/categories/create', methods=['GET', 'POST'])
 @login_required
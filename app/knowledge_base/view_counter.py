@@ -0,0 +1,98 @@
+"""
+Buffered knowledge base view counting.
+
+Article views are tallied in memory and written out periodically as one
+batched ``UPDATE ... SET view_count = view_count + n``, so viewing an article
+no longer opens a write transaction of its own.
+"""
+import atexit
+import threading
+import time
+from flask import current_app
+from sqlalchemy import update, bindparam
+from app import db
+from app.models import KnowledgeBaseArticle
+
+
+class ViewCounter:
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flushing = False
+        self._last_flush = time.monotonic()
+        self._app = None
+
+    def record(self, article_id):
+        """Count one view of ``article_id`` and flush if the interval has passed."""
+        app = current_app._get_current_object()
+        interval = app.config.get('KB_VIEW_FLUSH_INTERVAL', 30)
+        with self._lock:
+            self._pending[article_id] = self._pending.get(article_id, 0) + 1
+            if self._app is None:
+                self._app = app
+                atexit.register(self._flush_at_exit)
+            due = time.monotonic() - self._last_flush >= interval
+            if not due or self._flushing:
+                return
+            self._flushing = True
+
+        if interval:
+            threading.Thread(target=self._flush_in_background, args=(app,), daemon=True).start()
+        else:
+            # Interval 0 writes each view through immediately
+            try:
+                self.flush()
+            finally:
+                self._flushing = False
+
+    def pending(self, article_id):
+        """Views of ``article_id`` not yet written to the database."""
+        return self._pending.get(article_id, 0)
+
+    def flush(self):
+        """Write buffered views to the database; returns the number of articles updated."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        table = KnowledgeBaseArticle.__table__
+        statement = (
+            update(table)
+            .where(table.c.id == bindparam('article_id'))
+            # Keep updated_at as is: a view isn't an edit
+            .values(view_count=db.func.coalesce(table.c.view_count, 0) + bindparam('views'),
+                    updated_at=table.c.updated_at)
+        )
+        try:
+            db.session.execute(statement, [
+                {'article_id': article_id, 'views': views} for article_id, views in pending.items()
+            ])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Put the counts back so the next flush retries them
+            with self._lock:
+                for article_id, views in pending.items():
+                    self._pending[article_id] = self._pending.get(article_id, 0) + views
+            raise
+        return len(pending)
+
+    def _flush_in_background(self, app):
+        try:
+            with app.app_context():
+                self.flush()
+        except Exception:
+            app.logger.exception('Error writing buffered knowledge base view counts')
+        finally:
+            with self._lock:
+                self._flushing = False
+
+    def _flush_at_exit(self):
+        if self._pending and self._app is not None:
+            with self._app.app_context():
+                self.flush()
+
+
+view_counter = ViewCounter()
@@ -0,0 +1,69 @@
+"""
+Ticket comment threads.
+
+All comments a viewer may see are fetched in one query and assembled into
+a reply tree in memory, so rendering cost no longer grows with one query
+per comment.
+"""
+from sqlalchemy.orm import joinedload
+from app.models import TicketComment
+
+
+class CommentNode:
+    """A comment with its visible replies and its depth in the thread."""
+
+    def __init__(self, comment):
+        self.comment = comment
+        self.replies = []
+        self.depth = 0
+
+    def __getattr__(self, name):
+        # Templates read comment fields straight off the node
+        return getattr(self.comment, name)
+
+
+class CommentThread:
+    def __init__(self, roots):
+        self.roots = roots
+        self.entries = list(self._walk(roots))
+
+    @staticmethod
+    def _walk(roots):
+        # Iterative pre-order walk so very deep threads can't hit the recursion limit
+        stack = [(node, 0) for node in reversed(roots)]
+        while stack:
+            node, depth = stack.pop()
+            node.depth = depth
+            yield node
+            stack.extend((reply, depth + 1) for reply in reversed(node.replies))
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def load_comment_thread(ticket_id, include_internal, newest_first=False):
+    """Build the comment tree for a ticket.
+
+    Top-level comments follow the requested order; replies are always shown
+    oldest first under their parent. When ``include_internal`` is false,
+    internal comments are skipped along with any replies beneath them.
+    """
+    query = TicketComment.query.options(joinedload(TicketComment.user)).filter(
+        TicketComment.ticket_id == ticket_id
+    )
+    if not include_internal:
+        query = query.filter(TicketComment.is_internal == False)
+    comments = query.order_by(TicketComment.created_at, TicketComment.id).all()
+
+    nodes = {comment.id: CommentNode(comment) for comment in comments}
+    roots = []
+    for comment in comments:
+        node = nodes[comment.id]
+        if comment.parent_id is None:
+            roots.append(node)
+        elif comment.parent_id in nodes:
+            nodes[comment.parent_id].replies.append(node)
+
+    if newest_first:
+        roots.reverse()
+    return CommentThread(roots)
@@ -0,0 +1,188 @@
+"""
+Dashboard snapshot computation and caching.
+
+The dashboard payload only depends on the audience viewing it: staff share
+one snapshot, and each requester (without VIEW_ALL_TICKETS) gets one scoped to the tickets
+they created. Snapshots hold plain data, never ORM instances, so they can be
+shared across requests and threads.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session, aliased
+from app import db
+from app.cache import SnapshotCache
+from app.models import Ticket, TicketStatus, TicketPriority, User, Role, TimeEntry, AgentStats, Asset, KnowledgeBaseArticle
+from app.reference import reference
+from app.rollups import ticket_counts_by
+from app.database import day_of
+from app.replica import primary_only
+from app.permissions import Permission
+from app.sla import AT_RISK, BREACHED
+
+STAFF_AUDIENCE = 'staff'
+
+
+def dashboard_audience(user):
+    """Cache key for the dashboard ``user`` should see."""
+    if not user.can(Permission.VIEW_ALL_TICKETS):
+        return ('user', user.id)
+    return STAFF_AUDIENCE
+
+
+def ticket_summaries(*criteria, order_by=None, limit=None):
+    """Plain-dict ticket rows with the status and priority fields the templates use."""
+    status = aliased(TicketStatus)
+    priority = aliased(TicketPriority)
+    query = (
+        select(Ticket.id, Ticket.subject, Ticket.created_at,
+               status.name, status.color, priority.name, priority.color)
+        .outerjoin(status, Ticket.status_id == status.id)
+        .outerjoin(priority, Ticket.priority_id == priority.id)
+        .where(*criteria)
+        .order_by(order_by if order_by is not None else Ticket.created_at.desc())
+        .limit(limit)
+    )
+    return [
+        {
+            'id': row[0],
+            'subject': row[1],
+            'created_at': row[2],
+            'status': {'name': row[3], 'color': row[4]},
+            'priority': {'name': row[5], 'color': row[6]},
+        }
+        for row in db.session.execute(query)
+    ]
+
+
+# Snapshots are rebuilt right after a commit invalidates them and then cached
+# for the full TTL, so they must not come from a replica that may be behind
+@primary_only
+def build_dashboard_snapshot(audience):
+    if audience == STAFF_AUDIENCE:
+        user_id = None
+        audience_criteria = []
+        count_filters = {}
+    else:
+        user_id = audience[1]
+        audience_criteria = [Ticket.created_by == user_id]
+        count_filters = {'created_by': user_id}
+
+    # Get ticket counts by status and priority from the counter table
+    counts_by_status = ticket_counts_by('status_id', **count_filters)
+    status_counts = {}
+    for status in reference.statuses:
+        status_counts[status.name] = {
+            'count': counts_by_status.get(status.id, 0),
+            'color': status.color
+        }
+
+    counts_by_priority = ticket_counts_by('priority_id', **count_filters)
+    priority_counts = {}
+    for priority in reference.priorities:
+        priority_counts[priority.name] = {
+            'count': counts_by_priority.get(priority.id, 0),
+            'color': priority.color
+        }
+
+    # Get recent tickets
+    recent_tickets = ticket_summaries(*audience_criteria, limit=10)
+    if user_id is None:
+        # For technicians and administrators, show unassigned tickets
+        unassigned_tickets = ticket_summaries(
+            Ticket.assigned_to == None,
+            Ticket.status.has(TicketStatus.is_closed == False),
+            limit=5
+        )
+    else:
+        # Users don't see unassigned tickets
+        unassigned_tickets = []
+
+    now = datetime.utcnow()
+    open_ticket = Ticket.status.has(TicketStatus.is_closed == False)
+
+    # Get overdue tickets
+    overdue_tickets = Ticket.query.filter(
+        Ticket.due_date < now,
+        open_ticket,
+        *audience_criteria
+    ).count()
+
+    # Get SLA breached and at risk tickets from the stored SLA state
+    sla_breached = Ticket.query.filter(
+        Ticket.sla_state == BREACHED,
+        open_ticket,
+        *audience_criteria
+    ).count()
+
+    at_risk_tickets = Ticket.query.filter(
+        Ticket.sla_state == AT_RISK,
+        open_ticket
+    ).count()
+
+    # Get ticket volume over time (last 7 days)
+    seven_days_ago = now - timedelta(days=7)
+    created_on = day_of(Ticket.created_at)
+    daily_tickets = db.session.query(
+        created_on.label('date'),
+        func.count(Ticket.id).label('count')
+    ).filter(Ticket.created_at >= seven_days_ago).group_by(created_on).order_by(created_on).all()
+
+    daily_ticket_data = {
+        'labels': [str(day.date) for day in daily_tickets],
+        'counts': [day.count for day in daily_tickets]
+    }
+
+    # Get agent performance metrics from the per-agent rollup in one query
+    agent_rows = db.session.execute(
+        select(User.first_name, User.last_name, AgentStats.closed_tickets, AgentStats.total_time)
+        .join(User.role)
+        .outerjoin(AgentStats, AgentStats.user_id == User.id)
+        .where(Role.name == 'Agent')
+    )
+    agent_metrics = [
+        {
+            'name': f"{first_name} {last_name}",
+            'closed_tickets': closed_tickets or 0,
+            'total_time': total_time or 0
+        }
+        for first_name, last_name, closed_tickets, total_time in agent_rows
+    ]
+
+    return {
+        'status_counts': status_counts,
+        'priority_counts': priority_counts,
+        'recent_tickets': recent_tickets,
+        'unassigned_tickets': unassigned_tickets,
+        'overdue_tickets': overdue_tickets,
+        'sla_breached': sla_breached,
+        'at_risk_tickets': at_risk_tickets,
+        'daily_ticket_data': daily_ticket_data,
+        'agent_metrics': agent_metrics,
+        'total_assets': Asset.query.count(),
+        'assigned_assets': Asset.query.filter(Asset.assigned_to_id != None).count(),
+        'kb_articles': KnowledgeBaseArticle.query.filter_by(is_published=True).count(),
+    }
+
+
+dashboard_cache = SnapshotCache(build_dashboard_snapshot, 'DASHBOARD_CACHE_TTL')
+
+# Writes to these models make cached dashboards stale
+DASHBOARD_SOURCES = (Ticket, TimeEntry)
+
+
+@event.listens_for(Session, 'after_flush')
+def note_dashboard_writes(session, flush_context):
+    changed = list(session.new) + list(session.dirty) + list(session.deleted)
+    if any(isinstance(instance, DASHBOARD_SOURCES) for instance in changed):
+        session.info['dashboard_stale'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_dashboard(session):
+    if session.info.pop('dashboard_stale', False):
+        dashboard_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_dashboard_writes(session):
+    session.info.pop('dashboard_stale', None)
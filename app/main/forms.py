@@ -1,7 +1,9 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, TextAreaField, SelectField, DateTimeField, SubmitField, PasswordField, BooleanField
 from wtforms.validators import DataRequired, Email, Length, Optional, EqualTo, ValidationError
-from app.models import TicketStatus, TicketPriority, TicketType, User
+from app.models import User
+from app.reference import reference
+from app.choices import RemoteSelectField, USER_CHOICES
 
 class TicketForm(FlaskForm):
     subject = StringField('Subject', validators=[DataRequired(), Length(max=255)])
@@ -11,20 +13,15 @@ class TicketForm(FlaskForm):
     status_id = SelectField('Status', coerce=int)
     priority_id = SelectField('Priority', coerce=int)
     type_id = SelectField('Type', coerce=int)
-    assigned_to = SelectField('Assign To', coerce=int, validators=[Optional()])
+    assigned_to = RemoteSelectField('Assign To', validators=[Optional()], source=USER_CHOICES, blank=(0, 'Unassigned'))
     due_date = DateTimeField('Due Date', format='%Y-%m-%dT%H:%M', validators=[Optional()])
     submit = SubmitField('Submit')
 
     def __init__(self, *args, **kwargs):
         super(TicketForm, self).__init__(*args, **kwargs)
-        self.status_id.choices = [(s.id, s.name) for s in TicketStatus.query.all()]
-        self.priority_id.choices = [(p.id, p.name) for p in TicketPriority.query.all()]
-        self.type_id.choices = [(t.id, t.name) for t in TicketType.query.all()]
-        
-        # Add empty choice for assigned_to
-        self.assigned_to.choices = [(0, 'Unassigned')] + [
-            (u.id, u.username) for u in User.query.filter_by(is_active=True).all()
-        ]
+        self.status_id.choices = reference.status_choices()
+        self.priority_id.choices = reference.priority_choices()
+        self.type_id.choices = reference.type_choices()
 
 class TicketCommentForm(FlaskForm):
     content = TextAreaField('Comment', validators=[DataRequired()])
@@ -32,15 +29,8 @@ class TicketCommentForm(FlaskForm):
     submit = SubmitField('Add Comment')
 
 class TicketAssignForm(FlaskForm):
-    assigned_to = SelectField('Assign To', coerce=int, validators=[Optional()])
+    assigned_to = RemoteSelectField('Assign To', validators=[Optional()], source=USER_CHOICES, blank=(0, 'Unassigned'))
     submit = SubmitField('Assign Ticket')
-    
-    def __init__(self, *args, **kwargs):
-        super(TicketAssignForm, self).__init__(*args, **kwargs)
-        # Add empty choice for assigned_to
-        self.assigned_to.choices = [(0, 'Unassigned')] + [
-            (u.id, u.username) for u in User.query.filter_by(is_active=True).all()
-        ]
 
 class TicketStatusForm(FlaskForm):
     status_id = SelectField('Status', coerce=int, validators=[DataRequired()])
@@ -48,7 +38,7 @@ class TicketStatusForm(FlaskForm):
     
     def __init__(self, *args, **kwargs):
         super(TicketStatusForm, self).__init__(*args, **kwargs)
-        self.status_id.choices = [(s.id, s.name) for s in TicketStatus.query.all()]
+        self.status_id.choices = reference.status_choices()
 
 class UserForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired(), Length(min=2, max=20)])
@@ -1,50 +1,35 @@
-from flask import render_template, redirect, url_for, flash, request, current_app, session
+from flask import render_template, redirect, url_for, flash, request, current_app, session, jsonify
 from flask_login import login_required, current_user
 from app import db
 from app.main import bp
-from app.models import Ticket, TicketStatus, TicketPriority, TicketType, User, TimeEntry, Asset, KnowledgeBaseArticle, TicketComment, Role, Setting
+from app.models import Ticket, TicketStatus, TicketType, User, Asset, KnowledgeBaseArticle, TicketComment, Role, Setting
 from app.main.forms import TicketForm, TicketCommentForm, TicketAssignForm, TicketStatusForm, UserForm, SettingsForm, CommentReplyForm
-from sqlalchemy import func, and_
-from datetime import datetime, timedelta
-from functools import wraps
+from app.main.dashboard import dashboard_cache, dashboard_audience, ticket_summaries
+from app.main.comments import load_comment_thread
+from app.search import search_records
+from app.typeahead import quick_jump
+from app.reference import reference
+from app.choices import USER_CHOICES, ASSET_CHOICES
+from app.permissions import Permission, permission_required
+from app.replica import read_only
+from app.tickets.listing import ticket_filter_criteria, paginate_tickets, page_to_json
+from sqlalchemy import insert
+from datetime import datetime
 import logging
 
 # Role-based permission decorators
-def admin_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if not current_user.role or current_user.role.name != 'Administrator':
-            flash('You do not have permission to access this page.', 'danger')
-            return redirect(url_for('main.dashboard'))
-        return f(*args, **kwargs)
-    return decorated_function
+admin_required = permission_required(Permission.ADMIN_SETTINGS)
 
-def staff_required(f):
-    """Requires user to be Administrator or Technician"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if not current_user.role or current_user.role.name not in ['Administrator', 'Technician']:
-            flash('You do not have permission to access this page.', 'danger')
-            return redirect(url_for('main.dashboard'))
-        return f(*args, **kwargs)
-    return decorated_function
-
-def technician_or_admin_required(f):
-    """Requires user to be Administrator or Technician"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if not current_user.role or current_user.role.name not in ['Administrator', 'Technician']:
-            flash('You do not have permission to access this page.', 'danger')
-            return redirect(url_for('main.dashboard'))
-        return f(*args, **kwargs)
-    return decorated_function
+# Staff may assign tickets and change their status
+staff_required = permission_required(Permission.ASSIGN)
+technician_or_admin_required = staff_required
 
 # Helper function to check if a user owns a ticket or is staff
 def can_view_ticket(ticket):
+    if current_user.can(Permission.VIEW_ALL_TICKETS):
+        return True
     if not current_user.role:
         return False
-    if current_user.role.name in ['Administrator', 'Technician']:
-        return True
     return ticket.created_by == current_user.id
 
 @bp.route('/')
@@ -55,185 +40,43 @@ def index():
 
 @bp.route('/dashboard')
 @login_required
+@read_only
 def dashboard():
-    # Get ticket counts by status
-    statuses = TicketStatus.query.all()
-    status_counts = {}
-    for status in statuses:
-        # If user role, only count tickets created by this user
-        if current_user.role and current_user.role.name == 'User':
-            count = Ticket.query.filter_by(status_id=status.id, created_by=current_user.id).count()
-        else:
-            count = Ticket.query.filter_by(status_id=status.id).count()
-        status_counts[status.name] = {
-            'count': count,
-            'color': status.color
-        }
-    
-    # Get ticket counts by priority
-    priorities = TicketPriority.query.all()
-    priority_counts = {}
-    for priority in priorities:
-        # If user role, only count tickets created by this user
-        if current_user.role and current_user.role.name == 'User':
-            count = Ticket.query.filter_by(priority_id=priority.id, created_by=current_user.id).count()
-        else:
-            count = Ticket.query.filter_by(priority_id=priority.id).count()
-        priority_counts[priority.name] = {
-            'count': count,
-            'color': priority.color
-        }
+    # Counts, recent tickets and metrics come from the cached snapshot for this audience
+    snapshot = dashboard_cache.get(dashboard_audience(current_user))
     
     # Get open tickets assigned to or created by current user
-    if current_user.role and current_user.role.name == 'User':
-        # For users, show tickets they created
-        my_tickets = Ticket.query.join(TicketStatus).filter(
+    if not current_user.can(Permission.VIEW_ALL_TICKETS):
+        # For requesters, show tickets they created
+        my_tickets = ticket_summaries(
             Ticket.created_by == current_user.id,
-            TicketStatus.is_closed == False
-        ).order_by(Ticket.created_at.desc()).limit(5).all()
+            Ticket.status.has(TicketStatus.is_closed == False),
+            limit=5
+        )
     else:
         # For staff, show tickets assigned to them
-        my_tickets = Ticket.query.join(TicketStatus).filter(
+        my_tickets = ticket_summaries(
             Ticket.assigned_to == current_user.id,
-            TicketStatus.is_closed == False
-        ).order_by(Ticket.created_at.desc()).limit(5).all()
-    
-    # Get recent tickets
-    if current_user.role and current_user.role.name == 'User':
-        # For users, only show tickets they created
-        recent_tickets = Ticket.query.filter_by(created_by=current_user.id).order_by(Ticket.created_at.desc()).limit(10).all()
-        # Users don't see unassigned tickets
-        unassigned_tickets = []
-    else:
-        # For staff, show all tickets
-        recent_tickets = Ticket.query.order_by(Ticket.created_at.desc()).limit(10).all()
-        # For technicians and administrators, show unassigned tickets
-        unassigned_tickets = Ticket.query.join(TicketStatus).filter(
-            Ticket.assigned_to == None,
-            TicketStatus.is_closed == False
-        ).order_by(Ticket.created_at.desc()).limit(5).all()
-    
-    # Get overdue tickets
-    if current_user.role and current_user.role.name == 'User':
-        # For users, only count their tickets
-        overdue_tickets = Ticket.query.filter(
-            Ticket.due_date < datetime.utcnow(),
-            Ticket.status.has(TicketStatus.is_closed == False),
-            Ticket.created_by == current_user.id
-        ).count()
-    else:
-        # For staff, count all tickets
-        overdue_tickets = Ticket.query.filter(
-            Ticket.due_date < datetime.utcnow(),
-            Ticket.status.has(TicketStatus.is_closed == False)
-        ).count()
-    
-    # Get SLA breached tickets
-    if current_user.role and current_user.role.name == 'User':
-        # For users, only count their tickets
-        sla_breached = Ticket.query.filter(
-            and_(
-                Ticket.status.has(TicketStatus.is_closed == False),
-                Ticket.created_by == current_user.id,
-                (
-                    and_(Ticket.sla_response_due < datetime.utcnow(), Ticket.sla_response_met == False) |
-                    and_(Ticket.sla_resolution_due < datetime.utcnow(), Ticket.sla_resolution_met == False)
-                )
-            )
-        ).count()
-    else:
-        # For staff, count all tickets
-        sla_breached = Ticket.query.filter(
-            and_(
-                Ticket.status.has(TicketStatus.is_closed == False),
-                (
-                    and_(Ticket.sla_response_due < datetime.utcnow(), Ticket.sla_response_met == False) |
-                    and_(Ticket.sla_resolution_due < datetime.utcnow(), Ticket.sla_resolution_met == False)
-                )
-            )
-        ).count()
-    
-    # Get SLA at risk tickets (within 75% of SLA time)
-    now = datetime.utcnow()
-    at_risk_tickets = Ticket.query.filter(
-        and_(
             Ticket.status.has(TicketStatus.is_closed == False),
-            (
-                and_(
-                    Ticket.sla_response_met == False,
-                    Ticket.sla_response_due > now,
-                    Ticket.sla_response_due < now + timedelta(hours=4)
-                ) |
-                and_(
-                    Ticket.sla_resolution_met == False,
-                    Ticket.sla_resolution_due > now,
-                    Ticket.sla_resolution_due < now + timedelta(hours=8)
-                )
-            )
+            limit=5
         )
-    ).count()
-    
-    # Get ticket volume over time (last 7 days)
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    daily_tickets = db.session.query(
-        func.date(Ticket.created_at).label('date'),
-        func.count(Ticket.id).label('count')
-    ).filter(Ticket.created_at >= seven_days_ago).group_by(func.date(Ticket.created_at)).all()
-    
-    daily_ticket_data = {
-        'labels': [str(day.date) for day in daily_tickets],
-        'counts': [day.count for day in daily_tickets]
-    }
-    
-    # Get agent performance metrics
-    agents = User.query.join(User.role).filter(User.role.has(name='Agent')).all()
-    agent_metrics = []
-    
-    for agent in agents:
-        closed_tickets = Ticket.query.filter(
-            Ticket.assigned_to == agent.id,
-            Ticket.status.has(TicketStatus.is_closed == True)
-        ).count()
-        
-        total_time = db.session.query(func.sum(TimeEntry.duration)).filter(
-            TimeEntry.user_id == agent.id
-        ).scalar() or 0
-        
-        agent_metrics.append({
-            'name': agent.full_name,
-            'closed_tickets': closed_tickets,
-            'total_time': total_time
-        })
-    
-    # Get asset statistics
-    total_assets = Asset.query.count()
-    assigned_assets = Asset.query.filter(Asset.assigned_to_id != None).count()
-    
-    # Get knowledge base statistics
-    kb_articles = KnowledgeBaseArticle.query.filter_by(is_published=True).count()
     
     return render_template('main/dashboard.html', 
                            title='Dashboard',
-                           status_counts=status_counts,
-                           priority_counts=priority_counts,
                            my_tickets=my_tickets,
-                           recent_tickets=recent_tickets,
-                           unassigned_tickets=unassigned_tickets,
-                           overdue_tickets=overdue_tickets,
-                           sla_breached=sla_breached,
-                           at_risk_tickets=at_risk_tickets,
-                           daily_ticket_data=daily_ticket_data,
-                           agent_metrics=agent_metrics,
-                           total_assets=total_assets,
-                           assigned_assets=assigned_assets,
-                           kb_articles=kb_articles)
+                           **snapshot)
 
 @bp.route('/tickets')
 @login_required
 def tickets():
-    # Get all tickets
-    tickets = Ticket.query.order_by(Ticket.created_at.desc()).all()
-    return render_template('main/tickets.html', title='All Tickets', tickets=tickets)
+    # Get one page of tickets, keeping any filters across pages
+    query = Ticket.query.filter(*ticket_filter_criteria(request.args))
+    page = paginate_tickets(query)
+    
+    if request.args.get('format') == 'json':
+        return jsonify(page_to_json(page))
+    
+    return render_template('main/tickets.html', title='All Tickets', tickets=page.items, page=page)
 
 @bp.route('/tickets/create', methods=['GET', 'POST'])
 @login_required
@@ -253,7 +96,7 @@ def create_ticket():
         )
         
         # Handle assigned_to field
-        if form.assigned_to.data != 0 and current_user.role.name in ['Administrator', 'Technician']:  # Not unassigned and user has permission
+        if form.assigned_to.data != 0 and current_user.can(Permission.ASSIGN):  # Not unassigned and user has permission
             ticket.assigned_to = form.assigned_to.data
         else:
             ticket.assigned_to = None  # Ensure regular users can't assign tickets
@@ -298,34 +141,14 @@ def view_ticket(ticket_id):
         # If sort order is specified, set active tab to comments
         active_tab = 'comments'
     
-    # Query comments with the appropriate sort order
-    if sort_order == 'desc':
-        query = TicketComment.query.filter_by(ticket_id=ticket_id, parent_id=None)
-        # If user is not staff, only show public comments
-        if current_user.role.name not in ['Administrator', 'Technician']:
-            query = query.filter_by(is_internal=False)
-        comments = query.order_by(TicketComment.created_at.desc()).all()
-    else:
-        query = TicketComment.query.filter_by(ticket_id=ticket_id, parent_id=None)
-        # If user is not staff, only show public comments
-        if current_user.role.name not in ['Administrator', 'Technician']:
-            query = query.filter_by(is_internal=False)
-        comments = query.order_by(TicketComment.created_at).all()
-        
-    # Fetch replies for each comment
-    for comment in comments:
-        # If user is not staff, only show public replies
-        if current_user.role.name not in ['Administrator', 'Technician']:
-            comment.replies = TicketComment.query.filter_by(
-                ticket_id=ticket_id, 
-                parent_id=comment.id,
-                is_internal=False
-            ).order_by(TicketComment.created_at).all()
-        else:
-            comment.replies = TicketComment.query.filter_by(
-                ticket_id=ticket_id, 
-                parent_id=comment.id
-            ).order_by(TicketComment.created_at).all()
+    # Load the whole visible comment thread in one query
+    # If user is not staff, only show public comments
+    thread = load_comment_thread(
+        ticket_id,
+        include_internal=current_user.can(Permission.INTERNAL_COMMENTS),
+        newest_first=sort_order == 'desc'
+    )
+    comments = thread.roots
         
     # Create a reply form for each comment
     reply_form = CommentReplyForm()
@@ -341,10 +164,10 @@ def view_ticket(ticket_id):
         status_form.status_id.data = ticket.status_id
         
     # Determine if user can modify ticket status and assignment
-    can_modify = current_user.role.name in ['Administrator', 'Technician']
+    can_modify = current_user.can(Permission.ASSIGN)
     
     # Determine if user can add internal comments
-    can_add_internal = current_user.role.name in ['Administrator', 'Technician']
+    can_add_internal = current_user.can(Permission.INTERNAL_COMMENTS)
     
     return render_template('main/view_ticket.html', 
                            title=f'Ticket #{ticket.id}', 
@@ -354,6 +177,7 @@ def view_ticket(ticket_id):
                            assign_form=assign_form,
                            status_form=status_form,
                            comments=comments,
+                           comment_thread=thread.entries,
                            sort_order=sort_order,
                            active_tab=active_tab,
                            can_modify=can_modify,
@@ -397,18 +221,16 @@ def update_ticket_status(ticket_id):
     
     if form.validate_on_submit():
         try:
-            # Use direct SQL to update the ticket status
-            from sqlalchemy import text
-            
             # Get the status information first
-            status = TicketStatus.query.get(form.status_id.data)
+            status = reference.status_by_id.get(form.status_id.data)
             if not status:
                 flash('Invalid status selected!', 'danger')
                 return redirect(url_for('main.view_ticket', ticket_id=ticket_id, tab='comments'))
             
             # Get the current status name for the comment
             ticket = Ticket.query.get_or_404(ticket_id)
-            old_status = ticket.status.name if ticket.status else 'None'
+            old_status = reference.status_by_id.get(ticket.status_id)
+            old_status = old_status.name if old_status else 'None'
             
             # Determine if we need to update SLA metrics
             update_resolved = False
@@ -420,43 +242,29 @@ def update_ticket_status(ticket_id):
                 if ticket.sla_resolution_due and current_time <= ticket.sla_resolution_due:
                     update_sla_met = True
             
-            # Update the ticket status
-            update_sql = text("""
-                UPDATE ticket 
-                SET status_id = :status_id,
-                    resolved_at = CASE WHEN :update_resolved THEN :current_time ELSE resolved_at END,
-                    sla_resolution_met = CASE WHEN :update_sla_met THEN 1 ELSE sla_resolution_met END
-                WHERE id = :ticket_id
-            """)
+            # Update the ticket through the session so the rollup listeners see the change
+            ticket.status_id = status.id
+            if update_resolved:
+                ticket.resolved_at = current_time
+            if update_sla_met:
+                ticket.sla_resolution_met = True
             
-            # Add a system comment about the status change
-            comment_sql = text("""
-                INSERT INTO ticket_comment (ticket_id, user_id, content, is_internal, created_at)
-                VALUES (:ticket_id, :user_id, :content, :is_internal, :created_at)
-            """)
+            # Add a system comment about the status change; a Core insert, so it
+            # doesn't count as the ticket's first response
+            db.session.execute(insert(TicketComment.__table__).values(
+                ticket_id=ticket_id,
+                user_id=current_user.id,
+                content=f'Status changed from {old_status} to {status.name}',
+                is_internal=True,
+                created_at=current_time
+            ))
             
-            # Execute both operations in a transaction
-            with db.engine.begin() as conn:
-                # Update the ticket
-                conn.execute(update_sql, {
-                    'status_id': status.id,
-                    'update_resolved': update_resolved,
-                    'current_time': current_time,
-                    'update_sla_met': update_sla_met,
-                    'ticket_id': ticket_id
-                })
-                
-                # Add the comment
-                conn.execute(comment_sql, {
-                    'ticket_id': ticket_id,
-                    'user_id': current_user.id,
-                    'content': f'Status changed from {old_status} to {status.name}',
-                    'is_internal': True,
-                    'created_at': current_time
-                })
+            # Commit both operations in one transaction
+            db.session.commit()
             
             flash(f'Ticket status updated to {status.name}!', 'success')
         except Exception as e:
+            db.session.rollback()
             current_app.logger.error(f'Error updating ticket status: {str(e)}')
             flash('Error updating ticket status. Please try again.', 'danger')
     
@@ -484,7 +292,7 @@ def add_comment(ticket_id):
             is_internal = form.is_internal.data == '1'
             current_app.logger.debug(f'is_internal value determined: {is_internal}')
             
-            if is_internal and current_user.role.name not in ['Administrator', 'Technician']:
+            if is_internal and not current_user.can(Permission.INTERNAL_COMMENTS):
                 current_app.logger.warning(f'User {current_user.id} attempted to add internal comment without permission on ticket {ticket_id}')
                 flash('You do not have permission to add internal comments.', 'danger')
                 return redirect(url_for('main.view_ticket', ticket_id=ticket_id, tab='comments'))
@@ -507,7 +315,7 @@ def add_comment(ticket_id):
             # Check if status is being updated and user has permission
             status_id = form.status_id.data
             current_app.logger.debug(f'Status ID from form: {status_id}')
-            if status_id != 0 and current_user.role and current_user.role.name in ['Administrator', 'Technician']:
+            if status_id != 0 and current_user.can(Permission.ASSIGN):
                 current_app.logger.info(f'Updating ticket {ticket_id} status to {status_id}')
                 # Update ticket status
                 ticket.status_id = status_id
@@ -555,7 +363,7 @@ def reply_to_comment_form(ticket_id, comment_id):
                           ticket=ticket,
                           parent_comment=parent_comment,
                           form=form,
-                          can_add_internal=current_user.role.name in ['Administrator', 'Technician'])
+                          can_add_internal=current_user.can(Permission.INTERNAL_COMMENTS))
 
 @bp.route('/tickets/<int:ticket_id>/comment/<int:comment_id>/reply', methods=['POST'])
 @login_required
@@ -579,7 +387,7 @@ def reply_to_comment(ticket_id, comment_id):
             is_internal = form.is_internal.data == '1'
             current_app.logger.debug(f'Reply is_internal value determined: {is_internal}')
 
-            if is_internal and current_user.role.name not in ['Administrator', 'Technician']:
+            if is_internal and not current_user.can(Permission.INTERNAL_COMMENTS):
                 current_app.logger.warning(f'User {current_user.id} attempted to add internal reply without permission on ticket {ticket_id}, comment {comment_id}')
                 flash('You do not have permission to add internal comments.', 'danger')
                 return redirect(url_for('main.view_ticket', ticket_id=ticket_id, tab='comments'))
@@ -728,33 +536,54 @@ def settings():
     # Redirect to the new settings module
     return redirect(url_for('settings.index'))
 
+@bp.route('/quick-jump')
+@login_required
+def quick_jump_lookup():
+    # Typeahead for ticket IDs, asset serial numbers and users
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 25))
+    
+    results = []
+    for entry in quick_jump(query, current_user, limit):
+        if entry.kind == 'ticket':
+            url = url_for('main.view_ticket', ticket_id=entry.id)
+        elif entry.kind == 'asset':
+            url = url_for('assets.view', id=entry.id)
+        else:
+            url = url_for('users.view', id=entry.id) if current_user.is_administrator() else None
+        results.append({
+            'type': entry.kind,
+            'id': entry.id,
+            'label': entry.label,
+            'detail': entry.detail,
+            'url': url
+        })
+    return jsonify(query=query, results=results)
+
+@bp.route('/choices/users')
+@login_required
+def user_choices():
+    # Paginated, searchable options for assignee pickers
+    return jsonify(USER_CHOICES.page())
+
+@bp.route('/choices/assets')
+@login_required
+def asset_choices():
+    # Paginated, searchable options for asset pickers
+    return jsonify(ASSET_CHOICES.page())
+
 @bp.route('/search')
 @login_required
+@read_only
 def search():
     query = request.args.get('q', '')
     if not query:
         return redirect(url_for('main.dashboard'))
     
-    # Search tickets
-    tickets = Ticket.query.filter(
-        (Ticket.subject.contains(query)) |
-        (Ticket.description.contains(query)) |
-        (Ticket.requester_email.contains(query)) |
-        (Ticket.requester_name.contains(query))
-    ).limit(20).all()
-    
-    # Search knowledge base
-    kb_articles = KnowledgeBaseArticle.query.filter(
-        (KnowledgeBaseArticle.title.contains(query)) |
-        (KnowledgeBaseArticle.content.contains(query))
-    ).filter_by(is_published=True).limit(10).all()
-    
-    # Search assets
-    assets = Asset.query.filter(
-        (Asset.name.contains(query)) |
-        (Asset.serial_number.contains(query)) |
-        (Asset.notes.contains(query))
-    ).limit(10).all()
+    # Search tickets, knowledge base and assets through the full-text index
+    tickets = search_records(Ticket, query, limit=20)
+    kb_articles = search_records(KnowledgeBaseArticle, query, limit=10)
+    assets = search_records(Asset, query, limit=10)
     
     return render_template('main/search_results.html',
                            title='Search Results',
@@ -1,15 +1,19 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 import pytz
 from flask import current_app
 from flask_login import UserMixin
-from app import db, login_manager, bcrypt
+from app import db, bcrypt
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy import event
+from app.permissions import Permission, default_permissions
 
 class Role(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), unique=True)
     description = db.Column(db.String(255))
+    # Permission bit flags; new roles get the defaults for their name
+    permissions = db.Column(db.Integer, default=lambda context: default_permissions(
+        context.get_current_parameters().get('name')))
     users = db.relationship('User', backref='role', lazy='dynamic')
     
     def __repr__(self):
@@ -46,16 +50,15 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return bcrypt.check_password_hash(self.password_hash, password)
     
+    def can(self, permission):
+        return self.role is not None and (self.role.permissions or 0) & permission == permission
+    
     def is_administrator(self):
-        return self.role.name == 'Administrator'
+        return self.can(Permission.ADMIN_SETTINGS)
     
     def __repr__(self):
         return f'<User {self.username}>'
 
-@login_manager.user_loader
-def load_user(id):
-    return User.query.get(int(id))
-
 class TicketStatus(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), unique=True)
@@ -76,11 +79,50 @@ class TicketPriority(db.Model):
     is_default = db.Column(db.Boolean, default=False)
     sla_response_time = db.Column(db.Integer)  # Minutes
     sla_resolution_time = db.Column(db.Integer)  # Minutes
+    # Hours the SLA times are counted in; the default calendar when not set
+    calendar_id = db.Column(db.Integer, db.ForeignKey('business_calendar.id'))
     tickets = db.relationship('Ticket', backref='priority', lazy='dynamic')
     
     def __repr__(self):
         return f'<TicketPriority {self.name}>'
 
+# Working hours and holidays that SLA times are counted in (see app/calendars.py).
+# With no calendars at all, SLA times run around the clock.
+class BusinessCalendar(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), unique=True)
+    timezone = db.Column(db.String(64), nullable=False, default='UTC')  # Zone the hours are in
+    is_default = db.Column(db.Boolean, default=False)
+    hours = db.relationship('BusinessHours', backref='calendar', lazy='dynamic', cascade='all, delete-orphan')
+    holidays = db.relationship('CalendarHoliday', backref='calendar', lazy='dynamic', cascade='all, delete-orphan')
+    priorities = db.relationship('TicketPriority', backref='calendar', lazy='dynamic')
+    
+    def __repr__(self):
+        return f'<BusinessCalendar {self.name}>'
+
+class BusinessHours(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    calendar_id = db.Column(db.Integer, db.ForeignKey('business_calendar.id'), nullable=False, index=True)
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday
+    start_minute = db.Column(db.Integer, nullable=False)  # Minutes after local midnight
+    end_minute = db.Column(db.Integer, nullable=False)  # Up to 1440
+    
+    def __repr__(self):
+        return f'<BusinessHours {self.calendar_id}: {self.weekday} {self.start_minute}-{self.end_minute}>'
+
+class CalendarHoliday(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    calendar_id = db.Column(db.Integer, db.ForeignKey('business_calendar.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)  # Local date with no working hours
+    name = db.Column(db.String(128))
+    
+    __table_args__ = (
+        db.UniqueConstraint('calendar_id', 'date', name='uq_calendar_holiday_date'),
+    )
+    
+    def __repr__(self):
+        return f'<CalendarHoliday {self.calendar_id}: {self.date}>'
+
 class TicketType(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), unique=True)
@@ -114,11 +156,39 @@ class Ticket(db.Model):
     first_response_at = db.Column(db.DateTime)
     resolved_at = db.Column(db.DateTime)
     
+    # Overall SLA state ('on_track', 'at_risk', 'breached' or 'met') and the
+    # next time it can change, maintained by app/sla.py
+    sla_state = db.Column(db.String(16))
+    sla_state_changed_at = db.Column(db.DateTime)
+    sla_next_check_at = db.Column(db.DateTime)
+    
+    # Sum of the ticket's time entry durations, maintained by app/rollups.py
+    total_seconds = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     # Relationships
     comments = db.relationship('TicketComment', backref='ticket', lazy='dynamic', cascade='all, delete-orphan')
     time_entries = db.relationship('TimeEntry', backref='ticket', lazy='dynamic', cascade='all, delete-orphan')
     assets = db.relationship('Asset', secondary='ticket_asset', backref='tickets', lazy='dynamic')
     
+    # Ticket lists page newest first, optionally filtered to one status,
+    # priority, assignee or creator; the dashboard and SLA views look up
+    # overdue tickets by due date and SLA state, the SLA evaluator picks up
+    # tickets by their next check time, and lists can sort by time spent
+    __table_args__ = (
+        db.Index('ix_ticket_created_at', 'created_at', 'id'),
+        db.Index('ix_ticket_updated_at', 'updated_at', 'id'),
+        db.Index('ix_ticket_status_created', 'status_id', 'created_at'),
+        db.Index('ix_ticket_priority_created', 'priority_id', 'created_at'),
+        db.Index('ix_ticket_assigned_created', 'assigned_to', 'created_at'),
+        db.Index('ix_ticket_creator_created', 'created_by', 'created_at'),
+        db.Index('ix_ticket_due_date', 'due_date'),
+        db.Index('ix_ticket_sla_response', 'sla_response_met', 'sla_response_due'),
+        db.Index('ix_ticket_sla_resolution', 'sla_resolution_met', 'sla_resolution_due'),
+        db.Index('ix_ticket_sla_state', 'sla_state'),
+        db.Index('ix_ticket_sla_next_check', 'sla_next_check_at'),
+        db.Index('ix_ticket_total_seconds', 'total_seconds', 'id'),
+    )
+    
     @hybrid_property
     def is_overdue(self):
         if self.due_date and self.due_date < datetime.utcnow():
@@ -139,11 +209,69 @@ class Ticket(db.Model):
     
     @hybrid_property
     def total_time_spent(self):
-        return sum([entry.duration for entry in self.time_entries])
+        return self.total_seconds or 0
+    
+    @total_time_spent.expression
+    def total_time_spent(cls):
+        return cls.total_seconds
     
     def __repr__(self):
         return f'<Ticket {self.id}: {self.subject}>'
 
+# Running ticket totals per (status, priority, assignee, creator, open/closed),
+# maintained by the listeners in app/rollups.py
+class TicketCounter(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # Key columns hold 0 rather than NULL, so the key can be unique
+    status_id = db.Column(db.Integer, nullable=False, default=0)
+    priority_id = db.Column(db.Integer, nullable=False, default=0)
+    assigned_to = db.Column(db.Integer, nullable=False, default=0)
+    created_by = db.Column(db.Integer, nullable=False, default=0)
+    is_closed = db.Column(db.Boolean, nullable=False, default=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('uq_ticket_counter_key', 'status_id', 'priority_id', 'assigned_to', 'created_by', 'is_closed',
+                 unique=True),
+    )
+    
+    def __repr__(self):
+        return f'<TicketCounter {self.status_id}/{self.priority_id}: {self.count}>'
+
+# Per-agent ticket and time totals, maintained by the listeners in app/rollups.py
+class AgentStats(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    assigned_tickets = db.Column(db.Integer, nullable=False, default=0)
+    open_tickets = db.Column(db.Integer, nullable=False, default=0)
+    closed_tickets = db.Column(db.Integer, nullable=False, default=0)
+    total_time = db.Column(db.Integer, nullable=False, default=0)  # Seconds
+    
+    user = db.relationship('User', backref=db.backref('stats', uselist=False))
+    
+    def __repr__(self):
+        return f'<AgentStats {self.user_id}>'
+
+# Time and expense totals per (day, user, ticket, billable), maintained by the
+# listeners in app/rollups.py; billing summaries and reports read these
+class DailyBillingTotal(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    # Key columns hold 0 rather than NULL, so the key can be unique
+    user_id = db.Column(db.Integer, nullable=False, default=0)
+    ticket_id = db.Column(db.Integer, nullable=False, default=0)
+    billable = db.Column(db.Boolean, nullable=False, default=False)
+    time_seconds = db.Column(db.Integer, nullable=False, default=0)
+    # Whole cents, so repeated additions and removals leave no rounding residue
+    expense_cents = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    __table_args__ = (
+        db.Index('uq_daily_billing_total_key', 'day', 'user_id', 'ticket_id', 'billable', unique=True),
+        db.Index('ix_daily_billing_total_user_day', 'user_id', 'day'),
+    )
+    
+    def __repr__(self):
+        return f'<DailyBillingTotal {self.day} {self.user_id}/{self.ticket_id}>'
+
 class TicketComment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'))
@@ -158,6 +286,12 @@ class TicketComment(db.Model):
     replies = db.relationship('TicketComment', backref=db.backref('parent', remote_side=[id]),
                             lazy='dynamic', cascade='all, delete-orphan')
     
+    # A ticket's thread is read in creation order; replies are found by parent
+    __table_args__ = (
+        db.Index('ix_ticket_comment_thread', 'ticket_id', 'created_at', 'id'),
+        db.Index('ix_ticket_comment_parent', 'parent_id'),
+    )
+    
     def __repr__(self):
         return f'<TicketComment {self.id}>'
 
@@ -172,6 +306,14 @@ class TimeEntry(db.Model):
     billable = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Time lists filter by user and date range; the ticket page looks up the
+    # current user's running timer (end_time IS NULL) on the ticket
+    __table_args__ = (
+        db.Index('ix_time_entry_user_start', 'user_id', 'start_time'),
+        db.Index('ix_time_entry_start_time', 'start_time'),
+        db.Index('ix_time_entry_ticket_user_end', 'ticket_id', 'user_id', 'end_time'),
+    )
+    
     def __repr__(self):
         return f'<TimeEntry {self.id}>'
 
@@ -189,6 +331,11 @@ class Expense(db.Model):
     ticket = db.relationship('Ticket', backref='expenses')
     user = db.relationship('User', backref='expenses')
     
+    __table_args__ = (
+        db.Index('ix_expense_date', 'date'),
+        db.Index('ix_expense_user_date', 'user_id', 'date'),
+    )
+    
     def __repr__(self):
         return f'<Expense {self.id}>'
 
@@ -269,6 +416,35 @@ class Setting(db.Model):
     def __repr__(self):
         return f'<Setting {self.key}>'
 
+# Version stamps for process-local caches; a write bumps the stamp so every
+# process knows to reload (see app/settings/service.py)
+class CacheVersion(db.Model):
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<CacheVersion {self.name}: {self.version}>'
+
+# A bulk rewrite of open tickets' SLA due dates after priority targets change
+# (see app/sla.py). Progress is committed with every batch, so an interrupted
+# run resumes after the last ticket it finished.
+class SLARecalculation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    priority_ids = db.Column(db.String(255), nullable=False)  # Comma-separated
+    total = db.Column(db.Integer, nullable=False, default=0)  # Open tickets when started
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    last_ticket_id = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    superseded = db.Column(db.Boolean, nullable=False, default=False)
+    
+    __table_args__ = (
+        db.Index('ix_sla_recalculation_finished', 'finished_at'),
+    )
+    
+    def __repr__(self):
+        return f'<SLARecalculation {self.id}: {self.processed}/{self.total}>'
+
 class EmailConfig(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     protocol = db.Column(db.String(10))  # IMAP or Exchange
@@ -296,28 +472,39 @@ class NotificationSetting(db.Model):
 # Event listeners for SLA calculations
 @event.listens_for(Ticket, 'before_insert')
 def set_sla_due_dates(mapper, connection, target):
+    # Imported here because the calendars module builds on these models
+    from app.calendars import calendars
     if target.priority_id:
         priority = TicketPriority.query.get(target.priority_id)
         if priority:
             now = datetime.utcnow()
+            # SLA times count working minutes in the priority's business calendar
+            calendar = calendars.for_priority(priority.id)
             if priority.sla_response_time:
-                target.sla_response_due = now + timedelta(minutes=priority.sla_response_time)
+                target.sla_response_due = calendar.add(now, priority.sla_response_time)
             if priority.sla_resolution_time:
-                target.sla_resolution_due = now + timedelta(minutes=priority.sla_resolution_time)
+                target.sla_resolution_due = calendar.add(now, priority.sla_resolution_time)
 
 # Event listener for first response
 @event.listens_for(TicketComment, 'after_insert')
 def check_first_response(mapper, connection, target):
-    ticket = Ticket.query.get(target.ticket_id)
-    if ticket and not ticket.first_response_at and target.user_id:
-        # Only count agent responses, not requester responses
-        user = User.query.get(target.user_id)
-        if user and user.role.name in ['Administrator', 'Agent']:
-            ticket.first_response_at = datetime.utcnow()
-            if ticket.sla_response_due and ticket.first_response_at <= ticket.sla_response_due:
-                ticket.sla_response_met = True
-            db.session.add(ticket)
-            # db.session.commit() # Removed commit: Let the main transaction handle it
+    if not target.user_id:
+        return
+    # Only count staff responses, not requester responses
+    user = User.query.get(target.user_id)
+    if not (user and user.can(Permission.INTERNAL_COMMENTS)):
+        return
+    # Written through the connection: changes to the Ticket object inside a flush are discarded
+    now = datetime.utcnow()
+    tickets = Ticket.__table__
+    connection.execute(
+        tickets.update()
+        .where(tickets.c.id == target.ticket_id, tickets.c.first_response_at.is_(None))
+        .values(first_response_at=now,
+                sla_response_met=db.case((tickets.c.sla_response_due >= now, True), else_=tickets.c.sla_response_met),
+                # Let the next SLA pass pick up the met response target
+                sla_next_check_at=now)
+    )
 
 # Create default data for the application
 def create_default_data():
@@ -0,0 +1,178 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are addressed by the sort value and id of the row at their edge rather
+than by an offset, so fetching page 1000 costs the same as fetching page 1
+and rows inserted meanwhile don't shift the pages a reader is walking.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime, date
+from flask import current_app, request
+from sqlalchemy import tuple_, or_, and_, DateTime, Date
+
+
+def encode_cursor(sort_key, descending, value, row_id, backwards=False):
+    """Opaque, URL-safe token for the position just past ``(value, row_id)``."""
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    payload = {'s': sort_key, 'd': 'desc' if descending else 'asc', 'v': value, 'i': row_id}
+    if backwards:
+        payload['b'] = 1
+    raw = json.dumps(payload, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a cursor token, returning None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        return {
+            'sort': payload['s'],
+            'descending': payload['d'] == 'desc',
+            'value': payload['v'],
+            'id': int(payload['i']),
+            'backwards': bool(payload.get('b')),
+        }
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        return None
+
+
+def _coerce(column, value):
+    # Cursor values travel as JSON; restore the column's Python type, raising
+    # ValueError or TypeError for a value the column can't hold
+    if value is None:
+        return None
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, Date):
+        return date.fromisoformat(value)
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, python_type) or (python_type is int and isinstance(value, bool)):
+        raise TypeError(f'Cursor value {value!r} does not fit a {python_type.__name__} column')
+    return value
+
+
+def per_page_from_request(config_key='TICKETS_PER_PAGE'):
+    """Page size from ``?per_page=``, clamped to the configured maximum."""
+    default = current_app.config.get(config_key, 50)
+    maximum = current_app.config.get('MAX_PER_PAGE', 200)
+    per_page = request.args.get('per_page', type=int, default=default)
+    return max(1, min(per_page, maximum))
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor, prev_cursor, sort_key, descending, per_page):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.sort_key = sort_key
+        self.descending = descending
+        self.per_page = per_page
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def url_args(self, cursor):
+        """Current query string arguments with the cursor replaced."""
+        args = request.args.to_dict()
+        args.pop('cursor', None)
+        if cursor:
+            args['cursor'] = cursor
+        return args
+
+    def sort_args(self, sort_key):
+        """Arguments for sorting by ``sort_key`` from the first page, toggling direction if already sorted by it."""
+        args = self.url_args(None)
+        descending = not self.descending if sort_key == self.sort_key else True
+        args.update(sort=sort_key, dir='desc' if descending else 'asc')
+        return args
+
+
+def keyset_paginate(query, sort_key, column, id_column, descending=True, per_page=50,
+                    cursor=None, nullable=False):
+    """Return one KeysetPage of ``query`` ordered by ``(column, id_column)``.
+
+    ``cursor`` is a token from a previous page; it is ignored (giving the first
+    page) if it was issued for a different sort or holds a value the sort
+    column can't take. Nullable sort columns order their NULLs last in both
+    directions.
+    """
+    position = decode_cursor(cursor)
+    if position and (position['sort'] != sort_key or position['descending'] != descending):
+        position = None
+    if position:
+        try:
+            value = _coerce(column, position['value'])
+            if value is None and not nullable:
+                raise ValueError('Cursor has no value for a column without NULLs')
+        except (ValueError, TypeError):
+            position = None
+    backwards = bool(position and position['backwards'])
+
+    # Walking backwards is walking forwards in the reversed order
+    scan_descending = descending != backwards
+
+    if position:
+        query = query.filter(_after(column, id_column, value, position['id'],
+                                    scan_descending, nullable, nulls_first=backwards))
+
+    ordering = []
+    if nullable:
+        null_last = column.is_(None)
+        ordering.append(null_last.desc() if backwards else null_last.asc())
+    if scan_descending:
+        ordering += [column.desc(), id_column.desc()]
+    else:
+        ordering += [column.asc(), id_column.asc()]
+
+    rows = query.order_by(*ordering).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def edge_cursor(row, backwards):
+        return encode_cursor(sort_key, descending, getattr(row, column.key), getattr(row, id_column.key),
+                             backwards=backwards)
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = edge_cursor(rows[-1], False)
+        if position and (has_more or not backwards):
+            prev_cursor = edge_cursor(rows[0], True)
+
+    return KeysetPage(rows, next_cursor, prev_cursor, sort_key, descending, per_page)
+
+
+def _after(column, id_column, value, row_id, descending, nullable, nulls_first):
+    """Criterion selecting the rows that follow ``(value, row_id)`` in scan order."""
+    def beyond(left, right):
+        return left < right if descending else left > right
+
+    if not nullable:
+        return beyond(tuple_(column, id_column), tuple_(value, row_id))
+
+    if value is None:
+        # Inside the NULL block: more NULLs, then (when scanning backwards) everything else
+        tail = and_(column.is_(None), beyond(id_column, row_id))
+        return or_(tail, column.is_not(None)) if nulls_first else tail
+
+    remaining = or_(beyond(column, value), and_(column == value, beyond(id_column, row_id)))
+    # NULLs sort after every value, so they follow when scanning forwards only
+    return remaining if nulls_first else or_(remaining, column.is_(None))
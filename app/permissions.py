@@ -0,0 +1,46 @@
+"""
+Capabilities granted to each role, as bit flags.
+
+Every role stores its own flags in ``Role.permissions``. New roles, and
+existing ones without flags, start from ``DEFAULT_ROLE_PERMISSIONS`` for
+their name. The flags are read once, when the signed-in user's principal
+is loaded, so a permission check is a single integer AND.
+"""
+from functools import wraps
+from flask import flash, redirect, url_for
+from flask_login import current_user
+
+
+class Permission:
+    VIEW_ALL_TICKETS = 0x01   # open tickets created by other users
+    INTERNAL_COMMENTS = 0x02  # read and write internal comments
+    ASSIGN = 0x04             # assign tickets and change their status
+    ADMIN_SETTINGS = 0x08     # manage users and application settings
+    DELETE_TICKETS = 0x10
+
+
+STAFF_PERMISSIONS = Permission.VIEW_ALL_TICKETS | Permission.INTERNAL_COMMENTS | Permission.ASSIGN
+
+# Flags a role starts with; roles not listed here (e.g. User) get none
+DEFAULT_ROLE_PERMISSIONS = {
+    'Administrator': STAFF_PERMISSIONS | Permission.ADMIN_SETTINGS | Permission.DELETE_TICKETS,
+    'Agent': STAFF_PERMISSIONS,
+    'Technician': STAFF_PERMISSIONS,
+}
+
+
+def default_permissions(role_name):
+    return DEFAULT_ROLE_PERMISSIONS.get(role_name, 0)
+
+
+def permission_required(permission):
+    """Redirect to the dashboard unless the current user has ``permission``."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not current_user.can(permission):
+                flash('You do not have permission to access this page.', 'danger')
+                return redirect(url_for('main.dashboard'))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
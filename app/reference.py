@@ -0,0 +1,88 @@
+"""
+In-memory registry of the small lookup tables: ticket statuses, priorities
+and types, and user roles.
+
+The tables are read once per process into immutable records, from which
+forms take their choice lists and templates look up names and colours by
+id. Any write to them bumps the shared 'reference_data' version stamp, so
+every process reloads after the settings screens change them.
+"""
+from collections import namedtuple
+from sqlalchemy import select
+from app import db
+from app.cache import VersionedCache
+from app.models import TicketStatus, TicketPriority, TicketType, Role
+
+StatusRef = namedtuple('StatusRef', 'id name description color is_default is_closed')
+PriorityRef = namedtuple('PriorityRef', 'id name description color is_default sla_response_time sla_resolution_time '
+                                       'calendar_id')
+TypeRef = namedtuple('TypeRef', 'id name description is_default')
+RoleRef = namedtuple('RoleRef', 'id name description permissions')
+
+REFERENCE_VERSION = 'reference_data'
+
+
+def _load(model, record):
+    columns = [getattr(model, field) for field in record._fields]
+    return [record(*row) for row in db.session.execute(select(*columns).order_by(model.id))]
+
+
+class ReferenceTables:
+    def __init__(self, statuses, priorities, types, roles):
+        self.statuses = statuses
+        self.priorities = priorities
+        self.types = types
+        self.roles = roles
+        self.status_by_id = {status.id: status for status in statuses}
+        self.priority_by_id = {priority.id: priority for priority in priorities}
+        self.type_by_id = {ticket_type.id: ticket_type for ticket_type in types}
+        self.role_by_id = {role.id: role for role in roles}
+        self.closed_status_ids = frozenset(status.id for status in statuses if status.is_closed)
+
+
+class ReferenceRegistry(VersionedCache):
+    def __init__(self):
+        super().__init__(REFERENCE_VERSION, 'SETTINGS_VERSION_CHECK_INTERVAL')
+
+    def load(self):
+        return ReferenceTables(
+            _load(TicketStatus, StatusRef),
+            _load(TicketPriority, PriorityRef),
+            _load(TicketType, TypeRef),
+            _load(Role, RoleRef),
+        )
+
+    def __getattr__(self, name):
+        # statuses, status_by_id, closed_status_ids, ... come from the loaded tables
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.data(), name)
+
+    def status_choices(self):
+        return [(status.id, status.name) for status in self.data().statuses]
+
+    def priority_choices(self):
+        return [(priority.id, priority.name) for priority in self.data().priorities]
+
+    def type_choices(self):
+        return [(ticket_type.id, ticket_type.name) for ticket_type in self.data().types]
+
+    def role_choices(self):
+        return [(role.id, role.name) for role in self.data().roles]
+
+    @staticmethod
+    def _default(records):
+        return next((record for record in records if record.is_default), None)
+
+    def default_status(self):
+        return self._default(self.data().statuses)
+
+    def default_priority(self):
+        return self._default(self.data().priorities)
+
+    def default_type(self):
+        return self._default(self.data().types)
+
+
+reference = ReferenceRegistry()
+reference.watch(TicketStatus, TicketPriority, TicketType, Role)
@@ -0,0 +1,212 @@
+"""
+Read-replica routing.
+
+When ``REPLICA_DATABASE_URL`` is set, the replica is configured as the
+'replica' bind. Functions decorated with ``read_only`` (the reporting,
+listing and search views and the dashboard view) send their SELECTs to it;
+``primary_only`` code inside them reads from the primary.
+Flushes and other statements always go to the primary. Whenever the replica
+is unreachable or more than ``REPLICA_MAX_LAG`` seconds behind, queries fall
+back to the primary.
+
+With two SQLite files the replica is a copy of the primary refreshed through
+the SQLite backup API, every ``REPLICA_SYNC_INTERVAL`` seconds or with
+``flask replica sync``; that setup is meant for local testing.
+"""
+import threading
+import time
+from functools import wraps
+import click
+from flask import current_app, g, has_app_context
+from flask.cli import AppGroup
+from flask_sqlalchemy.session import Session
+
+replica_cli = AppGroup('replica', help='Inspect and sync the read replica.')
+
+REPLICA_BIND = 'replica'
+
+# Written into a SQLite replica after each sync; the primary never has it
+SYNC_TABLE = 'replica_sync'
+
+
+def _db():
+    # app.db is created with RoutingSession, so it can't be imported here
+    return current_app.extensions['sqlalchemy']
+
+
+class RoutingSession(Session):
+    """Session that reads from the replica inside ``read_only`` code."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_app_context() and g.get('read_replica')
+                and clause is not None and getattr(clause, 'is_select', False)):
+            engine = replica.engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(f):
+    """Run ``f`` with its SELECTs routed to the replica while it is in sync."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        outer = g.get('read_replica')
+        if outer is None:
+            g.read_replica = replica.usable()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            if outer is None:
+                g.pop('read_replica', None)
+    return decorated_function
+
+
+def primary_only(f):
+    """Run ``f`` with its SELECTs on the primary, even inside ``read_only`` code."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        outer = g.get('read_replica')
+        g.read_replica = False
+        try:
+            return f(*args, **kwargs)
+        finally:
+            if outer is None:
+                g.pop('read_replica', None)
+            else:
+                g.read_replica = outer
+    return decorated_function
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lag = None
+        self._next_check = 0
+        self._syncing = False
+        self._last_sync = None
+
+    def engine(self):
+        return _db().engines.get(REPLICA_BIND)
+
+    def lag(self):
+        """Seconds the replica is behind the primary (infinite if unknown)."""
+        engine = self.engine()
+        if engine is None:
+            return float('inf')
+        with engine.connect() as connection:
+            if engine.dialect.name == 'sqlite':
+                if not self._has_sync_table(connection):
+                    return float('inf')
+                synced_at = connection.exec_driver_sql(f'SELECT max(synced_at) FROM {SYNC_TABLE}').scalar()
+                return time.time() - synced_at if synced_at is not None else float('inf')
+            if engine.dialect.name == 'postgresql':
+                # Zero once the standby has replayed everything it received
+                return connection.exec_driver_sql(
+                    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+                ).scalar() or 0
+        return 0
+
+    @staticmethod
+    def _has_sync_table(connection):
+        return connection.exec_driver_sql(
+            f"SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = '{SYNC_TABLE}'"
+        ).scalar() > 0
+
+    def usable(self):
+        """Whether reads may go to the replica, re-checking its lag at most every few seconds."""
+        if self.engine() is None:
+            return False
+        now = time.monotonic()
+        if now >= self._next_check:
+            try:
+                lag = self.lag()
+            except Exception:
+                current_app.logger.warning('Read replica unavailable; reading from the primary', exc_info=True)
+                lag = float('inf')
+            with self._lock:
+                self._lag = lag
+                self._next_check = now + current_app.config.get('REPLICA_LAG_CHECK_INTERVAL', 5)
+        return self._lag <= current_app.config.get('REPLICA_MAX_LAG', 30)
+
+    def sync(self):
+        """Copy the primary SQLite database onto the replica file with the backup API."""
+        db = _db()
+        engine = self.engine()
+        if engine is None or engine.dialect.name != 'sqlite' or db.engine.dialect.name != 'sqlite':
+            raise RuntimeError('Syncing needs a SQLite primary and a SQLite replica')
+
+        started_at = time.time()
+        with db.engine.connect() as source, engine.connect() as target:
+            target_connection = target.connection.dbapi_connection
+            # Replica connections are query_only (see configure_sqlite); this one writes the copy
+            target_connection.execute('PRAGMA query_only = OFF')
+            try:
+                source.connection.dbapi_connection.backup(target_connection)
+                target_connection.execute(f'CREATE TABLE IF NOT EXISTS {SYNC_TABLE} (synced_at REAL)')
+                target_connection.execute(f'DELETE FROM {SYNC_TABLE}')
+                target_connection.execute(f'INSERT INTO {SYNC_TABLE} (synced_at) VALUES (?)', (started_at,))
+                target_connection.commit()
+            finally:
+                target_connection.execute('PRAGMA query_only = ON')
+        with self._lock:
+            self._last_sync = time.monotonic()
+            self._next_check = 0
+        return started_at
+
+    def sync_if_due(self, app):
+        """Start a background sync of a SQLite replica once the configured interval has passed."""
+        interval = app.config.get('REPLICA_SYNC_INTERVAL', 0)
+        with self._lock:
+            if not interval or self._syncing:
+                return
+            if self._last_sync is not None and time.monotonic() - self._last_sync < interval:
+                return
+            self._syncing = True
+
+        def sync():
+            try:
+                with app.app_context():
+                    self.sync()
+            except Exception:
+                app.logger.exception('Error syncing the read replica')
+            finally:
+                with self._lock:
+                    self._syncing = False
+
+        threading.Thread(target=sync, daemon=True).start()
+
+
+replica = ReplicaRouter()
+
+
+def configure_replica(app):
+    """Start periodic syncing for a SQLite replica, if configured."""
+    engine = replica.engine()
+    if engine is None:
+        return
+    if engine.dialect.name == 'sqlite' and _db().engine.dialect.name == 'sqlite' and app.config.get('REPLICA_SYNC_INTERVAL'):
+        replica.sync()
+        app.before_request(lambda: replica.sync_if_due(app))
+
+
+@replica_cli.command('sync')
+def sync():
+    """Copy the SQLite primary onto the SQLite replica now."""
+    try:
+        replica.sync()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo('Replica synced.')
+
+
+@replica_cli.command('status')
+def status():
+    """Show the replica's lag and whether reads are routed to it."""
+    if replica.engine() is None:
+        click.echo('No replica configured (set REPLICA_DATABASE_URL).')
+        return
+    lag = replica.lag()
+    max_lag = current_app.config.get('REPLICA_MAX_LAG', 30)
+    state = 'in use' if lag <= max_lag else 'behind; reads go to the primary'
+    click.echo(f'Replica lag: {lag:.1f}s (limit {max_lag}s), {state}.')
@@ -0,0 +1,512 @@
+"""
+Incrementally maintained rollup tables.
+
+Listeners in this module keep the summary tables in step with the rows they
+summarise. They run inside the flush that writes the source row, so a rollup
+is committed or rolled back together with the change that caused it.
+
+Every rollup row is identified by a unique key, and ``bump()`` adds to it with
+a single upsert, so concurrent transactions creating the same key cannot
+insert it twice. Nullable key values are stored as ``NO_KEY``.
+"""
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect, select, update, insert, delete, func, case, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.database import day_of
+from app.models import Ticket, TicketStatus, TicketCounter, AgentStats, TimeEntry, Expense, DailyBillingTotal
+
+rollups_cli = AppGroup('rollups', help='Maintain the precomputed rollup tables.')
+
+# Ticket columns that make up a TicketCounter key
+COUNTER_COLUMNS = ('status_id', 'priority_id', 'assigned_to', 'created_by')
+
+# TimeEntry columns that feed AgentStats.total_time
+TIME_COLUMNS = ('user_id', 'duration')
+
+# TimeEntry columns that feed Ticket.total_seconds
+TICKET_TIME_COLUMNS = ('ticket_id', 'duration')
+
+# TimeEntry and Expense columns that feed DailyBillingTotal
+BILLED_TIME_COLUMNS = ('start_time', 'user_id', 'ticket_id', 'billable', 'duration')
+BILLED_EXPENSE_COLUMNS = ('date', 'user_id', 'ticket_id', 'billable', 'amount')
+
+
+# Stored in rollup key columns in place of NULL, which a unique key never matches
+NO_KEY = 0
+
+# Databases with INSERT ... ON CONFLICT DO UPDATE
+_UPSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def _stored_key(key):
+    return {column: NO_KEY if value is None else value for column, value in key.items()}
+
+
+def _key_conditions(table, key):
+    return [table.c[column] == value for column, value in _stored_key(key).items()]
+
+
+def bump(connection, table, key, **deltas):
+    """Add ``deltas`` to the rollup row identified by ``key``, creating it if needed.
+
+    ``key`` must be the table's primary key or unique key.
+    """
+    key = _stored_key(key)
+    upsert = _UPSERTS.get(connection.dialect.name)
+    if upsert is not None:
+        statement = upsert(table).values(**key, **deltas)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=list(key),
+            set_={column: table.c[column] + statement.excluded[column] for column in deltas},
+        ))
+        return
+
+    increment = (
+        update(table)
+        .where(*_key_conditions(table, key))
+        .values({column: table.c[column] + delta for column, delta in deltas.items()})
+    )
+    if connection.execute(increment).rowcount:
+        return
+    try:
+        with connection.begin_nested():
+            connection.execute(insert(table).values(**key, **deltas))
+    except IntegrityError:
+        # Another transaction created the row first
+        connection.execute(increment)
+
+
+def _status_is_closed(connection, status_id):
+    if not status_id:
+        return False
+    return bool(connection.execute(
+        select(TicketStatus.is_closed).where(TicketStatus.id == status_id)
+    ).scalar())
+
+
+def _counter_key(connection, values):
+    key = dict(values)
+    key['is_closed'] = _status_is_closed(connection, key['status_id'])
+    return key
+
+
+def _previous_values(target, columns):
+    state = inspect(target)
+    values = {}
+    for column in columns:
+        history = state.attrs[column].history
+        if history.deleted:
+            values[column] = history.deleted[0]
+        elif history.unchanged:
+            values[column] = history.unchanged[0]
+        else:
+            values[column] = None
+    return values
+
+
+def _current_values(target, columns):
+    return {column: getattr(target, column) for column in columns}
+
+
+def _tracks_old_value(target, value, oldvalue, initiator):
+    # Registering with active_history loads the old value on assignment, so the
+    # update listeners can always tell which rollup row to decrement.
+    pass
+
+
+for _column in COUNTER_COLUMNS:
+    event.listen(getattr(Ticket, _column), 'set', _tracks_old_value, active_history=True)
+
+for _column in set(TIME_COLUMNS + TICKET_TIME_COLUMNS + BILLED_TIME_COLUMNS):
+    event.listen(getattr(TimeEntry, _column), 'set', _tracks_old_value, active_history=True)
+
+for _column in BILLED_EXPENSE_COLUMNS:
+    event.listen(getattr(Expense, _column), 'set', _tracks_old_value, active_history=True)
+
+
+def _bump_agent_tickets(connection, key, sign):
+    # Agent stats follow the assignee and open/closed parts of a counter key
+    if key['assigned_to'] is None:
+        return
+    deltas = {'assigned_tickets': sign}
+    deltas['closed_tickets' if key['is_closed'] else 'open_tickets'] = sign
+    bump(connection, AgentStats.__table__, {'user_id': key['assigned_to']}, **deltas)
+
+
+def _bump_agent_time(connection, values, sign):
+    if values['user_id'] is None or not values['duration']:
+        return
+    bump(connection, AgentStats.__table__, {'user_id': values['user_id']},
+         total_time=sign * values['duration'])
+
+
+def _bump_ticket_time(connection, values, sign):
+    if values['ticket_id'] is None or not values['duration']:
+        return
+    tickets = Ticket.__table__
+    # Logging time is not an edit, so updated_at keeps its value
+    connection.execute(
+        update(tickets)
+        .where(tickets.c.id == values['ticket_id'])
+        .values(total_seconds=tickets.c.total_seconds + sign * values['duration'],
+                updated_at=tickets.c.updated_at)
+    )
+
+
+def _billing_key(day, values):
+    return {'day': day, 'user_id': values['user_id'], 'ticket_id': values['ticket_id'],
+            'billable': bool(values['billable'])}
+
+
+def _cents(amount):
+    return int(round((amount or 0) * 100))
+
+
+def _bump_billing_total(connection, key, sign, **deltas):
+    table = DailyBillingTotal.__table__
+    bump(connection, table, key, **deltas)
+    if sign < 0:
+        # Drop rows whose entries have all been removed or moved away
+        connection.execute(delete(table).where(*_key_conditions(table, key),
+                                               table.c.time_seconds == 0, table.c.expense_cents == 0))
+
+
+def _bump_billed_time(connection, values, sign):
+    if values['start_time'] is None or not values['duration']:
+        return
+    _bump_billing_total(connection, _billing_key(values['start_time'].date(), values), sign,
+                        time_seconds=sign * values['duration'])
+
+
+def _bump_billed_expense(connection, values, sign):
+    if values['date'] is None or not _cents(values['amount']):
+        return
+    _bump_billing_total(connection, _billing_key(values['date'], values), sign,
+                        expense_cents=sign * _cents(values['amount']))
+
+
+@event.listens_for(Ticket, 'after_insert')
+def count_new_ticket(mapper, connection, target):
+    key = _counter_key(connection, _current_values(target, COUNTER_COLUMNS))
+    bump(connection, TicketCounter.__table__, key, count=1)
+    _bump_agent_tickets(connection, key, 1)
+
+
+@event.listens_for(Ticket, 'after_update')
+def recount_updated_ticket(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[column].history.has_changes() for column in COUNTER_COLUMNS):
+        return
+    old_key = _counter_key(connection, _previous_values(target, COUNTER_COLUMNS))
+    new_key = _counter_key(connection, _current_values(target, COUNTER_COLUMNS))
+    if old_key != new_key:
+        bump(connection, TicketCounter.__table__, old_key, count=-1)
+        bump(connection, TicketCounter.__table__, new_key, count=1)
+    if (old_key['assigned_to'], old_key['is_closed']) != (new_key['assigned_to'], new_key['is_closed']):
+        _bump_agent_tickets(connection, old_key, -1)
+        _bump_agent_tickets(connection, new_key, 1)
+
+
+@event.listens_for(Ticket, 'before_delete')
+def uncount_deleted_ticket(mapper, connection, target):
+    key = _counter_key(connection, _previous_values(target, COUNTER_COLUMNS))
+    bump(connection, TicketCounter.__table__, key, count=-1)
+    _bump_agent_tickets(connection, key, -1)
+
+
+@event.listens_for(TicketStatus, 'after_update')
+def move_counters_with_status(mapper, connection, target):
+    history = inspect(target).attrs.is_closed.history
+    if history.has_changes():
+        connection.execute(
+            update(TicketCounter.__table__)
+            .where(TicketCounter.status_id == target.id)
+            .values(is_closed=bool(target.is_closed))
+        )
+        _recount_agent_tickets(connection)
+
+
+@event.listens_for(TimeEntry, 'after_insert')
+def add_agent_time(mapper, connection, target):
+    _bump_agent_time(connection, _current_values(target, TIME_COLUMNS), 1)
+
+
+@event.listens_for(TimeEntry, 'after_update')
+def move_agent_time(mapper, connection, target):
+    old_values = _previous_values(target, TIME_COLUMNS)
+    new_values = _current_values(target, TIME_COLUMNS)
+    if old_values != new_values:
+        _bump_agent_time(connection, old_values, -1)
+        _bump_agent_time(connection, new_values, 1)
+
+
+@event.listens_for(TimeEntry, 'before_delete')
+def remove_agent_time(mapper, connection, target):
+    _bump_agent_time(connection, _previous_values(target, TIME_COLUMNS), -1)
+
+
+@event.listens_for(TimeEntry, 'after_insert')
+def add_ticket_time(mapper, connection, target):
+    _bump_ticket_time(connection, _current_values(target, TICKET_TIME_COLUMNS), 1)
+
+
+@event.listens_for(TimeEntry, 'after_update')
+def move_ticket_time(mapper, connection, target):
+    old_values = _previous_values(target, TICKET_TIME_COLUMNS)
+    new_values = _current_values(target, TICKET_TIME_COLUMNS)
+    if old_values != new_values:
+        _bump_ticket_time(connection, old_values, -1)
+        _bump_ticket_time(connection, new_values, 1)
+
+
+@event.listens_for(TimeEntry, 'before_delete')
+def remove_ticket_time(mapper, connection, target):
+    _bump_ticket_time(connection, _previous_values(target, TICKET_TIME_COLUMNS), -1)
+
+
+@event.listens_for(TimeEntry, 'after_insert')
+def add_billed_time(mapper, connection, target):
+    _bump_billed_time(connection, _current_values(target, BILLED_TIME_COLUMNS), 1)
+
+
+@event.listens_for(TimeEntry, 'after_update')
+def move_billed_time(mapper, connection, target):
+    old_values = _previous_values(target, BILLED_TIME_COLUMNS)
+    new_values = _current_values(target, BILLED_TIME_COLUMNS)
+    if old_values != new_values:
+        _bump_billed_time(connection, old_values, -1)
+        _bump_billed_time(connection, new_values, 1)
+
+
+@event.listens_for(TimeEntry, 'before_delete')
+def remove_billed_time(mapper, connection, target):
+    _bump_billed_time(connection, _previous_values(target, BILLED_TIME_COLUMNS), -1)
+
+
+@event.listens_for(Expense, 'after_insert')
+def add_billed_expense(mapper, connection, target):
+    _bump_billed_expense(connection, _current_values(target, BILLED_EXPENSE_COLUMNS), 1)
+
+
+@event.listens_for(Expense, 'after_update')
+def move_billed_expense(mapper, connection, target):
+    old_values = _previous_values(target, BILLED_EXPENSE_COLUMNS)
+    new_values = _current_values(target, BILLED_EXPENSE_COLUMNS)
+    if old_values != new_values:
+        _bump_billed_expense(connection, old_values, -1)
+        _bump_billed_expense(connection, new_values, 1)
+
+
+@event.listens_for(Expense, 'before_delete')
+def remove_billed_expense(mapper, connection, target):
+    _bump_billed_expense(connection, _previous_values(target, BILLED_EXPENSE_COLUMNS), -1)
+
+
+def _agent_ticket_totals():
+    counters = TicketCounter.__table__
+    return (
+        select(
+            counters.c.assigned_to,
+            func.sum(counters.c.count),
+            func.sum(case((counters.c.is_closed == False, counters.c.count), else_=0)),
+            func.sum(case((counters.c.is_closed == True, counters.c.count), else_=0)),
+        )
+        .where(counters.c.assigned_to != NO_KEY)
+        .group_by(counters.c.assigned_to)
+    )
+
+
+def _recount_agent_tickets(connection):
+    # Derive the per-agent ticket columns from the (already correct) counter table
+    connection.execute(update(AgentStats.__table__).values(
+        assigned_tickets=0, open_tickets=0, closed_tickets=0
+    ))
+    for user_id, assigned, open_count, closed_count in connection.execute(_agent_ticket_totals()).all():
+        bump(connection, AgentStats.__table__, {'user_id': user_id},
+             assigned_tickets=assigned, open_tickets=open_count, closed_tickets=closed_count)
+
+
+def ticket_count(**filters):
+    """Number of tickets matching ``filters``, read from the counter table.
+
+    Filters are TicketCounter columns; passing ``assigned_to=None`` counts
+    unassigned tickets.
+    """
+    table = TicketCounter.__table__
+    query = select(func.coalesce(func.sum(table.c.count), 0)).where(*_key_conditions(table, filters))
+    return db.session.execute(query).scalar()
+
+
+def ticket_counts_by(column, **filters):
+    """Ticket counts grouped by one counter column, e.g. ``{status_id: count}``."""
+    table = TicketCounter.__table__
+    query = (select(table.c[column], func.sum(table.c.count))
+             .where(*_key_conditions(table, filters))
+             .group_by(table.c[column]))
+    return {None if value == NO_KEY else value: total for value, total in db.session.execute(query)}
+
+
+def rebuild_ticket_counters():
+    """Recompute the ticket counter table from scratch."""
+    key = [func.coalesce(getattr(Ticket, column), NO_KEY) for column in COUNTER_COLUMNS]
+    is_closed = func.coalesce(TicketStatus.is_closed, False)
+    source = (
+        select(*key, is_closed, func.count(Ticket.id))
+        .outerjoin(TicketStatus, Ticket.status_id == TicketStatus.id)
+        .group_by(*key, is_closed)
+    )
+    db.session.execute(delete(TicketCounter.__table__))
+    db.session.execute(insert(TicketCounter.__table__).from_select(
+        list(COUNTER_COLUMNS) + ['is_closed', 'count'], source
+    ))
+    db.session.commit()
+
+
+def rebuild_agent_stats():
+    """Recompute the per-agent statistics from the counter and time entry tables."""
+    stats = {}
+    for user_id, assigned, open_count, closed_count in db.session.execute(_agent_ticket_totals()):
+        stats[user_id] = {
+            'user_id': user_id,
+            'assigned_tickets': assigned,
+            'open_tickets': open_count,
+            'closed_tickets': closed_count,
+            'total_time': 0,
+        }
+    time_totals = (
+        select(TimeEntry.user_id, func.sum(TimeEntry.duration))
+        .where(TimeEntry.user_id.is_not(None))
+        .group_by(TimeEntry.user_id)
+    )
+    for user_id, total_time in db.session.execute(time_totals):
+        row = stats.setdefault(user_id, {
+            'user_id': user_id,
+            'assigned_tickets': 0,
+            'open_tickets': 0,
+            'closed_tickets': 0,
+        })
+        row['total_time'] = total_time or 0
+    
+    db.session.execute(delete(AgentStats.__table__))
+    if stats:
+        db.session.execute(insert(AgentStats.__table__), list(stats.values()))
+    db.session.commit()
+
+
+def rebuild_ticket_time():
+    """Recompute every ticket's total_seconds from its time entries."""
+    entry_seconds = (
+        select(func.coalesce(func.sum(TimeEntry.duration), 0))
+        .where(TimeEntry.ticket_id == Ticket.id)
+        .scalar_subquery()
+    )
+    tickets = Ticket.__table__
+    db.session.execute(update(tickets).values(total_seconds=entry_seconds, updated_at=tickets.c.updated_at))
+    db.session.commit()
+
+
+def _ticket_time_missing():
+    # A ticket with logged time but no total: the column was added to an existing database
+    return db.session.execute(
+        select(TimeEntry.id)
+        .join(Ticket, TimeEntry.ticket_id == Ticket.id)
+        .where(Ticket.total_seconds == 0, TimeEntry.duration > 0)
+        .limit(1)
+    ).first() is not None
+
+
+def rebuild_daily_billing():
+    """Recompute the daily billing totals from the time entry and expense tables."""
+    totals = {}
+    
+    def totals_for(day, user_id, ticket_id, billable):
+        key = _stored_key(_billing_key(day, {'user_id': user_id, 'ticket_id': ticket_id, 'billable': billable}))
+        return totals.setdefault(tuple(key.values()), dict(key, time_seconds=0, expense_cents=0))
+    
+    day = day_of(TimeEntry.start_time)
+    time_totals = (
+        select(day, TimeEntry.user_id, TimeEntry.ticket_id, TimeEntry.billable, func.sum(TimeEntry.duration))
+        .where(TimeEntry.start_time.is_not(None))
+        .group_by(day, TimeEntry.user_id, TimeEntry.ticket_id, TimeEntry.billable)
+    )
+    for entry_day, user_id, ticket_id, billable, seconds in db.session.execute(time_totals):
+        totals_for(entry_day, user_id, ticket_id, billable)['time_seconds'] += seconds or 0
+    
+    expense_totals = (
+        select(Expense.date, Expense.user_id, Expense.ticket_id, Expense.billable,
+               func.sum(func.round(Expense.amount * 100)))
+        .where(Expense.date.is_not(None))
+        .group_by(Expense.date, Expense.user_id, Expense.ticket_id, Expense.billable)
+    )
+    for expense_day, user_id, ticket_id, billable, cents in db.session.execute(expense_totals):
+        totals_for(expense_day, user_id, ticket_id, billable)['expense_cents'] += int(cents or 0)
+    
+    db.session.execute(delete(DailyBillingTotal.__table__))
+    rows = [row for row in totals.values() if row['time_seconds'] or row['expense_cents']]
+    if rows:
+        db.session.execute(insert(DailyBillingTotal.__table__), rows)
+    db.session.commit()
+
+
+def agent_stats(user_id):
+    """Precomputed statistics for one user, or zeros if they have none yet."""
+    return db.session.get(AgentStats, user_id) or AgentStats(
+        user_id=user_id, assigned_tickets=0, open_tickets=0, closed_tickets=0, total_time=0
+    )
+
+
+def _needs_rekeying(model, columns):
+    # Rows from before the keys were unique: NULLs in key columns, or duplicate keys
+    key = [getattr(model, column) for column in columns]
+    has_nulls = select(model.id).where(or_(*[column.is_(None) for column in key])).limit(1)
+    duplicates = select(*key).group_by(*key).having(func.count() > 1).limit(1)
+    return (db.session.execute(has_nulls).first() is not None
+            or db.session.execute(duplicates).first() is not None)
+
+
+def _has_retired_columns(model):
+    # Columns the table still has but the model no longer declares
+    declared = {column.name for column in model.__table__.columns}
+    return any(column['name'] not in declared for column in db.inspect(db.engine).get_columns(model.__tablename__))
+
+
+def _recreate_table(model):
+    connection = db.session.connection()
+    model.__table__.drop(connection)
+    model.__table__.create(connection)
+
+
+def seed_empty_rollups():
+    """Build the rollup tables on first start against an existing database, and
+    rebuild any whose rows or columns predate the current layout."""
+    if (TicketCounter.query.first() is None and Ticket.query.first() is not None
+            or _needs_rekeying(TicketCounter, COUNTER_COLUMNS + ('is_closed',))):
+        rebuild_ticket_counters()
+    if AgentStats.query.first() is None and (Ticket.query.first() is not None or TimeEntry.query.first() is not None):
+        rebuild_agent_stats()
+    if _ticket_time_missing():
+        rebuild_ticket_time()
+    if _has_retired_columns(DailyBillingTotal):
+        # Totals from before expenses were kept in cents: the old expense_amount
+        # column is NOT NULL without a default, so start the table over
+        _recreate_table(DailyBillingTotal)
+        rebuild_daily_billing()
+    elif (DailyBillingTotal.query.first() is None and (TimeEntry.query.first() is not None or Expense.query.first() is not None)
+            or _needs_rekeying(DailyBillingTotal, ('day', 'user_id', 'ticket_id', 'billable'))):
+        rebuild_daily_billing()
+
+
+@rollups_cli.command('reconcile')
+def reconcile():
+    """Rebuild every rollup table from the source rows."""
+    rebuild_ticket_counters()
+    click.echo(f'Ticket counters rebuilt: {ticket_count()} tickets.')
+    rebuild_agent_stats()
+    click.echo(f'Agent statistics rebuilt: {AgentStats.query.count()} users.')
+    rebuild_ticket_time()
+    click.echo('Ticket time totals rebuilt.')
+    rebuild_daily_billing()
+    click.echo(f'Daily billing totals rebuilt: {DailyBillingTotal.query.count()} rows.')
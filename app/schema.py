@@ -0,0 +1,41 @@
+"""
+Columns added to tables that already exist.
+
+``db.create_all()`` creates missing tables but never alters existing ones, so
+a database created by an earlier version lacks the columns added to the
+models since. ``add_missing_columns`` adds them with ``ALTER TABLE ... ADD
+COLUMN`` at startup, before anything queries them, the same way
+``create_missing_indexes`` adds indexes.
+"""
+from sqlalchemy.schema import CreateColumn
+from app import db
+
+
+def add_missing_columns():
+    """Add every column declared on the models that an existing table lacks.
+
+    A column is added with its server default, so a NOT NULL column needs one,
+    and with a REFERENCES clause for its foreign key.
+    Returns the added columns as ``table.column`` names.
+    """
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+
+    added = []
+    with db.engine.begin() as connection:
+        preparer = connection.dialect.identifier_preparer
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                definition = str(CreateColumn(column).compile(dialect=connection.dialect))
+                for foreign_key in column.foreign_keys:
+                    # e.g. ticket_priority.calendar_id; SQLite only accepts this on a NULL-default column
+                    target = foreign_key.column
+                    definition += f' REFERENCES {preparer.format_table(target.table)} ({preparer.quote(target.name)})'
+                connection.exec_driver_sql(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {definition}')
+                added.append(f'{table.name}.{column.name}')
+    return added
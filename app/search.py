@@ -0,0 +1,244 @@
+"""
+Full-text search over tickets, knowledge base articles and assets.
+
+On SQLite the searchable text lives in an FTS5 table kept in step with the
+source rows by mapper events, and queries are ranked with BM25. Each index
+row's rowid encodes the entity kind and primary key, so syncing one record
+touches a single row. Other databases fall back to ``LIKE`` matching.
+"""
+import re
+import click
+import markupsafe
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect, or_, select, insert, delete, text, table, column, literal, func, Integer, String, Float
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.models import Ticket, KnowledgeBaseArticle, Asset
+
+search_cli = AppGroup('search', help='Maintain the full-text search index.')
+
+SEARCH_TABLE = 'search_index'
+search_index = table(SEARCH_TABLE, column('rowid'), column('kind'), column('title'), column('body'))
+
+# Room for this many entity kinds in the low bits of an index rowid
+KIND_SLOTS = 8
+
+# Markers snippet() wraps around matches; swapped for <mark> after escaping
+_MATCH_START = '\x02'
+_MATCH_END = '\x03'
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchSource:
+    def __init__(self, model, kind, code, title, body, published=None):
+        self.model = model
+        self.kind = kind
+        self.code = code
+        self.title = title
+        self.body = body
+        self.published = published
+
+    @property
+    def columns(self):
+        columns = (self.title,) + self.body
+        return columns + (self.published,) if self.published else columns
+
+    def rowid(self, entity_id):
+        return entity_id * KIND_SLOTS + self.code
+
+    def is_indexed(self, target):
+        return not self.published or bool(getattr(target, self.published))
+
+    def document(self, target):
+        body = ' '.join(getattr(target, name) or '' for name in self.body)
+        return {
+            'rowid': self.rowid(target.id),
+            'kind': self.kind,
+            'title': getattr(target, self.title) or '',
+            'body': body,
+        }
+
+    def source_rows(self):
+        # Same document as document(), built in SQL for bulk rebuilds
+        model = self.model
+        parts = [func.coalesce(getattr(model, name), '') for name in self.body]
+        body = parts[0]
+        for part in parts[1:]:
+            body = body + ' ' + part
+        query = select(
+            model.id * KIND_SLOTS + self.code,
+            literal(self.kind),
+            func.coalesce(getattr(model, self.title), ''),
+            body
+        )
+        if self.published:
+            query = query.where(getattr(model, self.published) == True)
+        return query
+
+
+SOURCES = {}
+
+
+def fts_enabled(connection=None):
+    """Whether the FTS5 index exists for the current app's database."""
+    bind = connection if connection is not None else db.engine
+    return bind.dialect.name == 'sqlite' and current_app.extensions.get('search_fts', False)
+
+
+def _write_record(connection, source, target):
+    connection.execute(delete(search_index).where(search_index.c.rowid == source.rowid(target.id)))
+    if source.is_indexed(target):
+        connection.execute(insert(search_index).values(**source.document(target)))
+
+
+def _index_record(mapper, connection, target):
+    if fts_enabled(connection):
+        _write_record(connection, SOURCES[mapper.class_], target)
+
+
+def _reindex_record(mapper, connection, target):
+    if not fts_enabled(connection):
+        return
+    source = SOURCES[mapper.class_]
+    state = inspect(target)
+    # Skip updates to columns the index doesn't store (view counts, assignees, ...)
+    if any(state.attrs[name].history.has_changes() for name in source.columns):
+        _write_record(connection, source, target)
+
+
+def _drop_record(mapper, connection, target):
+    if fts_enabled(connection):
+        source = SOURCES[mapper.class_]
+        connection.execute(delete(search_index).where(search_index.c.rowid == source.rowid(target.id)))
+
+
+def _register(source):
+    SOURCES[source.model] = source
+    event.listen(source.model, 'after_insert', _index_record)
+    event.listen(source.model, 'after_update', _reindex_record)
+    event.listen(source.model, 'after_delete', _drop_record)
+
+
+_register(SearchSource(Ticket, 'ticket', 1, 'subject', ('description', 'requester_name', 'requester_email')))
+_register(SearchSource(KnowledgeBaseArticle, 'article', 2, 'title', ('content',), published='is_published'))
+_register(SearchSource(Asset, 'asset', 3, 'name', ('serial_number', 'notes')))
+
+
+def match_expression(kind, query):
+    """FTS5 MATCH string for ``query``: every word, as a prefix, in the title or body."""
+    terms = ' '.join('"%s"*' % token for token in _TOKEN.findall(query))
+    if not terms:
+        return None
+    return 'kind : "%s" AND {title body} : (%s)' % (kind, terms)
+
+
+def highlight(snippet):
+    """Escape an FTS snippet and mark up its matched terms."""
+    escaped = markupsafe.escape(snippet or '')
+    return markupsafe.Markup(
+        str(escaped).replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>')
+    )
+
+
+class SearchResults(list):
+    """Matching records in rank order, with a highlighted snippet per record."""
+
+    def __init__(self, records=(), snippets=None):
+        super().__init__(records)
+        self.snippets = snippets or {}
+
+    def snippet(self, record):
+        return self.snippets.get(record.id)
+
+
+def search_records(model, query, *criteria, limit=20):
+    """Records of ``model`` matching ``query``, best matches first.
+
+    Extra ``criteria`` are applied in SQL alongside the text match, e.g. a
+    category filter for knowledge base articles.
+    """
+    source = SOURCES[model]
+    if not fts_enabled():
+        return _search_like(source, query, criteria, limit)
+
+    match = match_expression(source.kind, query)
+    if match is None:
+        return SearchResults()
+
+    hits = text(
+        'SELECT rowid / :slots AS entity_id, '
+        "snippet(search_index, 2, :start, :end, '…', 16) AS snippet, "
+        'bm25(search_index, 0.0, 10.0, 1.0) AS rank '
+        'FROM search_index WHERE search_index MATCH :match'
+    ).bindparams(slots=KIND_SLOTS, start=_MATCH_START, end=_MATCH_END, match=match).columns(
+        entity_id=Integer, snippet=String, rank=Float
+    ).subquery('hits')
+
+    rows = (
+        db.session.query(model, hits.c.snippet)
+        .join(hits, hits.c.entity_id == model.id)
+        .filter(*criteria)
+        .order_by(hits.c.rank)
+        .limit(limit)
+        .all()
+    )
+    return SearchResults([record for record, _ in rows],
+                         {record.id: highlight(snippet) for record, snippet in rows})
+
+
+def _search_like(source, query, criteria, limit):
+    model = source.model
+    columns = [getattr(model, name) for name in (source.title,) + source.body]
+    records = model.query.filter(
+        or_(*[field.contains(query) for field in columns]),
+        *criteria
+    )
+    if source.published:
+        records = records.filter(getattr(model, source.published) == True)
+    return SearchResults(records.limit(limit).all())
+
+
+def rebuild_search_index():
+    """Repopulate the index from the source tables."""
+    db.session.execute(delete(search_index))
+    for source in SOURCES.values():
+        db.session.execute(insert(search_index).from_select(
+            ['rowid', 'kind', 'title', 'body'], source.source_rows()
+        ))
+    db.session.execute(text("INSERT INTO search_index(search_index) VALUES ('optimize')"))
+    db.session.commit()
+
+
+def ensure_search_index(app):
+    """Create the FTS5 table if needed and fill it on first start."""
+    app.extensions['search_fts'] = False
+    if db.engine.dialect.name != 'sqlite':
+        return
+    created = not inspect(db.engine).has_table(SEARCH_TABLE)
+    try:
+        db.session.execute(text(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS search_index '
+            "USING fts5(kind, title, body, tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+        db.session.commit()
+    except OperationalError:
+        # SQLite built without FTS5
+        db.session.rollback()
+        app.logger.warning('FTS5 is unavailable; search falls back to LIKE matching.')
+        return
+    app.extensions['search_fts'] = True
+    if created:
+        rebuild_search_index()
+
+
+@search_cli.command('reindex')
+def reindex():
+    """Rebuild the full-text search index."""
+    if not fts_enabled():
+        click.echo('The full-text index is only used with SQLite; nothing to do.')
+        return
+    rebuild_search_index()
+    count = db.session.execute(text('SELECT count(*) FROM search_index')).scalar()
+    click.echo(f'Search index rebuilt: {count} documents.')
@@ -8,6 +8,12 @@ class GeneralSettingsForm(FlaskForm):
     ticket_id_format = StringField('Ticket ID Format', validators=[DataRequired(), Length(max=32)])
     submit = SubmitField('Save Settings')
 
+    def validate_ticket_id_format(self, ticket_id_format):
+        try:
+            ticket_id_format.data.format(id=1)
+        except (KeyError, IndexError, ValueError, AttributeError, TypeError):
+            raise ValidationError('Invalid format. Use {id} for the ticket number, e.g. HD-{id:06d}.')
+
 class EmailConfigForm(FlaskForm):
     protocol = SelectField('Protocol', choices=[('IMAP', 'IMAP'), ('Exchange', 'Exchange')], validators=[DataRequired()])
     server = StringField('Server Address', validators=[DataRequired(), Length(max=128)])
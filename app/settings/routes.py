@@ -3,13 +3,16 @@ from flask_login import login_required, current_user
 from app import db
 from app.settings import bp
 from app.settings.forms import GeneralSettingsForm, EmailConfigForm, NotificationSettingForm, SLASettingsForm
-from app.models import Setting, EmailConfig, NotificationSetting, TicketPriority, User, Role
+from app.settings.service import settings
+from app.reference import reference
+from app.permissions import Permission
+from app.models import EmailConfig, NotificationSetting, TicketPriority, User, Role
 from functools import wraps
 
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not current_user.is_administrator():
+        if not current_user.can(Permission.ADMIN_SETTINGS):
             flash('You need administrator privileges to access this page.', 'danger')
             return redirect(url_for('main.dashboard'))
         return f(*args, **kwargs)
@@ -28,32 +31,12 @@ def general():
     form = GeneralSettingsForm()
     
     if form.validate_on_submit():
-        # Update app_name setting
-        app_name_setting = Setting.query.filter_by(key='app_name').first()
-        if app_name_setting:
-            app_name_setting.value = form.app_name.data
-        else:
-            app_name_setting = Setting(key='app_name', value=form.app_name.data, 
-                                      description='Application name displayed in the UI')
-            db.session.add(app_name_setting)
-        
-        # Update company_name setting
-        company_name_setting = Setting.query.filter_by(key='company_name').first()
-        if company_name_setting:
-            company_name_setting.value = form.company_name.data
-        else:
-            company_name_setting = Setting(key='company_name', value=form.company_name.data, 
-                                         description='Company name used in emails and reports')
-            db.session.add(company_name_setting)
-        
-        # Update ticket_id_format setting
-        ticket_id_format_setting = Setting.query.filter_by(key='ticket_id_format').first()
-        if ticket_id_format_setting:
-            ticket_id_format_setting.value = form.ticket_id_format.data
-        else:
-            ticket_id_format_setting = Setting(key='ticket_id_format', value=form.ticket_id_format.data, 
-                                             description='Format for ticket IDs displayed to users')
-            db.session.add(ticket_id_format_setting)
+        # Update app_name, company_name and ticket_id_format settings
+        settings.update({
+            'app_name': form.app_name.data,
+            'company_name': form.company_name.data,
+            'ticket_id_format': form.ticket_id_format.data
+        })
         
         db.session.commit()
         flash('General settings updated successfully', 'success')
@@ -61,17 +44,9 @@ def general():
     
     # Pre-populate form with current settings
     if request.method == 'GET':
-        app_name_setting = Setting.query.filter_by(key='app_name').first()
-        if app_name_setting:
-            form.app_name.data = app_name_setting.value
-        
-        company_name_setting = Setting.query.filter_by(key='company_name').first()
-        if company_name_setting:
-            form.company_name.data = company_name_setting.value
-        
-        ticket_id_format_setting = Setting.query.filter_by(key='ticket_id_format').first()
-        if ticket_id_format_setting:
-            form.ticket_id_format.data = ticket_id_format_setting.value
+        form.app_name.data = settings.get('app_name')
+        form.company_name.data = settings.get('company_name')
+        form.ticket_id_format.data = settings.get('ticket_id_format')
     
     return render_template('settings/general.html', title='General Settings', form=form)
 
@@ -172,18 +147,15 @@ def notifications():
                 db.session.add(notification)
         
         # Update SLA warning threshold
-        sla_threshold_setting = Setting.query.filter_by(key='sla_warning_threshold').first()
-        if sla_threshold_setting:
-            sla_threshold_setting.value = str(form.sla_warning_threshold.data)
-        else:
-            sla_threshold_setting = Setting(
-                key='sla_warning_threshold',
-                value=str(form.sla_warning_threshold.data),
-                description='Percentage of SLA time elapsed before warning is triggered'
-            )
-            db.session.add(sla_threshold_setting)
+        threshold_changed = settings.get_int('sla_warning_threshold', None) != form.sla_warning_threshold.data
+        settings.update({'sla_warning_threshold': form.sla_warning_threshold.data})
         
         db.session.commit()
+        
+        # Stored at-risk states depend on the threshold
+        if threshold_changed:
+            from app.sla import sla_evaluator  # app.sla imports the settings service
+            sla_evaluator.start(current_app._get_current_object(), full=True)
         flash('Notification settings updated successfully', 'success')
         return redirect(url_for('settings.notifications'))
     
@@ -221,9 +193,9 @@ def notifications():
             form.ticket_resolved.data = notifications['ticket_resolved'].is_enabled
             form.ticket_resolved_recipients.data = notifications['ticket_resolved'].recipients
         
-        sla_threshold_setting = Setting.query.filter_by(key='sla_warning_threshold').first()
-        if sla_threshold_setting:
-            form.sla_warning_threshold.data = int(sla_threshold_setting.value)
+        threshold = settings.get_int('sla_warning_threshold', None)
+        if threshold is not None:
+            form.sla_warning_threshold.data = threshold
     
     return render_template('settings/notifications.html', title='Notification Settings', form=form)
 
@@ -254,34 +226,48 @@ def sla():
             }
         }
         
+        changed = []
         for name, times in priorities.items():
             priority = TicketPriority.query.filter_by(name=name).first()
             if priority:
+                if (priority.sla_response_time, priority.sla_resolution_time) != (times['response_time'], times['resolution_time']):
+                    changed.append(priority.id)
                 priority.sla_response_time = times['response_time']
                 priority.sla_resolution_time = times['resolution_time']
         
+        # Open tickets of changed priorities get due dates from the new targets
+        if changed:
+            from app.sla import start_recalculation, sla_recalculator  # app.sla imports the settings service
+            recalculation = start_recalculation(changed)
+        
         db.session.commit()
+        
+        if changed:
+            sla_recalculator.start(current_app._get_current_object())
+            flash(f'Recalculating the SLA due dates of {recalculation.total} open tickets in the background', 'info')
         flash('SLA settings updated successfully', 'success')
         return redirect(url_for('settings.sla'))
     
     # Pre-populate form with current settings
     if request.method == 'GET':
-        low_priority = TicketPriority.query.filter_by(name='Low').first()
+        priorities = {priority.name: priority for priority in reference.priorities}
+        
+        low_priority = priorities.get('Low')
         if low_priority:
             form.low_response_time.data = low_priority.sla_response_time
             form.low_resolution_time.data = low_priority.sla_resolution_time
         
-        medium_priority = TicketPriority.query.filter_by(name='Medium').first()
+        medium_priority = priorities.get('Medium')
         if medium_priority:
             form.medium_response_time.data = medium_priority.sla_response_time
             form.medium_resolution_time.data = medium_priority.sla_resolution_time
         
-        high_priority = TicketPriority.query.filter_by(name='High').first()
+        high_priority = priorities.get('High')
         if high_priority:
             form.high_response_time.data = high_priority.sla_response_time
             form.high_resolution_time.data = high_priority.sla_resolution_time
         
-        critical_priority = TicketPriority.query.filter_by(name='Critical').first()
+        critical_priority = priorities.get('Critical')
         if critical_priority:
             form.critical_response_time.data = critical_priority.sla_response_time
             form.critical_resolution_time.data = critical_priority.sla_resolution_time
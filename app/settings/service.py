@@ -0,0 +1,72 @@
+"""
+Cached access to the key/value ``Setting`` rows.
+
+All settings are loaded once per process and served from memory. Every
+write to the table bumps the shared 'settings' version stamp in the same
+transaction, and processes reload when they see the stamp change.
+"""
+from sqlalchemy import select
+from app import db
+from app.cache import VersionedCache
+from app.models import Setting
+
+SETTINGS_VERSION = 'settings'
+
+# Descriptions stored with settings created through the service
+SETTING_DESCRIPTIONS = {
+    'app_name': 'Application name displayed in the UI',
+    'company_name': 'Company name used in emails and reports',
+    'ticket_id_format': 'Format for ticket IDs displayed to users',
+    'sla_warning_threshold': 'Percentage of SLA time elapsed before warning is triggered',
+    'theme': 'Colour theme for the user interface',
+}
+
+_TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+class SettingsService(VersionedCache):
+    def __init__(self):
+        super().__init__(SETTINGS_VERSION, 'SETTINGS_VERSION_CHECK_INTERVAL')
+
+    def load(self):
+        return {key: value for key, value in db.session.execute(select(Setting.key, Setting.value))}
+
+    def get(self, key, default=None):
+        value = self.data().get(key)
+        return default if value is None else value
+
+    def get_int(self, key, default=0):
+        try:
+            return int(self.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_float(self, key, default=0.0):
+        try:
+            return float(self.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_bool(self, key, default=False):
+        value = self.get(key)
+        if value is None:
+            return default
+        return str(value).strip().lower() in _TRUE_VALUES
+
+    def all(self):
+        return dict(self.data())
+
+    def update(self, values):
+        """Stage new values for several settings; the caller commits."""
+        existing = {setting.key: setting for setting in Setting.query.filter(Setting.key.in_(list(values)))}
+        for key, value in values.items():
+            value = None if value is None else str(value)
+            setting = existing.get(key)
+            if setting:
+                setting.value = value
+            else:
+                db.session.add(Setting(key=key, value=value, description=SETTING_DESCRIPTIONS.get(key)))
+
+
+settings = SettingsService()
+settings.watch(Setting)
@@ -0,0 +1,525 @@
+"""
+SLA evaluation.
+
+Every ticket stores its overall SLA state in ``sla_state``. The state is
+'on_track' until ``sla_warning_threshold`` percent of the time to a target
+has elapsed. It is then 'at_risk', and 'breached' once a target is missed.
+When every target has been met or the ticket closed in time, it is 'met'.
+``sla_next_check_at`` holds the next moment the state can change.
+
+Both columns are recomputed whenever a ticket's SLA fields are written.
+Every ``SLA_EVALUATION_INTERVAL`` seconds a background pass re-evaluates the
+open tickets whose next check has come due, found through the index on that
+column; ``flask sla evaluate`` runs the same pass. Once committed, moves into
+'at_risk' and 'breached' are sent on the ``sla_warning`` and ``sla_breached``
+signals.
+
+When a priority's SLA targets change, the due dates of its open tickets are
+recomputed from their creation time by a recalculation run: batches of
+tickets in id order, each rewritten with one executemany UPDATE and committed
+together with the run's progress, then re-evaluated. The run goes on in the
+background after the SLA settings are saved and an interrupted one resumes
+at startup (or with ``flask sla recalculate --resume``).
+"""
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+import click
+from blinker import Namespace
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect, select, update, bindparam, func
+from sqlalchemy.orm import Session
+from app import db
+from app.calendars import calendars
+from app.models import Ticket, TicketStatus, TicketPriority, SLARecalculation
+from app.reference import reference
+from app.settings.service import settings
+
+sla_cli = AppGroup('sla', help='Evaluate and inspect ticket SLA states.')
+
+ON_TRACK = 'on_track'
+AT_RISK = 'at_risk'
+BREACHED = 'breached'
+MET = 'met'
+
+# The worst state of the response and resolution targets is the ticket's
+_SEVERITY = {MET: 1, ON_TRACK: 2, AT_RISK: 3, BREACHED: 4}
+
+DEFAULT_WARNING_THRESHOLD = 75
+
+# Ticket columns the SLA state is computed from
+SLA_COLUMNS = ('status_id', 'created_at', 'sla_response_due', 'sla_resolution_due',
+               'sla_response_met', 'sla_resolution_met')
+
+_signals = Namespace()
+
+# Sent with the app as sender and ticket_id, previous_state and state. They are
+# sent after the commit, so receivers must not use the committing session.
+sla_warning = _signals.signal('sla-warning')
+sla_breached = _signals.signal('sla-breached')
+
+_TRANSITION_SIGNALS = {AT_RISK: sla_warning, BREACHED: sla_breached}
+
+
+def warning_threshold():
+    """Percentage of a target's time that may elapse before it is at risk."""
+    return min(max(settings.get_int('sla_warning_threshold', DEFAULT_WARNING_THRESHOLD), 0), 100)
+
+
+def target_status(started_at, due, met, now, threshold, is_closed=False):
+    """(status, next change) of one SLA target; (None, None) if it has no due date."""
+    if due is None:
+        return None, None
+    if met:
+        return MET, None
+    if due <= now:
+        return BREACHED, None
+    if is_closed:
+        # Closed before the target was missed
+        return MET, None
+    warn_at = due
+    if started_at and started_at < due:
+        warn_at = started_at + (due - started_at) * (threshold / 100)
+    if now >= warn_at:
+        return AT_RISK, due
+    return ON_TRACK, warn_at
+
+
+def ticket_sla(values, now, threshold, is_closed):
+    """Overall (state, next check) from a mapping of the ``SLA_COLUMNS`` values."""
+    targets = [
+        target_status(values['created_at'], values['sla_response_due'], values['sla_response_met'],
+                      now, threshold, is_closed),
+        target_status(values['created_at'], values['sla_resolution_due'], values['sla_resolution_met'],
+                      now, threshold, is_closed),
+    ]
+    states = [state for state, _ in targets if state]
+    checks = [check for _, check in targets if check]
+    return (max(states, key=_SEVERITY.get) if states else None,
+            min(checks) if checks else None)
+
+
+def _status_is_closed(connection, status_id):
+    if not status_id:
+        return False
+    return bool(connection.execute(
+        select(TicketStatus.is_closed).where(TicketStatus.id == status_id)
+    ).scalar())
+
+
+def _apply_sla(connection, target):
+    now = datetime.utcnow()
+    values = {column: getattr(target, column) for column in SLA_COLUMNS}
+    # created_at's default is only filled in by the INSERT itself
+    values['created_at'] = values['created_at'] or now
+    state, next_check = ticket_sla(values, now, warning_threshold(),
+                                   _status_is_closed(connection, target.status_id))
+    if state != target.sla_state:
+        target.sla_state = state
+        target.sla_state_changed_at = now
+    target.sla_next_check_at = next_check
+
+
+@event.listens_for(Ticket, 'before_insert')
+def evaluate_new_ticket(mapper, connection, target):
+    _apply_sla(connection, target)
+
+
+@event.listens_for(Ticket, 'before_update')
+def reevaluate_changed_ticket(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[column].history.has_changes() for column in SLA_COLUMNS):
+        _apply_sla(connection, target)
+
+
+def _note_transition(mapper, connection, target):
+    history = inspect(target).attrs.sla_state.history
+    if history.added and target.sla_state in _TRANSITION_SIGNALS:
+        previous = history.deleted[0] if history.deleted else None
+        inspect(target).session.info.setdefault('sla_transitions', []).append(
+            (target.id, previous, target.sla_state))
+
+
+event.listen(Ticket, 'after_insert', _note_transition)
+event.listen(Ticket, 'after_update', _note_transition)
+
+
+def announce(transitions):
+    """Send the signal for each committed (ticket_id, previous_state, state)."""
+    if not transitions:
+        return
+    app = current_app._get_current_object()
+    for ticket_id, previous, state in transitions:
+        _TRANSITION_SIGNALS[state].send(app, ticket_id=ticket_id, previous_state=previous, state=state)
+
+
+@event.listens_for(Session, 'after_commit')
+def _announce_after_commit(session):
+    announce(session.info.pop('sla_transitions', None))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_transitions(session):
+    session.info.pop('sla_transitions', None)
+
+
+@sla_warning.connect
+@sla_breached.connect
+def _log_transition(app, ticket_id, previous_state, state):
+    app.logger.info(f'Ticket #{ticket_id} SLA state {previous_state or "unset"} -> {state}')
+
+
+def _open_tickets():
+    # For statements joining TicketStatus; tickets without a status count as open
+    return func.coalesce(TicketStatus.is_closed, False) == False
+
+
+def evaluate_tickets(criteria=(), now=None, draining=False):
+    """Re-evaluate the tickets matching ``criteria`` in batches, committing each.
+
+    Batches are paged by ticket id. With ``draining`` the criteria stop matching
+    a ticket once it is evaluated, so each batch is simply the first tickets
+    still matching in ``sla_next_check_at`` order, read from its index.
+
+    Returns the number of tickets evaluated and the state transitions announced.
+    """
+    now = now or datetime.utcnow()
+    threshold = warning_threshold()
+    batch_size = current_app.config.get('SLA_EVALUATION_BATCH_SIZE', 500)
+    tickets = Ticket.__table__
+    statement = (
+        select(Ticket.id, Ticket.sla_state, Ticket.sla_state_changed_at,
+               *(getattr(Ticket, column) for column in SLA_COLUMNS),
+               func.coalesce(TicketStatus.is_closed, False).label('is_closed'))
+        .outerjoin(TicketStatus, Ticket.status_id == TicketStatus.id)
+        .where(*criteria)
+        .order_by(Ticket.sla_next_check_at if draining else Ticket.id, Ticket.id)
+        .limit(batch_size)
+    )
+    # Logging a state change is not an edit, so updated_at keeps its value
+    store = (
+        update(tickets)
+        .where(tickets.c.id == bindparam('ticket_id'))
+        .values(sla_state=bindparam('state'), sla_state_changed_at=bindparam('changed_at'),
+                sla_next_check_at=bindparam('next_check'), updated_at=tickets.c.updated_at)
+    )
+
+    evaluated = 0
+    transitions = []
+    after_id = 0
+    while True:
+        rows = db.session.execute(statement if draining else statement.where(Ticket.id > after_id)).all()
+        if not rows:
+            break
+        params = []
+        batch_transitions = []
+        for row in rows:
+            state, next_check = ticket_sla(row._mapping, now, threshold, bool(row.is_closed))
+            changed_at = row.sla_state_changed_at
+            if state != row.sla_state:
+                changed_at = now
+                if state in _TRANSITION_SIGNALS:
+                    batch_transitions.append((row.id, row.sla_state, state))
+            params.append({'ticket_id': row.id, 'state': state, 'changed_at': changed_at,
+                           'next_check': next_check})
+        db.session.execute(store, params)
+        db.session.commit()
+        announce(batch_transitions)
+        transitions += batch_transitions
+        evaluated += len(rows)
+        after_id = rows[-1].id
+    return evaluated, transitions
+
+
+def evaluate_due(now=None):
+    """Re-evaluate the tickets whose next SLA check has come due."""
+    now = now or datetime.utcnow()
+    # An evaluated ticket's next check is always after now, or there is none
+    return evaluate_tickets([Ticket.sla_next_check_at <= now], now, draining=True)
+
+
+def evaluate_open():
+    """Re-evaluate every open ticket, e.g. after the warning threshold changes."""
+    return evaluate_tickets([_open_tickets()])
+
+
+def _has_unevaluated_tickets():
+    # Tickets with due dates from before the SLA state columns existed
+    return db.session.execute(
+        select(Ticket.id)
+        .where(Ticket.sla_state.is_(None),
+               (Ticket.sla_response_due.is_not(None)) | (Ticket.sla_resolution_due.is_not(None)))
+        .limit(1)
+    ).first() is not None
+
+
+def _priority_ids(recalculation):
+    return [int(priority_id) for priority_id in recalculation.priority_ids.split(',') if priority_id]
+
+
+def _unfinished_recalculation():
+    return (SLARecalculation.query.filter(SLARecalculation.finished_at.is_(None))
+            .order_by(SLARecalculation.id).first())
+
+
+def start_recalculation(priority_ids):
+    """Stage a recalculation of the open tickets of ``priority_ids``; the caller commits.
+
+    An unfinished run is superseded, and its priorities folded into the new one.
+    """
+    priority_ids = set(priority_ids)
+    for unfinished in SLARecalculation.query.filter(SLARecalculation.finished_at.is_(None)):
+        priority_ids.update(_priority_ids(unfinished))
+        unfinished.finished_at = datetime.utcnow()
+        unfinished.superseded = True
+    total = db.session.execute(
+        select(func.count(Ticket.id))
+        .outerjoin(TicketStatus, Ticket.status_id == TicketStatus.id)
+        .where(Ticket.priority_id.in_(priority_ids), _open_tickets())
+    ).scalar()
+    recalculation = SLARecalculation(priority_ids=','.join(str(priority_id) for priority_id in sorted(priority_ids)),
+                                     total=total)
+    db.session.add(recalculation)
+    return recalculation
+
+
+def _recalculated_due_dates(rows):
+    by_priority = defaultdict(list)
+    for row in rows:
+        by_priority[row.priority_id].append(row)
+
+    params = []
+    for priority_id, group in by_priority.items():
+        priority = reference.priority_by_id.get(priority_id)
+        calendar = calendars.for_priority(priority_id)
+        starts = [row.created_at for row in group]
+        response_dues = (calendar.add_many(starts, priority.sla_response_time)
+                         if priority and priority.sla_response_time else [None] * len(group))
+        resolution_dues = (calendar.add_many(starts, priority.sla_resolution_time)
+                           if priority and priority.sla_resolution_time else [None] * len(group))
+        for row, response_due, resolution_due in zip(group, response_dues, resolution_dues):
+            params.append({
+                'ticket_id': row.id,
+                # A met response target keeps the due date it was met against
+                'response_due': row.sla_response_due if row.sla_response_met else response_due,
+                'resolution_due': resolution_due,
+            })
+    return params
+
+
+def recalculate_due_dates(recalculation, on_batch=None):
+    """Rewrite the SLA due dates of the run's open tickets, from where it stopped.
+
+    ``on_batch`` is called with the run after each committed batch. Stops early
+    if another process supersedes the run.
+    """
+    batch_size = current_app.config.get('SLA_RECALCULATION_BATCH_SIZE', 1000)
+    tickets = Ticket.__table__
+    statement = (
+        select(Ticket.id, Ticket.priority_id, Ticket.created_at, Ticket.sla_response_due, Ticket.sla_response_met)
+        .outerjoin(TicketStatus, Ticket.status_id == TicketStatus.id)
+        .where(Ticket.priority_id.in_(_priority_ids(recalculation)), Ticket.created_at.is_not(None),
+               _open_tickets())
+        .order_by(Ticket.id)
+        .limit(batch_size)
+    )
+    # New targets are not an edit of the ticket, so updated_at keeps its value
+    store = (
+        update(tickets)
+        .where(tickets.c.id == bindparam('ticket_id'))
+        .values(sla_response_due=bindparam('response_due'), sla_resolution_due=bindparam('resolution_due'),
+                updated_at=tickets.c.updated_at)
+    )
+
+    while recalculation.finished_at is None:
+        rows = db.session.execute(statement.where(Ticket.id > recalculation.last_ticket_id)).all()
+        if rows:
+            db.session.execute(store, _recalculated_due_dates(rows))
+            recalculation.processed += len(rows)
+            recalculation.last_ticket_id = rows[-1].id
+        else:
+            recalculation.finished_at = datetime.utcnow()
+        db.session.commit()
+        if rows:
+            evaluate_tickets([Ticket.id.in_([row.id for row in rows])])
+            if on_batch:
+                on_batch(recalculation)
+    return recalculation
+
+
+def resume_recalculations(on_batch=None):
+    """Finish every unfinished recalculation run; returns the last one run."""
+    recalculation = last = _unfinished_recalculation()
+    while recalculation is not None:
+        recalculate_due_dates(recalculation, on_batch)
+        last = recalculation
+        recalculation = _unfinished_recalculation()
+    return last
+
+
+class SLARecalculator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+        self._pending = False
+
+    def start(self, app):
+        """Run the unfinished recalculations in a background thread."""
+        with self._lock:
+            # A running thread looks again for runs started while it works
+            self._pending = True
+            if self._running:
+                return
+            self._running = True
+
+        def log_progress(recalculation):
+            app.logger.info(f'SLA recalculation {recalculation.id}: '
+                            f'{recalculation.processed}/{recalculation.total} tickets')
+
+        def recalculate():
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        self._running = False
+                        return
+                    self._pending = False
+                try:
+                    with app.app_context():
+                        resume_recalculations(log_progress)
+                except Exception:
+                    app.logger.exception('Error recalculating ticket SLA due dates')
+
+        threading.Thread(target=recalculate, daemon=True).start()
+
+
+sla_recalculator = SLARecalculator()
+
+
+class SLAEvaluator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+        self._pending = False
+        self._pending_full = False
+        self._last_run = time.monotonic()
+
+    def run_if_due(self, app):
+        """Start a background pass once the configured interval has passed."""
+        interval = app.config.get('SLA_EVALUATION_INTERVAL', 60)
+        if not interval or self._running or time.monotonic() - self._last_run < interval:
+            return
+        self.start(app)
+
+    def start(self, app, full=False):
+        """Evaluate the due tickets (or every open ticket) in a background thread.
+
+        While a pass is running the request is queued, and a full pass asked
+        for meanwhile runs once the current one ends.
+        """
+        with self._lock:
+            self._pending = True
+            self._pending_full = self._pending_full or full
+            if self._running:
+                return
+            self._running = True
+
+        def evaluate():
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        self._running = False
+                        self._last_run = time.monotonic()
+                        return
+                    full_pass = self._pending_full
+                    self._pending = self._pending_full = False
+                try:
+                    with app.app_context():
+                        # Use the threshold as committed now, not as cached when the last pass ran
+                        settings.invalidate()
+                        evaluated, transitions = evaluate_open() if full_pass else evaluate_due()
+                    if evaluated:
+                        app.logger.debug(f'SLA evaluation: {evaluated} tickets, {len(transitions)} warnings or breaches')
+                except Exception:
+                    app.logger.exception('Error evaluating ticket SLAs')
+
+        threading.Thread(target=evaluate, daemon=True).start()
+
+
+sla_evaluator = SLAEvaluator()
+
+
+def configure_sla(app):
+    """Schedule periodic SLA evaluation, evaluate tickets that have no state yet and
+    resume an interrupted due date recalculation."""
+    if app.config.get('SLA_EVALUATION_INTERVAL', 60):
+        app.before_request(lambda: sla_evaluator.run_if_due(app))
+    if _has_unevaluated_tickets():
+        sla_evaluator.start(app, full=True)
+    if _unfinished_recalculation() is not None:
+        sla_recalculator.start(app)
+
+
+@sla_cli.command('evaluate')
+@click.option('--all', 'evaluate_all', is_flag=True, help='Re-evaluate every open ticket, not just those due a check.')
+def evaluate(evaluate_all):
+    """Update the stored SLA state of tickets now."""
+    evaluated, transitions = evaluate_open() if evaluate_all else evaluate_due()
+    warnings = sum(1 for _, _, state in transitions if state == AT_RISK)
+    click.echo(f'Evaluated {evaluated} tickets: {warnings} now at risk, {len(transitions) - warnings} breached.')
+
+
+@sla_cli.command('status')
+def status():
+    """Count open tickets by SLA state."""
+    counts = db.session.execute(
+        select(Ticket.sla_state, func.count(Ticket.id))
+        .outerjoin(TicketStatus, Ticket.status_id == TicketStatus.id)
+        .where(_open_tickets())
+        .group_by(Ticket.sla_state)
+    ).all()
+    for state, count in sorted(counts, key=lambda row: _SEVERITY.get(row[0], 0)):
+        click.echo(f'{state or "no SLA"}: {count}')
+
+
+def _echo_progress(recalculation):
+    click.echo(f'{recalculation.processed}/{recalculation.total} tickets')
+
+
+@sla_cli.command('recalculate')
+@click.option('--priority', 'priorities', multiple=True, help='Only this priority. Repeatable.')
+@click.option('--resume', is_flag=True, help='Only finish an interrupted recalculation.')
+def recalculate(priorities, resume):
+    """Recompute the SLA due dates of open tickets from the current targets."""
+    if not resume:
+        query = TicketPriority.query
+        if priorities:
+            query = query.filter(TicketPriority.name.in_(priorities))
+        priority_ids = [priority.id for priority in query]
+        if not priority_ids:
+            raise click.ClickException('No matching priorities')
+        start_recalculation(priority_ids)
+        db.session.commit()
+    recalculation = resume_recalculations(_echo_progress)
+    if recalculation is None:
+        click.echo('No recalculation to resume.')
+    else:
+        click.echo(f'Recalculated the due dates of {recalculation.processed} open tickets.')
+
+
+@sla_cli.command('progress')
+def progress():
+    """Show the progress of the latest due date recalculation."""
+    recalculation = SLARecalculation.query.order_by(SLARecalculation.id.desc()).first()
+    if recalculation is None:
+        click.echo('No recalculation has run.')
+        return
+    if recalculation.finished_at is None:
+        state = 'running or interrupted'
+    elif recalculation.superseded:
+        state = f'superseded {recalculation.finished_at:%Y-%m-%d %H:%M}'
+    else:
+        state = f'finished {recalculation.finished_at:%Y-%m-%d %H:%M}'
+    click.echo(f'Recalculation {recalculation.id} started {recalculation.started_at:%Y-%m-%d %H:%M}: '
+               f'{recalculation.processed}/{recalculation.total} tickets, {state}.')
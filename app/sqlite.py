@@ -0,0 +1,148 @@
+"""
+SQLite engine profile: connection pragmas and periodic maintenance.
+
+``SQLITE_PROFILE`` selects one of ``SQLITE_PROFILES`` in the config. Its
+pragmas are set on every new connection from a SQLAlchemy ``connect``
+listener, and the values SQLite actually applied are logged at startup. A
+SQLite read replica gets the same pragmas, plus ``query_only``. With
+the production profile the database runs in WAL mode, so readers no longer
+wait for writers; the WAL is checkpointed and ``PRAGMA optimize`` is run in
+the background every ``SQLITE_MAINTENANCE_INTERVAL`` seconds.
+"""
+import threading
+import time
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event
+from app import db
+from app.replica import REPLICA_BIND
+
+sqlite_cli = AppGroup('sqlite', help='Inspect and maintain the SQLite database.')
+
+# Pragmas reported at startup and by "flask sqlite status"
+REPORTED_PRAGMAS = ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size', 'temp_store')
+
+
+def _pragma_setter(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+# SQLite reports these pragmas as numbers
+_PRAGMA_NAMES = {
+    'synchronous': {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'},
+    'temp_store': {0: 'DEFAULT', 1: 'FILE', 2: 'MEMORY'},
+}
+
+
+def effective_pragmas(connection):
+    values = {}
+    for name in REPORTED_PRAGMAS:
+        value = connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+        values[name] = _PRAGMA_NAMES.get(name, {}).get(value, value)
+    return values
+
+
+def run_maintenance(connection):
+    """Checkpoint the WAL without blocking writers and refresh planner statistics.
+
+    Returns the ``wal_checkpoint`` result: (busy, WAL pages, pages checkpointed).
+    """
+    result = tuple(connection.exec_driver_sql('PRAGMA wal_checkpoint(PASSIVE)').first())
+    connection.exec_driver_sql('PRAGMA optimize')
+    return result
+
+
+class SQLiteMaintenance:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+        self._last_run = time.monotonic()
+
+    def run_if_due(self, app):
+        """Start a background maintenance pass once the configured interval has passed."""
+        interval = app.config.get('SQLITE_MAINTENANCE_INTERVAL', 600)
+        with self._lock:
+            if self._running or not interval or time.monotonic() - self._last_run < interval:
+                return
+            self._running = True
+
+        def maintain():
+            try:
+                with app.app_context(), db.engine.connect() as connection:
+                    busy, wal_pages, checkpointed = run_maintenance(connection)
+                app.logger.debug(f'SQLite maintenance: checkpointed {checkpointed} of {wal_pages} WAL pages')
+            except Exception:
+                app.logger.exception('Error running SQLite maintenance')
+            finally:
+                with self._lock:
+                    self._running = False
+                    self._last_run = time.monotonic()
+
+        threading.Thread(target=maintain, daemon=True).start()
+
+
+sqlite_maintenance = SQLiteMaintenance()
+
+
+def configure_sqlite(app):
+    """Apply the configured SQLite profile to the app's engine and to a SQLite read replica."""
+    engine = db.engine
+    replica = db.engines.get(REPLICA_BIND)
+    if replica is not None and replica.dialect.name != 'sqlite':
+        replica = None
+    if engine.dialect.name != 'sqlite' and replica is None:
+        return
+
+    profile = app.config.get('SQLITE_PROFILE', 'default')
+    profiles = app.config.get('SQLITE_PROFILES', {})
+    if profile not in profiles:
+        raise RuntimeError(f'Unknown SQLITE_PROFILE {profile!r}; expected one of {", ".join(profiles)}')
+    pragmas = profiles[profile]
+
+    if replica is not None:
+        # Only the backup-API sync writes to the replica, and it lifts query_only while it does;
+        # readers wait out a sync for busy_timeout instead of failing
+        event.listen(replica, 'connect', _pragma_setter(dict(pragmas, query_only='ON')))
+        replica.dispose()
+
+    if engine.dialect.name != 'sqlite':
+        return
+
+    if pragmas:
+        event.listen(engine, 'connect', _pragma_setter(pragmas))
+        # Connections opened before the listener was added miss the pragmas
+        engine.dispose()
+        app.before_request(lambda: sqlite_maintenance.run_if_due(app))
+
+    with engine.connect() as connection:
+        applied = effective_pragmas(connection)
+    app.logger.info(f'SQLite profile {profile!r}: ' + ', '.join(f'{name}={value}' for name, value in applied.items()))
+
+
+@sqlite_cli.command('status')
+def status():
+    """Show the pragmas in effect on a new connection."""
+    if db.engine.dialect.name != 'sqlite':
+        click.echo('The database is not SQLite; nothing to show.')
+        return
+    with db.engine.connect() as connection:
+        for name, value in effective_pragmas(connection).items():
+            click.echo(f'{name} = {value}')
+
+
+@sqlite_cli.command('maintain')
+def maintain():
+    """Checkpoint the WAL and run PRAGMA optimize now."""
+    if db.engine.dialect.name != 'sqlite':
+        click.echo('The database is not SQLite; nothing to do.')
+        return
+    with db.engine.connect() as connection:
+        busy, wal_pages, checkpointed = run_maintenance(connection)
+    click.echo(f'Checkpointed {checkpointed} of {wal_pages} WAL pages' + (' (readers busy)' if busy else '') + '.')
@@ -1,7 +1,8 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, TextAreaField, SelectField, DateTimeField, BooleanField, SubmitField, IntegerField
 from wtforms.validators import DataRequired, Email, Optional, Length
-from app.models import User, TicketStatus, TicketPriority, TicketType, Asset
+from app.reference import reference
+from app.choices import RemoteSelectField, USER_CHOICES, ASSET_CHOICES
 
 class TicketForm(FlaskForm):
     subject = StringField('Subject', validators=[DataRequired(), Length(max=255)])
@@ -11,22 +12,16 @@ class TicketForm(FlaskForm):
     status_id = SelectField('Status', coerce=int, validators=[DataRequired()])
     priority_id = SelectField('Priority', coerce=int, validators=[DataRequired()])
     type_id = SelectField('Type', coerce=int, validators=[DataRequired()])
-    assigned_to = SelectField('Assign To', coerce=int, validators=[Optional()])
+    assigned_to = RemoteSelectField('Assign To', validators=[Optional()], source=USER_CHOICES, blank=(0, 'Unassigned'))
     due_date = DateTimeField('Due Date', format='%Y-%m-%d %H:%M', validators=[Optional()])
-    assets = SelectField('Related Assets', coerce=int, validators=[Optional()])
+    assets = RemoteSelectField('Related Assets', validators=[Optional()], source=ASSET_CHOICES, blank=(0, 'None'))
     submit = SubmitField('Save Ticket')
     
     def __init__(self, *args, **kwargs):
         super(TicketForm, self).__init__(*args, **kwargs)
-        self.status_id.choices = [(s.id, s.name) for s in TicketStatus.query.all()]
-        self.priority_id.choices = [(p.id, p.name) for p in TicketPriority.query.all()]
-        self.type_id.choices = [(t.id, t.name) for t in TicketType.query.all()]
-        self.assigned_to.choices = [(0, 'Unassigned')] + [
-            (u.id, u.full_name) for u in User.query.filter(User.is_active == True).all()
-        ]
-        self.assets.choices = [(0, 'None')] + [
-            (a.id, f"{a.name} ({a.asset_type})") for a in Asset.query.all()
-        ]
+        self.status_id.choices = reference.status_choices()
+        self.priority_id.choices = reference.priority_choices()
+        self.type_id.choices = reference.type_choices()
 
 class TicketCommentForm(FlaskForm):
     content = TextAreaField('Comment', validators=[DataRequired()])
@@ -49,13 +44,12 @@ class ManualTimeEntryForm(FlaskForm):
 class TicketFilterForm(FlaskForm):
     status = SelectField('Status', coerce=int, validators=[Optional()])
     priority = SelectField('Priority', coerce=int, validators=[Optional()])
-    assigned_to = SelectField('Assigned To', coerce=int, validators=[Optional()])
+    assigned_to = RemoteSelectField('Assigned To', validators=[Optional()], source=USER_CHOICES, blank=(0, 'All'))
     date_from = DateTimeField('From Date', format='%Y-%m-%d', validators=[Optional()])
     date_to = DateTimeField('To Date', format='%Y-%m-%d', validators=[Optional()])
     submit = SubmitField('Filter')
     
     def __init__(self, *args, **kwargs):
         super(TicketFilterForm, self).__init__(*args, **kwargs)
-        self.status.choices = [(0, 'All')] + [(s.id, s.name) for s in TicketStatus.query.all()]
-        self.priority.choices = [(0, 'All')] + [(p.id, p.name) for p in TicketPriority.query.all()]
-        self.assigned_to.choices = [(0, 'All')] + [(u.id, u.full_name) for u in User.query.filter(User.is_active == True).all()]
+        self.status.choices = [(0, 'All')] + reference.status_choices()
+        self.priority.choices = [(0, 'All')] + reference.priority_choices()
@@ -0,0 +1,113 @@
+"""
+Filtering, sorting and paging shared by the ticket list views.
+"""
+from datetime import datetime, timedelta
+from flask import request
+from sqlalchemy.orm import joinedload
+from app.models import Ticket
+from app.pagination import keyset_paginate, per_page_from_request
+from app.reference import reference
+
+# Sort keys accepted in ?sort=, mapped to (column, nullable)
+TICKET_SORTS = {
+    'created': (Ticket.created_at, False),
+    'updated': (Ticket.updated_at, False),
+    'due': (Ticket.due_date, True),
+    'subject': (Ticket.subject, False),
+    'status': (Ticket.status_id, False),
+    'priority': (Ticket.priority_id, False),
+    'time': (Ticket.total_seconds, False),
+    'id': (Ticket.id, False),
+}
+DEFAULT_TICKET_SORT = 'created'
+
+
+def ticket_filter_criteria(args):
+    """SQL criteria for the status/priority/assignee/date/time spent filters in ``args``."""
+    criteria = []
+
+    status_id = args.get('status', type=int, default=0)
+    priority_id = args.get('priority', type=int, default=0)
+    assigned_to = args.get('assigned_to', type=int, default=0)
+    date_from = args.get('date_from', type=str)
+    date_to = args.get('date_to', type=str)
+    min_hours = args.get('min_hours', type=float, default=0)
+
+    if status_id > 0:
+        criteria.append(Ticket.status_id == status_id)
+
+    if priority_id > 0:
+        criteria.append(Ticket.priority_id == priority_id)
+
+    if assigned_to > 0:
+        criteria.append(Ticket.assigned_to == assigned_to)
+
+    if date_from:
+        try:
+            from_date = datetime.strptime(date_from, '%Y-%m-%d')
+            criteria.append(Ticket.created_at >= from_date)
+        except ValueError:
+            pass
+
+    if date_to:
+        try:
+            to_date = datetime.strptime(date_to, '%Y-%m-%d')
+            to_date = to_date + timedelta(days=1)  # Include the entire day
+            criteria.append(Ticket.created_at <= to_date)
+        except ValueError:
+            pass
+
+    if min_hours > 0:
+        criteria.append(Ticket.total_seconds >= int(min_hours * 3600))
+
+    return criteria
+
+
+def paginate_tickets(query):
+    """One page of ``query`` using the sort, direction and cursor in the request."""
+    sort_key = request.args.get('sort', DEFAULT_TICKET_SORT)
+    if sort_key not in TICKET_SORTS:
+        sort_key = DEFAULT_TICKET_SORT
+    descending = request.args.get('dir', 'desc') != 'asc'
+    column, nullable = TICKET_SORTS[sort_key]
+
+    # Status and priority come from the reference registry, so only the agent is joined
+    query = query.options(joinedload(Ticket.assigned_agent))
+    return keyset_paginate(query, sort_key, column, Ticket.id,
+                           descending=descending,
+                           per_page=per_page_from_request(),
+                           cursor=request.args.get('cursor'),
+                           nullable=nullable)
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def ticket_to_dict(ticket):
+    status = reference.status_by_id.get(ticket.status_id)
+    priority = reference.priority_by_id.get(ticket.priority_id)
+    return {
+        'id': ticket.id,
+        'subject': ticket.subject,
+        'status': status.name if status else None,
+        'priority': priority.name if priority else None,
+        'requester_name': ticket.requester_name,
+        'assigned_to': ticket.assigned_to,
+        'assigned_agent': ticket.assigned_agent.username if ticket.assigned_agent else None,
+        'created_at': _isoformat(ticket.created_at),
+        'updated_at': _isoformat(ticket.updated_at),
+        'due_date': _isoformat(ticket.due_date),
+        'total_seconds': ticket.total_seconds,
+    }
+
+
+def page_to_json(page):
+    return {
+        'tickets': [ticket_to_dict(ticket) for ticket in page.items],
+        'sort': page.sort_key,
+        'dir': 'desc' if page.descending else 'asc',
+        'per_page': page.per_page,
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+    }
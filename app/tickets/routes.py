@@ -3,73 +3,46 @@ from flask_login import login_required, current_user
 from app import db
 from app.tickets import bp
 from app.tickets.forms import TicketForm, TicketCommentForm, TimeEntryForm, ManualTimeEntryForm, TicketFilterForm
-from app.models import Ticket, TicketComment, TicketStatus, TicketPriority, TicketType, User, TimeEntry, Asset
-from datetime import datetime, timedelta
-from sqlalchemy import and_, or_
+from app.models import Ticket, TicketComment, TicketStatus, User, TimeEntry, Asset
+from app.rollups import ticket_count
+from app.reference import reference
+from app.permissions import Permission
+from app.tickets.listing import ticket_filter_criteria, paginate_tickets, page_to_json
+from app.export import csv_response, stream_rows
+from app.replica import read_only
+from app.sla import BREACHED, target_status, warning_threshold
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
 
 @bp.route('/')
 @login_required
 def index():
     form = TicketFilterForm()
     
-    # Get filter parameters
-    status_id = request.args.get('status', type=int, default=0)
-    priority_id = request.args.get('priority', type=int, default=0)
-    assigned_to = request.args.get('assigned_to', type=int, default=0)
-    date_from = request.args.get('date_from', type=str)
-    date_to = request.args.get('date_to', type=str)
+    # Apply filters and fetch one page; the filters stay in the paging links
+    query = Ticket.query.filter(*ticket_filter_criteria(request.args))
+    page = paginate_tickets(query)
     
-    # Base query
-    query = Ticket.query
-    
-    # Apply filters
-    if status_id > 0:
-        query = query.filter(Ticket.status_id == status_id)
-    
-    if priority_id > 0:
-        query = query.filter(Ticket.priority_id == priority_id)
-    
-    if assigned_to > 0:
-        query = query.filter(Ticket.assigned_to == assigned_to)
-    
-    if date_from:
-        try:
-            from_date = datetime.strptime(date_from, '%Y-%m-%d')
-            query = query.filter(Ticket.created_at >= from_date)
-        except ValueError:
-            pass
-    
-    if date_to:
-        try:
-            to_date = datetime.strptime(date_to, '%Y-%m-%d')
-            to_date = to_date + timedelta(days=1)  # Include the entire day
-            query = query.filter(Ticket.created_at <= to_date)
-        except ValueError:
-            pass
-    
-    # Get tickets
-    tickets = query.order_by(Ticket.created_at.desc()).all()
+    if request.args.get('format') == 'json':
+        return jsonify(page_to_json(page))
     
     # Get counts for sidebar
-    all_tickets_count = Ticket.query.count()
-    open_tickets_count = Ticket.query.join(TicketStatus).filter(TicketStatus.is_closed == False).count()
-    my_tickets_count = Ticket.query.filter(Ticket.assigned_to == current_user.id).count()
-    unassigned_tickets_count = Ticket.query.filter(Ticket.assigned_to == None).count()
+    all_tickets_count = ticket_count()
+    open_tickets_count = ticket_count(is_closed=False)
+    my_tickets_count = ticket_count(assigned_to=current_user.id)
+    unassigned_tickets_count = ticket_count(assigned_to=None)
     
     # Get SLA breached tickets
     sla_breached_count = Ticket.query.filter(
-        and_(
-            Ticket.status.has(TicketStatus.is_closed == False),
-            or_(
-                and_(Ticket.sla_response_due < datetime.utcnow(), Ticket.sla_response_met == False),
-                and_(Ticket.sla_resolution_due < datetime.utcnow(), Ticket.sla_resolution_met == False)
-            )
-        )
+        Ticket.sla_state == BREACHED,
+        Ticket.status.has(TicketStatus.is_closed == False)
     ).count()
     
     return render_template('tickets/index.html', 
                           title='Tickets',
-                          tickets=tickets,
+                          tickets=page.items,
+                          page=page,
                           form=form,
                           all_tickets_count=all_tickets_count,
                           open_tickets_count=open_tickets_count,
@@ -77,6 +50,37 @@ def index():
                           unassigned_tickets_count=unassigned_tickets_count,
                           sla_breached_count=sla_breached_count)
 
+@bp.route('/export.csv')
+@login_required
+@read_only
+def export():
+    # Same filters as the ticket list, streamed as CSV
+    assignee = aliased(User)
+    creator = aliased(User)
+    statement = (select(Ticket.id, Ticket.subject, Ticket.status_id, Ticket.priority_id, Ticket.type_id,
+                        assignee.username, creator.username, Ticket.requester_name, Ticket.requester_email,
+                        Ticket.created_at, Ticket.updated_at, Ticket.due_date, Ticket.resolved_at)
+                 .outerjoin(assignee, Ticket.assigned_to == assignee.id)
+                 .outerjoin(creator, Ticket.created_by == creator.id)
+                 .where(*ticket_filter_criteria(request.args))
+                 .order_by(Ticket.created_at.desc(), Ticket.id.desc()))
+    
+    def rows():
+        # Status, priority and type names come from the reference registry
+        for row in stream_rows(statement):
+            status = reference.status_by_id.get(row.status_id)
+            priority = reference.priority_by_id.get(row.priority_id)
+            ticket_type = reference.type_by_id.get(row.type_id)
+            yield (row[0], row[1],
+                   status.name if status else None,
+                   priority.name if priority else None,
+                   ticket_type.name if ticket_type else None) + tuple(row[5:])
+    
+    return csv_response('tickets.csv',
+                        ['ID', 'Subject', 'Status', 'Priority', 'Type', 'Assigned To', 'Created By',
+                         'Requester Name', 'Requester Email', 'Created', 'Updated', 'Due', 'Resolved'],
+                        rows())
+
 @bp.route('/create', methods=['GET', 'POST'])
 @login_required
 def create():
@@ -112,15 +116,15 @@ def create():
         return redirect(url_for('tickets.view', id=ticket.id))
     
     # Pre-populate with default values
-    default_status = TicketStatus.query.filter_by(is_default=True).first()
+    default_status = reference.default_status()
     if default_status:
         form.status_id.data = default_status.id
         
-    default_priority = TicketPriority.query.filter_by(is_default=True).first()
+    default_priority = reference.default_priority()
     if default_priority:
         form.priority_id.data = default_priority.id
         
-    default_type = TicketType.query.filter_by(is_default=True).first()
+    default_type = reference.default_type()
     if default_type:
         form.type_id.data = default_type.id
     
@@ -196,46 +200,22 @@ def view(id):
     # Get time entries
     time_entries = TimeEntry.query.filter_by(ticket_id=ticket.id).order_by(TimeEntry.start_time.desc()).all()
     
-    # Calculate total time spent
-    total_time = sum([entry.duration or 0 for entry in time_entries if entry.duration])
-    
-    # Format total time
-    hours, remainder = divmod(total_time, 3600)
+    # Format the maintained total time spent
+    hours, remainder = divmod(ticket.total_time_spent, 3600)
     minutes, seconds = divmod(remainder, 60)
     formatted_total_time = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
     
     # Get related assets
     assets = ticket.assets.all()
     
-    # Check SLA status
-    sla_response_status = None
-    sla_resolution_status = None
-    
-    if ticket.sla_response_due:
-        if ticket.sla_response_met:
-            sla_response_status = 'met'
-        elif ticket.sla_response_due < datetime.utcnow():
-            sla_response_status = 'breached'
-        else:
-            time_left = ticket.sla_response_due - datetime.utcnow()
-            hours_left = time_left.total_seconds() / 3600
-            if hours_left < 4:  # Less than 4 hours left
-                sla_response_status = 'at_risk'
-            else:
-                sla_response_status = 'on_track'
-    
-    if ticket.sla_resolution_due:
-        if ticket.sla_resolution_met:
-            sla_resolution_status = 'met'
-        elif ticket.sla_resolution_due < datetime.utcnow():
-            sla_resolution_status = 'breached'
-        else:
-            time_left = ticket.sla_resolution_due - datetime.utcnow()
-            hours_left = time_left.total_seconds() / 3600
-            if hours_left < 8:  # Less than 8 hours left
-                sla_resolution_status = 'at_risk'
-            else:
-                sla_resolution_status = 'on_track'
+    # Check SLA status of each target, with the same warning threshold as the stored state
+    now = datetime.utcnow()
+    threshold = warning_threshold()
+    is_closed = ticket.status_id in reference.closed_status_ids
+    sla_response_status, _ = target_status(ticket.created_at, ticket.sla_response_due,
+                                           ticket.sla_response_met, now, threshold, is_closed)
+    sla_resolution_status, _ = target_status(ticket.created_at, ticket.sla_resolution_due,
+                                             ticket.sla_resolution_met, now, threshold, is_closed)
     
     return render_template('tickets/view.html',
                           title=f'Ticket #{ticket.id}',
@@ -257,6 +237,8 @@ def edit(id):
     form = TicketForm()
     
     if form.validate_on_submit():
+        was_closed = ticket.status_id in reference.closed_status_ids
+        
         ticket.subject = form.subject.data
         ticket.description = form.description.data
         ticket.requester_name = form.requester_name.data
@@ -276,10 +258,9 @@ def edit(id):
             ticket.due_date = None
         
         # Check if status changed to closed
-        old_status = TicketStatus.query.get(ticket.status_id)
-        new_status = TicketStatus.query.get(form.status_id.data)
+        now_closed = ticket.status_id in reference.closed_status_ids
         
-        if new_status.is_closed and (not old_status.is_closed):
+        if now_closed and not was_closed:
             ticket.resolved_at = datetime.utcnow()
             if ticket.sla_resolution_due and ticket.resolved_at <= ticket.sla_resolution_due:
                 ticket.sla_resolution_met = True
@@ -365,7 +346,7 @@ def delete(id):
     ticket = Ticket.query.get_or_404(id)
     
     # Only administrators can delete tickets
-    if not current_user.is_administrator():
+    if not current_user.can(Permission.DELETE_TICKETS):
         flash('You do not have permission to delete tickets', 'danger')
         return redirect(url_for('tickets.view', id=ticket.id))
     
@@ -0,0 +1,95 @@
+"""
+Filter criteria shared by the time entry and expense lists, their exports
+and the daily billing totals behind their summaries.
+"""
+from datetime import datetime, timedelta
+from app.models import TimeEntry, Expense, DailyBillingTotal
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+
+def time_entry_filter_criteria(args):
+    """SQL criteria for the user/ticket/date/billable filters in ``args``."""
+    criteria = []
+
+    user_id = args.get('user_id', type=int, default=0)
+    ticket_id = args.get('ticket_id', type=int, default=0)
+    from_date = _parse_date(args.get('date_from', type=str))
+    to_date = _parse_date(args.get('date_to', type=str))
+
+    if user_id > 0:
+        criteria.append(TimeEntry.user_id == user_id)
+
+    if ticket_id > 0:
+        criteria.append(TimeEntry.ticket_id == ticket_id)
+
+    if from_date:
+        criteria.append(TimeEntry.start_time >= from_date)
+
+    if to_date:
+        # Include the entire day
+        criteria.append(TimeEntry.start_time <= to_date + timedelta(days=1))
+
+    if args.get('billable_only', type=bool, default=False):
+        criteria.append(TimeEntry.billable == True)
+
+    return criteria
+
+
+def expense_filter_criteria(args):
+    """SQL criteria for the user/ticket/date/billable filters in ``args``."""
+    criteria = []
+
+    user_id = args.get('user_id', type=int, default=0)
+    ticket_id = args.get('ticket_id', type=int, default=0)
+    from_date = _parse_date(args.get('date_from', type=str))
+    to_date = _parse_date(args.get('date_to', type=str))
+
+    if user_id > 0:
+        criteria.append(Expense.user_id == user_id)
+
+    if ticket_id > 0:
+        criteria.append(Expense.ticket_id == ticket_id)
+
+    if from_date:
+        criteria.append(Expense.date >= from_date.date())
+
+    if to_date:
+        criteria.append(Expense.date <= to_date.date())
+
+    if args.get('billable_only', type=bool, default=False):
+        criteria.append(Expense.billable == True)
+
+    return criteria
+
+
+def billing_total_filter_criteria(args):
+    """The same filters applied to the daily billing totals."""
+    criteria = []
+
+    user_id = args.get('user_id', type=int, default=0)
+    ticket_id = args.get('ticket_id', type=int, default=0)
+    from_date = _parse_date(args.get('date_from', type=str))
+    to_date = _parse_date(args.get('date_to', type=str))
+
+    if user_id > 0:
+        criteria.append(DailyBillingTotal.user_id == user_id)
+
+    if ticket_id > 0:
+        criteria.append(DailyBillingTotal.ticket_id == ticket_id)
+
+    if from_date:
+        criteria.append(DailyBillingTotal.day >= from_date.date())
+
+    if to_date:
+        criteria.append(DailyBillingTotal.day <= to_date.date())
+
+    if args.get('billable_only', type=bool, default=False):
+        criteria.append(DailyBillingTotal.billable == True)
+
+    return criteria
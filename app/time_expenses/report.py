@@ -0,0 +1,105 @@
+"""
+Time and expense report.
+
+Totals come from one grouped query over the daily billing totals (see
+app/rollups.py), summed per (ticket, user, billable) and joined to the ticket
+subjects and user names. A month is a few hundred rollup rows however many
+entries it holds; the per-ticket, per-user and overall figures are folded
+from the result.
+
+Individual entries are only loaded when asked for, one page at a time.
+"""
+from datetime import datetime
+from sqlalchemy import select, func, or_
+from werkzeug.datastructures import MultiDict
+from app import db
+from app.models import DailyBillingTotal, Ticket, User
+from app.time_expenses.filters import billing_total_filter_criteria
+
+
+def format_duration(total_seconds):
+    hours, remainder = divmod(int(total_seconds or 0), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def report_args(args):
+    """``args`` with the date range defaulting to the current month."""
+    args = MultiDict(args)
+    if not args.get('date_from') and not args.get('date_to'):
+        today = datetime.today()
+        args['date_from'] = today.replace(day=1).strftime('%Y-%m-%d')
+        args['date_to'] = today.strftime('%Y-%m-%d')
+    return args
+
+
+def billing_totals(args):
+    """Seconds and amount per (ticket, user, billable) for the filters in ``args``."""
+    statement = (select(DailyBillingTotal.ticket_id, Ticket.subject,
+                        DailyBillingTotal.user_id, User.first_name, User.last_name,
+                        DailyBillingTotal.billable,
+                        func.sum(DailyBillingTotal.time_seconds).label('seconds'),
+                        func.sum(DailyBillingTotal.expense_cents).label('cents'))
+                 .outerjoin(Ticket, Ticket.id == DailyBillingTotal.ticket_id)
+                 .outerjoin(User, User.id == DailyBillingTotal.user_id)
+                 .where(*billing_total_filter_criteria(args))
+                 .group_by(DailyBillingTotal.ticket_id, Ticket.subject, DailyBillingTotal.user_id,
+                           User.first_name, User.last_name, DailyBillingTotal.billable)
+                 .having(or_(func.sum(DailyBillingTotal.time_seconds) != 0,
+                             func.sum(DailyBillingTotal.expense_cents) != 0))
+                 .order_by(DailyBillingTotal.ticket_id, DailyBillingTotal.user_id))
+    return db.session.execute(statement).all()
+
+
+class BillingReport:
+    def __init__(self, rows):
+        self.total_seconds = self.billable_seconds = 0
+        self.total_amount = self.billable_amount = 0.0
+        tickets = {}
+        users = {}
+        for row in rows:
+            seconds = row.seconds or 0
+            amount = (row.cents or 0) / 100
+            self.total_seconds += seconds
+            self.total_amount += amount
+            if row.billable:
+                self.billable_seconds += seconds
+                self.billable_amount += amount
+
+            ticket = tickets.setdefault(row.ticket_id, _Totals(ticket_id=row.ticket_id, subject=row.subject))
+            ticket.add(seconds, amount, row.billable)
+            user = users.setdefault(row.user_id, _Totals(
+                user_id=row.user_id, name=f"{row.first_name or ''} {row.last_name or ''}".strip()))
+            user.add(seconds, amount, row.billable)
+
+        self.ticket_summary = [totals.summary() for totals in tickets.values()]
+        self.user_summary = sorted((totals.summary() for totals in users.values()), key=lambda s: s['name'])
+
+    @property
+    def total_time(self):
+        return format_duration(self.total_seconds)
+
+    @property
+    def billable_time(self):
+        return format_duration(self.billable_seconds)
+
+
+class _Totals:
+    def __init__(self, **fields):
+        self.fields = fields
+        self.seconds = self.billable_seconds = 0
+        self.amount = self.billable_amount = 0.0
+
+    def add(self, seconds, amount, billable):
+        self.seconds += seconds
+        self.amount += amount
+        if billable:
+            self.billable_seconds += seconds
+            self.billable_amount += amount
+
+    def summary(self):
+        return dict(self.fields,
+                    total_time=format_duration(self.seconds),
+                    billable_time=format_duration(self.billable_seconds),
+                    total_expenses=f"${self.amount:.2f}",
+                    billable_expenses=f"${self.billable_amount:.2f}")
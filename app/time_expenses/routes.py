@@ -3,9 +3,14 @@ from flask_login import login_required, current_user
 from app import db
 from app.time_expenses import bp
 from app.time_expenses.forms import TimeEntryForm, ExpenseForm, TimeExpenseFilterForm
-from app.models import TimeEntry, Expense, Ticket, User
-from datetime import datetime, timedelta
-from sqlalchemy import func, and_
+from app.models import TimeEntry, Expense, Ticket, User, DailyBillingTotal
+from app.replica import read_only
+from app.time_expenses.filters import time_entry_filter_criteria, expense_filter_criteria, billing_total_filter_criteria
+from app.time_expenses.report import report_args, billing_totals, BillingReport
+from app.export import csv_response, stream_rows
+from app.pagination import keyset_paginate, per_page_from_request
+from sqlalchemy import func, and_, select
+from sqlalchemy.orm import joinedload
 
 @bp.route('/')
 @login_required
@@ -14,43 +19,12 @@ def index():
 
 @bp.route('/time')
 @login_required
+@read_only
 def time_entries():
     form = TimeExpenseFilterForm()
     
-    # Get filter parameters
-    user_id = request.args.get('user_id', type=int, default=0)
-    ticket_id = request.args.get('ticket_id', type=int, default=0)
-    date_from = request.args.get('date_from', type=str)
-    date_to = request.args.get('date_to', type=str)
-    billable_only = request.args.get('billable_only', type=bool, default=False)
-    
-    # Base query
-    query = TimeEntry.query
-    
-    # Apply filters
-    if user_id > 0:
-        query = query.filter(TimeEntry.user_id == user_id)
-    
-    if ticket_id > 0:
-        query = query.filter(TimeEntry.ticket_id == ticket_id)
-    
-    if date_from:
-        try:
-            from_date = datetime.strptime(date_from, '%Y-%m-%d')
-            query = query.filter(TimeEntry.start_time >= from_date)
-        except ValueError:
-            pass
-    
-    if date_to:
-        try:
-            to_date = datetime.strptime(date_to, '%Y-%m-%d')
-            to_date = to_date + timedelta(days=1)  # Include the entire day
-            query = query.filter(TimeEntry.start_time <= to_date)
-        except ValueError:
-            pass
-    
-    if billable_only:
-        query = query.filter(TimeEntry.billable == True)
+    # Apply the user, ticket, date and billable filters
+    query = TimeEntry.query.filter(*time_entry_filter_criteria(request.args))
     
     # Get time entries
     time_entries = query.order_by(TimeEntry.start_time.desc()).all()
@@ -61,13 +35,18 @@ def time_entries():
     minutes, seconds = divmod(remainder, 60)
     total_time = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
     
+    # Summaries come from the daily billing totals, with the same filters
+    rollup_criteria = billing_total_filter_criteria(request.args)
+    
     # Get summary by user
     user_summary = db.session.query(
-        TimeEntry.user_id,
+        DailyBillingTotal.user_id,
         User.first_name,
         User.last_name,
-        func.sum(TimeEntry.duration).label('total_duration')
-    ).join(User).group_by(TimeEntry.user_id, User.first_name, User.last_name).all()
+        func.sum(DailyBillingTotal.time_seconds).label('total_duration')
+    ).join(User, DailyBillingTotal.user_id == User.id).filter(*rollup_criteria).group_by(
+        DailyBillingTotal.user_id, User.first_name, User.last_name
+    ).having(func.sum(DailyBillingTotal.time_seconds) != 0).all()
     
     user_time_summary = []
     for summary in user_summary:
@@ -81,10 +60,12 @@ def time_entries():
     
     # Get summary by ticket
     ticket_summary = db.session.query(
-        TimeEntry.ticket_id,
+        DailyBillingTotal.ticket_id,
         Ticket.subject,
-        func.sum(TimeEntry.duration).label('total_duration')
-    ).join(Ticket).group_by(TimeEntry.ticket_id, Ticket.subject).all()
+        func.sum(DailyBillingTotal.time_seconds).label('total_duration')
+    ).join(Ticket, DailyBillingTotal.ticket_id == Ticket.id).filter(*rollup_criteria).group_by(
+        DailyBillingTotal.ticket_id, Ticket.subject
+    ).having(func.sum(DailyBillingTotal.time_seconds) != 0).all()
     
     ticket_time_summary = []
     for summary in ticket_summary:
@@ -104,6 +85,23 @@ def time_entries():
                           user_time_summary=user_time_summary,
                           ticket_time_summary=ticket_time_summary)
 
+@bp.route('/time/export.csv')
+@login_required
+@read_only
+def export_time_entries():
+    # Same filters as the time entry list, streamed as CSV
+    statement = (select(TimeEntry.id, TimeEntry.ticket_id, Ticket.subject, User.username,
+                        TimeEntry.start_time, TimeEntry.end_time, TimeEntry.duration,
+                        TimeEntry.billable, TimeEntry.notes)
+                 .outerjoin(Ticket, TimeEntry.ticket_id == Ticket.id)
+                 .outerjoin(User, TimeEntry.user_id == User.id)
+                 .where(*time_entry_filter_criteria(request.args))
+                 .order_by(TimeEntry.start_time.desc()))
+    return csv_response('time_entries.csv',
+                        ['ID', 'Ticket', 'Subject', 'User', 'Start', 'End', 'Duration (seconds)',
+                         'Billable', 'Notes'],
+                        stream_rows(statement))
+
 @bp.route('/time/create', methods=['GET', 'POST'])
 @login_required
 def create_time_entry():
@@ -201,39 +199,8 @@ def delete_time_entry(id):
 def expenses():
     form = TimeExpenseFilterForm()
     
-    # Get filter parameters
-    user_id = request.args.get('user_id', type=int, default=0)
-    ticket_id = request.args.get('ticket_id', type=int, default=0)
-    date_from = request.args.get('date_from', type=str)
-    date_to = request.args.get('date_to', type=str)
-    billable_only = request.args.get('billable_only', type=bool, default=False)
-    
-    # Base query
-    query = Expense.query
-    
-    # Apply filters
-    if user_id > 0:
-        query = query.filter(Expense.user_id == user_id)
-    
-    if ticket_id > 0:
-        query = query.filter(Expense.ticket_id == ticket_id)
-    
-    if date_from:
-        try:
-            from_date = datetime.strptime(date_from, '%Y-%m-%d').date()
-            query = query.filter(Expense.date >= from_date)
-        except ValueError:
-            pass
-    
-    if date_to:
-        try:
-            to_date = datetime.strptime(date_to, '%Y-%m-%d').date()
-            query = query.filter(Expense.date <= to_date)
-        except ValueError:
-            pass
-    
-    if billable_only:
-        query = query.filter(Expense.billable == True)
+    # Apply the user, ticket, date and billable filters
+    query = Expense.query.filter(*expense_filter_criteria(request.args))
     
     # Get expenses
     expenses = query.order_by(Expense.date.desc()).all()
@@ -241,35 +208,42 @@ def expenses():
     # Calculate total amount
     total_amount = sum([expense.amount for expense in expenses])
     
+    # Summaries come from the daily billing totals, with the same filters
+    rollup_criteria = billing_total_filter_criteria(request.args)
+    
     # Get summary by user
     user_summary = db.session.query(
-        Expense.user_id,
+        DailyBillingTotal.user_id,
         User.first_name,
         User.last_name,
-        func.sum(Expense.amount).label('total_amount')
-    ).join(User).group_by(Expense.user_id, User.first_name, User.last_name).all()
+        func.sum(DailyBillingTotal.expense_cents).label('total_cents')
+    ).join(User, DailyBillingTotal.user_id == User.id).filter(*rollup_criteria).group_by(
+        DailyBillingTotal.user_id, User.first_name, User.last_name
+    ).having(func.sum(DailyBillingTotal.expense_cents) != 0).all()
     
     user_expense_summary = []
     for summary in user_summary:
         user_expense_summary.append({
             'user_id': summary.user_id,
             'name': f"{summary.first_name} {summary.last_name}",
-            'total_amount': f"${summary.total_amount:.2f}"
+            'total_amount': f"${summary.total_cents / 100:.2f}"
         })
     
     # Get summary by ticket
     ticket_summary = db.session.query(
-        Expense.ticket_id,
+        DailyBillingTotal.ticket_id,
         Ticket.subject,
-        func.sum(Expense.amount).label('total_amount')
-    ).join(Ticket).group_by(Expense.ticket_id, Ticket.subject).all()
+        func.sum(DailyBillingTotal.expense_cents).label('total_cents')
+    ).join(Ticket, DailyBillingTotal.ticket_id == Ticket.id).filter(*rollup_criteria).group_by(
+        DailyBillingTotal.ticket_id, Ticket.subject
+    ).having(func.sum(DailyBillingTotal.expense_cents) != 0).all()
     
     ticket_expense_summary = []
     for summary in ticket_summary:
         ticket_expense_summary.append({
             'ticket_id': summary.ticket_id,
             'subject': summary.subject,
-            'total_amount': f"${summary.total_amount:.2f}"
+            'total_amount': f"${summary.total_cents / 100:.2f}"
         })
     
     return render_template('time_expenses/expenses.html',
@@ -280,6 +254,21 @@ def expenses():
                           user_expense_summary=user_expense_summary,
                           ticket_expense_summary=ticket_expense_summary)
 
+@bp.route('/expenses/export.csv')
+@login_required
+@read_only
+def export_expenses():
+    # Same filters as the expense list, streamed as CSV
+    statement = (select(Expense.id, Expense.date, Expense.ticket_id, Ticket.subject, User.username,
+                        Expense.amount, Expense.billable, Expense.description)
+                 .outerjoin(Ticket, Expense.ticket_id == Ticket.id)
+                 .outerjoin(User, Expense.user_id == User.id)
+                 .where(*expense_filter_criteria(request.args))
+                 .order_by(Expense.date.desc()))
+    return csv_response('expenses.csv',
+                        ['ID', 'Date', 'Ticket', 'Subject', 'User', 'Amount', 'Billable', 'Description'],
+                        stream_rows(statement))
+
 @bp.route('/expenses/create', methods=['GET', 'POST'])
 @login_required
 def create_expense():
@@ -354,121 +343,41 @@ def delete_expense(id):
 
 @bp.route('/report')
 @login_required
+@read_only
 def report():
     form = TimeExpenseFilterForm()
     
-    # Get filter parameters
-    user_id = request.args.get('user_id', type=int, default=0)
-    ticket_id = request.args.get('ticket_id', type=int, default=0)
-    date_from = request.args.get('date_from', type=str)
-    date_to = request.args.get('date_to', type=str)
-    billable_only = request.args.get('billable_only', type=bool, default=False)
-    
-    # Default to current month if no dates specified
-    if not date_from and not date_to:
-        today = datetime.today()
-        first_day = today.replace(day=1)
-        date_from = first_day.strftime('%Y-%m-%d')
-        date_to = today.strftime('%Y-%m-%d')
-    
-    # Time entries query
-    time_query = TimeEntry.query
-    
-    # Apply filters to time entries
-    if user_id > 0:
-        time_query = time_query.filter(TimeEntry.user_id == user_id)
-    
-    if ticket_id > 0:
-        time_query = time_query.filter(TimeEntry.ticket_id == ticket_id)
-    
-    if date_from:
-        try:
-            from_date = datetime.strptime(date_from, '%Y-%m-%d')
-            time_query = time_query.filter(TimeEntry.start_time >= from_date)
-        except ValueError:
-            pass
-    
-    if date_to:
-        try:
-            to_date = datetime.strptime(date_to, '%Y-%m-%d')
-            to_date = to_date + timedelta(days=1)  # Include the entire day
-            time_query = time_query.filter(TimeEntry.start_time <= to_date)
-        except ValueError:
-            pass
-    
-    if billable_only:
-        time_query = time_query.filter(TimeEntry.billable == True)
-    
-    # Expenses query
-    expense_query = Expense.query
-    
-    # Apply filters to expenses
-    if user_id > 0:
-        expense_query = expense_query.filter(Expense.user_id == user_id)
-    
-    if ticket_id > 0:
-        expense_query = expense_query.filter(Expense.ticket_id == ticket_id)
-    
-    if date_from:
-        try:
-            from_date = datetime.strptime(date_from, '%Y-%m-%d').date()
-            expense_query = expense_query.filter(Expense.date >= from_date)
-        except ValueError:
-            pass
-    
-    if date_to:
-        try:
-            to_date = datetime.strptime(date_to, '%Y-%m-%d').date()
-            expense_query = expense_query.filter(Expense.date <= to_date)
-        except ValueError:
-            pass
-    
-    if billable_only:
-        expense_query = expense_query.filter(Expense.billable == True)
-    
-    # Get time entries and expenses
-    time_entries = time_query.all()
-    expenses = expense_query.all()
-    
-    # Calculate totals
-    total_seconds = sum([entry.duration or 0 for entry in time_entries])
-    hours, remainder = divmod(total_seconds, 3600)
-    minutes, seconds = divmod(remainder, 60)
-    total_time = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-    
-    total_expenses = sum([expense.amount for expense in expenses])
-    
-    # Get summary by ticket
-    ticket_summary = []
-    tickets = set([entry.ticket_id for entry in time_entries] + [expense.ticket_id for expense in expenses])
-    
-    for ticket_id in tickets:
-        ticket = Ticket.query.get(ticket_id)
-        if ticket:
-            ticket_time_entries = [entry for entry in time_entries if entry.ticket_id == ticket_id]
-            ticket_expenses = [expense for expense in expenses if expense.ticket_id == ticket_id]
-            
-            total_ticket_seconds = sum([entry.duration or 0 for entry in ticket_time_entries])
-            hours, remainder = divmod(total_ticket_seconds, 3600)
-            minutes, seconds = divmod(remainder, 60)
-            ticket_time = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-            
-            total_ticket_expenses = sum([expense.amount for expense in ticket_expenses])
-            
-            ticket_summary.append({
-                'ticket_id': ticket_id,
-                'subject': ticket.subject,
-                'total_time': ticket_time,
-                'total_expenses': f"${total_ticket_expenses:.2f}"
-            })
+    # Default to the current month if no dates are specified
+    args = report_args(request.args)
+    
+    # Totals per ticket and user from one grouped query
+    report = BillingReport(billing_totals(args))
+    
+    # Individual entries are optional and paged (?details=time or ?details=expenses)
+    details = request.args.get('details')
+    page = None
+    if details == 'time':
+        query = (TimeEntry.query.filter(*time_entry_filter_criteria(args))
+                 .options(joinedload(TimeEntry.user), joinedload(TimeEntry.ticket)))
+        page = keyset_paginate(query, 'start', TimeEntry.start_time, TimeEntry.id,
+                               per_page=per_page_from_request('REPORT_DETAILS_PER_PAGE'),
+                               cursor=request.args.get('cursor'), nullable=True)
+    elif details == 'expenses':
+        query = (Expense.query.filter(*expense_filter_criteria(args))
+                 .options(joinedload(Expense.user), joinedload(Expense.ticket)))
+        page = keyset_paginate(query, 'date', Expense.date, Expense.id,
+                               per_page=per_page_from_request('REPORT_DETAILS_PER_PAGE'),
+                               cursor=request.args.get('cursor'), nullable=True)
     
     return render_template('time_expenses/report.html',
                           title='Time and Expense Report',
                           form=form,
-                          time_entries=time_entries,
-                          expenses=expenses,
-                          total_time=total_time,
-                          total_expenses=f"${total_expenses:.2f}",
-                          ticket_summary=ticket_summary,
-                          date_from=date_from,
-                          date_to=date_to)
+                          report=report,
+                          total_time=report.total_time,
+                          total_expenses=f"${report.total_amount:.2f}",
+                          ticket_summary=report.ticket_summary,
+                          user_summary=report.user_summary,
+                          details=details,
+                          page=page,
+                          date_from=args.get('date_from', ''),
+                          date_to=args.get('date_to', ''))
@@ -0,0 +1,233 @@
+"""
+In-memory prefix index for the quick-jump box.
+
+Tickets (by formatted and plain ID), assets (by serial number) and users
+(by username and email) are kept in one sorted array per process, so a
+lookup is a binary search followed by a short scan. The index is built at
+startup, patched after every commit that touches those models, and rebuilt
+in the background at a configurable interval to pick up writes made by
+other processes.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Ticket, Asset, User, Setting
+from app.settings.service import settings
+from app.permissions import Permission
+
+DEFAULT_TICKET_ID_FORMAT = 'HD-{id:06d}'
+
+# Keys not scoped to an owner live under this namespace
+GLOBAL = ''
+
+
+def owner_namespace(user_id):
+    return f'owner:{user_id}'
+
+
+def format_ticket_id(ticket_id, id_format):
+    try:
+        return id_format.format(id=ticket_id)
+    except (KeyError, IndexError, ValueError, AttributeError, TypeError):
+        # e.g. '{id.foo}' or '{id[0]}' on an int
+        return DEFAULT_TICKET_ID_FORMAT.format(id=ticket_id)
+
+
+def _normalize(value):
+    return value.strip().lower() if value else ''
+
+
+class Entry:
+    __slots__ = ('kind', 'id', 'label', 'detail', 'keys')
+
+    def __init__(self, kind, id, label, detail, keys):
+        self.kind = kind
+        self.id = id
+        self.label = label
+        self.detail = detail
+        # (namespace, normalized key) pairs the entry is found under
+        self.keys = tuple((namespace, _normalize(key)) for namespace, key in keys if key)
+
+
+def ticket_entry(ticket_id, subject, created_by, id_format):
+    formatted = format_ticket_id(ticket_id, id_format)
+    keys = [(GLOBAL, formatted), (GLOBAL, str(ticket_id))]
+    if created_by:
+        # Requesters search only their own tickets
+        keys += [(owner_namespace(created_by), formatted), (owner_namespace(created_by), str(ticket_id))]
+    return Entry('ticket', ticket_id, formatted, subject, keys)
+
+
+def asset_entry(asset_id, name, serial_number):
+    return Entry('asset', asset_id, serial_number or '', name, [(GLOBAL, serial_number)])
+
+
+def user_entry(user_id, username, email, first_name, last_name):
+    name = ' '.join(part for part in (first_name, last_name) if part)
+    return Entry('user', user_id, username or email or '', name or email, [(GLOBAL, username), (GLOBAL, email)])
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._keys = []      # sorted (namespace, key, kind, id)
+        self._entries = {}   # (kind, id) -> Entry
+        self._lock = threading.Lock()
+        self._replay = None  # changes made while a rebuild is loading
+        self.ticket_id_format = DEFAULT_TICKET_ID_FORMAT
+        self.built_at = None
+        self._rebuilding = False
+
+    def _remove(self, kind, entity_id):
+        entry = self._entries.pop((kind, entity_id), None)
+        if entry is None:
+            return
+        for namespace, key in entry.keys:
+            position = bisect_left(self._keys, (namespace, key, kind, entity_id))
+            if position < len(self._keys) and self._keys[position] == (namespace, key, kind, entity_id):
+                del self._keys[position]
+
+    def _put(self, entry):
+        self._remove(entry.kind, entry.id)
+        self._entries[(entry.kind, entry.id)] = entry
+        for namespace, key in entry.keys:
+            insort(self._keys, (namespace, key, entry.kind, entry.id))
+
+    def apply(self, changes):
+        """Apply ``('put', entry)`` / ``('remove', kind, id)`` changes."""
+        with self._lock:
+            if self._replay is not None:
+                self._replay.extend(changes)
+            for change in changes:
+                if change[0] == 'put':
+                    self._put(change[1])
+                else:
+                    self._remove(change[1], change[2])
+
+    def lookup(self, prefix, namespace=GLOBAL, limit=10):
+        """Up to ``limit`` entries with a key starting with ``prefix``, in key order."""
+        prefix = _normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self._lock:
+            position = bisect_left(self._keys, (namespace, prefix))
+            while position < len(self._keys) and len(results) < limit:
+                key_namespace, key, kind, entity_id = self._keys[position]
+                if key_namespace != namespace or not key.startswith(prefix):
+                    break
+                if (kind, entity_id) not in seen:
+                    seen.add((kind, entity_id))
+                    results.append(self._entries[(kind, entity_id)])
+                position += 1
+        return results
+
+    def rebuild(self):
+        """Reload every entry from the database."""
+        with self._lock:
+            self._replay = []
+        try:
+            id_format = settings.get('ticket_id_format') or DEFAULT_TICKET_ID_FORMAT
+            entries = [ticket_entry(*row, id_format) for row in db.session.execute(
+                select(Ticket.id, Ticket.subject, Ticket.created_by))]
+            entries += [asset_entry(*row) for row in db.session.execute(
+                select(Asset.id, Asset.name, Asset.serial_number).where(Asset.serial_number != None))]
+            entries += [user_entry(*row) for row in db.session.execute(
+                select(User.id, User.username, User.email, User.first_name, User.last_name))]
+        except Exception:
+            with self._lock:
+                self._replay = None
+            raise
+
+        keys = sorted((namespace, key, entry.kind, entry.id)
+                      for entry in entries for namespace, key in entry.keys)
+        with self._lock:
+            replay, self._replay = self._replay, None
+            self._keys = keys
+            self._entries = {(entry.kind, entry.id): entry for entry in entries}
+            self.ticket_id_format = id_format
+            self.built_at = time.monotonic()
+            # Commits that landed while loading may be missing from the snapshot
+            for change in replay:
+                if change[0] == 'put':
+                    self._put(change[1])
+                else:
+                    self._remove(change[1], change[2])
+
+    def refresh_if_stale(self, app):
+        """Start a background rebuild once the configured interval has passed."""
+        interval = app.config.get('TYPEAHEAD_REFRESH_INTERVAL', 300)
+        with self._lock:
+            if self._rebuilding or not interval or self.built_at is None:
+                return
+            if time.monotonic() - self.built_at < interval:
+                return
+            self._rebuilding = True
+
+        def refresh():
+            try:
+                with app.app_context():
+                    self.rebuild()
+            except Exception:
+                app.logger.exception('Error rebuilding the quick-jump index')
+            finally:
+                with self._lock:
+                    self._rebuilding = False
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+typeahead_index = PrefixIndex()
+
+
+def quick_jump(query, user, limit=10):
+    """Quick-jump matches for ``user``: requesters only see their own tickets."""
+    typeahead_index.refresh_if_stale(current_app._get_current_object())
+    if not user.can(Permission.VIEW_ALL_TICKETS):
+        return typeahead_index.lookup(query, owner_namespace(user.id), limit)
+    return typeahead_index.lookup(query, GLOBAL, limit)
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_typeahead_changes(session, flush_context):
+    changes = session.info.setdefault('typeahead_changes', [])
+    id_format = typeahead_index.ticket_id_format
+    for instance in list(session.new) + list(session.dirty):
+        if isinstance(instance, Ticket):
+            changes.append(('put', ticket_entry(instance.id, instance.subject, instance.created_by, id_format)))
+        elif isinstance(instance, Asset):
+            if instance.serial_number:
+                changes.append(('put', asset_entry(instance.id, instance.name, instance.serial_number)))
+            else:
+                changes.append(('remove', 'asset', instance.id))
+        elif isinstance(instance, User):
+            changes.append(('put', user_entry(instance.id, instance.username, instance.email,
+                                              instance.first_name, instance.last_name)))
+        elif isinstance(instance, Setting) and instance.key == 'ticket_id_format':
+            session.info['typeahead_rebuild'] = True
+    for instance in session.deleted:
+        if isinstance(instance, (Ticket, Asset, User)):
+            kind = {Ticket: 'ticket', Asset: 'asset', User: 'user'}[type(instance)]
+            changes.append(('remove', kind, instance.id))
+    if not changes:
+        session.info.pop('typeahead_changes')
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_typeahead_changes(session):
+    changes = session.info.pop('typeahead_changes', None)
+    if session.info.pop('typeahead_rebuild', False):
+        # Every ticket key depends on the ID format; reload on next lookup
+        typeahead_index.built_at = float('-inf')
+    if changes and typeahead_index.built_at is not None:
+        typeahead_index.apply(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_typeahead_changes(session):
+    session.info.pop('typeahead_changes', None)
+    session.info.pop('typeahead_rebuild', None)
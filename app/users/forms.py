@@ -1,7 +1,8 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, SelectField
 from wtforms.validators import DataRequired, Email, Length, EqualTo, ValidationError
-from app.models import User, Role
+from app.models import User
+from app.reference import reference
 
 class UserForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired(), Length(min=3, max=64)])
@@ -23,7 +24,7 @@ class UserForm(FlaskForm):
     
     def __init__(self, *args, **kwargs):
         super(UserForm, self).__init__(*args, **kwargs)
-        self.role_id.choices = [(r.id, r.name) for r in Role.query.all()]
+        self.role_id.choices = reference.role_choices()
     
     def validate_username(self, username):
         user = User.query.filter_by(username=username.data).first()
@@ -53,7 +54,7 @@ class EditUserForm(FlaskForm):
         super(EditUserForm, self).__init__(*args, **kwargs)
         self.original_username = original_username
         self.original_email = original_email
-        self.role_id.choices = [(r.id, r.name) for r in Role.query.all()]
+        self.role_id.choices = reference.role_choices()
     
     def validate_username(self, username):
         if username.data != self.original_username:
@@ -5,7 +5,7 @@ from app.users import bp
 from app.users.forms import UserForm, EditUserForm
 from app.models import User, Role, Ticket, TimeEntry
 from app.settings.routes import admin_required
-from sqlalchemy import func
+from app.rollups import agent_stats
 
 @bp.route('/')
 @login_required
@@ -46,13 +46,12 @@ def create():
 def view(id):
     user = User.query.get_or_404(id)
     
-    # Get user statistics
-    assigned_tickets_count = Ticket.query.filter_by(assigned_to=user.id).count()
-    open_tickets_count = Ticket.query.filter_by(assigned_to=user.id).join(Ticket.status).filter_by(is_closed=False).count()
+    # Get ticket and time tracking statistics from the per-agent rollup
+    stats = agent_stats(user.id)
+    assigned_tickets_count = stats.assigned_tickets
+    open_tickets_count = stats.open_tickets
     
-    # Get time tracking statistics
-    total_time = db.session.query(func.sum(TimeEntry.duration)).filter(TimeEntry.user_id == user.id).scalar() or 0
-    hours, remainder = divmod(total_time, 3600)
+    hours, remainder = divmod(stats.total_time, 3600)
     minutes, seconds = divmod(remainder, 60)
     formatted_total_time = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
     
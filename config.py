@@ -10,6 +10,39 @@ class Config:
         'sqlite:///' + os.path.join(os.path.abspath(os.path.dirname(__file__)), 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Optional read replica for the reporting, listing and search pages
+    REPLICA_DATABASE_URL = os.environ.get('REPLICA_DATABASE_URL')
+    SQLALCHEMY_BINDS = {'replica': REPLICA_DATABASE_URL} if REPLICA_DATABASE_URL else {}
+    REPLICA_MAX_LAG = int(os.environ.get('REPLICA_MAX_LAG', 30))  # Seconds behind before reads go to the primary
+    REPLICA_LAG_CHECK_INTERVAL = int(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', 5))
+    # Seconds between backup-API copies when both databases are SQLite (0 disables)
+    REPLICA_SYNC_INTERVAL = int(os.environ.get('REPLICA_SYNC_INTERVAL', 0))
+    
+    # Connection pool for server databases such as PostgreSQL (ignored for SQLite)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))  # Seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # Seconds before a connection is replaced
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes', 'on')
+    
+    # SQLite connection pragmas, by profile; SQLITE_PROFILE picks the one applied
+    # to every connection ('default' leaves SQLite's own settings alone)
+    SQLITE_PROFILES = {
+        'default': {},
+        'production': {
+            'journal_mode': 'WAL',      # readers don't block the writer or each other
+            'synchronous': 'NORMAL',    # durable at checkpoints; safe with WAL
+            'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # ms to wait for a lock
+            'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+            'cache_size': -int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024)),  # negative means KiB
+            'temp_store': 'MEMORY',
+        },
+    }
+    SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'production')
+    
+    # Seconds between background WAL checkpoints and PRAGMA optimize runs (0 disables)
+    SQLITE_MAINTENANCE_INTERVAL = int(os.environ.get('SQLITE_MAINTENANCE_INTERVAL', 600))
+    
     # Mail server configuration (to be configured by admin)
     MAIL_SERVER = os.environ.get('MAIL_SERVER', 'localhost')
     MAIL_PORT = int(os.environ.get('MAIL_PORT', 25))
@@ -22,5 +55,43 @@ class Config:
     # Application name (customizable in settings)
     APP_NAME = os.environ.get('APP_NAME', 'IT Helpdesk')
     
+    # Seconds a cached dashboard snapshot is served before it is refreshed in the background (0 disables)
+    DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 60))
+    
+    # Seconds between background passes that update the stored SLA state of tickets due a check (0 disables)
+    SLA_EVALUATION_INTERVAL = int(os.environ.get('SLA_EVALUATION_INTERVAL', 60))
+    SLA_EVALUATION_BATCH_SIZE = int(os.environ.get('SLA_EVALUATION_BATCH_SIZE', 500))
+    
+    # Tickets per batch when rewriting SLA due dates after priority targets change
+    SLA_RECALCULATION_BATCH_SIZE = int(os.environ.get('SLA_RECALCULATION_BATCH_SIZE', 1000))
+    
+    # Ticket list page sizes (?per_page= is capped at MAX_PER_PAGE)
+    TICKETS_PER_PAGE = int(os.environ.get('TICKETS_PER_PAGE', 50))
+    MAX_PER_PAGE = int(os.environ.get('MAX_PER_PAGE', 200))
+    
+    # Entries per page in the time and expense report's detail view
+    REPORT_DETAILS_PER_PAGE = int(os.environ.get('REPORT_DETAILS_PER_PAGE', 100))
+    
+    # Options returned per page by the user and asset picker endpoints
+    CHOICES_PER_PAGE = int(os.environ.get('CHOICES_PER_PAGE', 25))
+    
+    # Rows fetched from the database per batch while streaming a CSV export
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+    
+    # Seconds between background reloads of the quick-jump index, which picks up writes from other processes (0 disables)
+    TYPEAHEAD_REFRESH_INTERVAL = int(os.environ.get('TYPEAHEAD_REFRESH_INTERVAL', 300))
+    
+    # Number of rendered Markdown KB articles kept in memory (0 disables the cache)
+    KB_RENDER_CACHE_SIZE = int(os.environ.get('KB_RENDER_CACHE_SIZE', 256))
+    
+    # Seconds KB article views are buffered in memory before being written in one batch (0 writes every view)
+    KB_VIEW_FLUSH_INTERVAL = int(os.environ.get('KB_VIEW_FLUSH_INTERVAL', 30))
+    
+    # Seconds between checks of the shared version stamps that tell this process to reload cached settings
+    SETTINGS_VERSION_CHECK_INTERVAL = int(os.environ.get('SETTINGS_VERSION_CHECK_INTERVAL', 5))
+    
+    # Seconds the signed-in user and role are cached between requests (0 loads them on every request)
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 60))
+    
     # Session configuration
     PERMANENT_SESSION_LIFETIME = timedelta(days=1)